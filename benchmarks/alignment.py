@@ -0,0 +1,85 @@
+"""
+Parallel text yield of the frontier: crawls the synthetic site (benchmarks/site.py) with a --max-pages budget, once
+with each --frontier, and reports the pages stored whose translation in another locale was stored too (aligned
+pages) per 1000 pages rendered, from the stats.json of the runs.
+
+Run from the repository root as `python -m benchmarks.alignment`.
+
+Usage:
+  alignment.py [options] [--] [<scrawl_option>...]
+
+Options:
+  -h --help                    Shows this help.
+  --frontiers=<list>           --frontier settings to compare [default: random,priority].
+  --max-pages=<n>              Pages stored per run [default: 300].
+  --locales=<list>             Locales of the crawls, the languages whose pages are aligned [default: en,es].
+  --simultaneous-pages=<n>     --simultaneous-pages of the runs [default: 10].
+  --repeat=<n>                 Runs per setting, the median one is reported [default: 3].
+  --output=<file>              Also append the results to this file as JSON lines, to compare runs.
+  --keep                       Keep the working directories (and scrawl.log) of the runs, always kept if a run fails.
+  --pages=<n>                  Pages per language [default: 500].
+  --languages=<list>           Languages of the site [default: en,es,fr].
+  --fanout=<n>                 Links to other pages of the same language per page [default: 10].
+  --words=<n>                  Words of text per page [default: 300].
+  --duplicates=<ratio>         Pages whose text is the same as an earlier page [default: 0.05].
+  --near-duplicates=<ratio>    Pages whose text is an earlier page with a few words changed [default: 0.05].
+  --slow=<ratio>               Pages answered after --slow-delay seconds [default: 0].
+  --slow-delay=<seconds>       Delay of the slow pages [default: 2].
+  --js=<ratio>                 Pages whose content is only rendered by JavaScript [default: 0.1].
+  --seed=<n>                   Seed of the generator [default: 1].
+
+Any <scrawl_option> is passed to every run, after "--", e.g. `python -m benchmarks.alignment -- --engine=pool`.
+"""
+
+import json
+import os
+import tempfile
+import time
+
+import docopt
+
+from benchmarks import crawl, site as synthetic
+
+
+def per_1k(result):
+    return 1000 * (result["aligned_pages"] or 0) / result["renders"] if result["renders"] else 0.0
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    site = synthetic.from_options(args)
+    server, base_url = synthetic.serve(site)
+    slot_size = int(args["--simultaneous-pages"])
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seeds = os.path.join(tmp, "seeds.txt")
+        with open(seeds, "wt") as fseeds:
+            fseeds.write(f"{base_url}/{site.languages[0]}/0\n")
+
+        print(f"Site: {site.pages} pages x {len(site.languages)} languages on {base_url}; locales {args['--locales']}, "
+              f"{args['--max-pages']} pages per run")
+        print(f"{'frontier':>9} {'pages':>6} {'renders':>8} {'aligned':>8} {'aligned/1k renders':>19} {'seconds':>8}")
+        baseline = None
+        for frontier in [i.strip() for i in args["--frontiers"].split(",")]:
+            options = [f"--frontier={frontier}", f"--max-pages={args['--max-pages']}", *args["<scrawl_option>"]]
+            runs = [crawl.run("crawl", slot_size, seeds, args["--locales"], options, args["--keep"])
+                    for _ in range(int(args["--repeat"]))]
+            result = sorted(runs, key=per_1k)[len(runs) // 2]
+            if result["returncode"] != 0:
+                print(f"{frontier:>9} failed with exit code {result['returncode']}, see "
+                      f"{os.path.join(result['directory'], 'scrawl.log')}")
+                continue
+            baseline = baseline or per_1k(result)
+            print(f"{frontier:>9} {result['pages']:>6} {result['renders'] or 0:>8} {result['aligned_pages'] or 0:>8} "
+                  f"{per_1k(result):>10.1f} ({per_1k(result) / baseline if baseline else 0:>4.2f}x) "
+                  f"{result['seconds']:>8.1f}")
+            if args["--output"]:
+                with open(args["--output"], "at") as foutput:
+                    foutput.write(json.dumps({**result, "frontier": frontier, "per_1k_renders": per_1k(result),
+                                              "site": {i: args[f"--{i}"] for i in crawl.SITE_OPTIONS},
+                                              "scrawl_options": options, "time": time.time()}) + "\n")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
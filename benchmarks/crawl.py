@@ -0,0 +1,165 @@
+"""
+End-to-end benchmark: serves a synthetic site (benchmarks/site.py) locally and runs `scrawl crawl` and `scrawl
+download` against it for each --simultaneous-pages setting. Reports pages stored per second, p50/p99 latency of the
+browser navigations and of the plain HTTP fetches (from the stats.json of the run), peak memory of scrawl and its
+browsers, and bytes on disk of the stored pages.
+
+Run from the repository root as `python -m benchmarks.crawl`.
+
+Usage:
+  crawl.py [options] [--] [<scrawl_option>...]
+
+Options:
+  -h --help                    Shows this help.
+  --modes=<list>               scrawl commands to measure: crawl, download [default: crawl,download].
+  --simultaneous-pages=<list>  --simultaneous-pages settings [default: 1,5,10,20].
+  --locales=<list>             Locales of the crawls [default: en].
+  --repeat=<n>                 Runs per setting, the median one is reported [default: 1].
+  --output=<file>              Also append the results to this file as JSON lines, to compare runs.
+  --keep                       Keep the working directories (and scrawl.log) of the runs, always kept if a run fails.
+  --pages=<n>                  Pages per language [default: 500].
+  --languages=<list>           Languages of the site [default: en,es,fr].
+  --fanout=<n>                 Links to other pages of the same language per page [default: 10].
+  --words=<n>                  Words of text per page [default: 300].
+  --duplicates=<ratio>         Pages whose text is the same as an earlier page [default: 0.05].
+  --near-duplicates=<ratio>    Pages whose text is an earlier page with a few words changed [default: 0.05].
+  --slow=<ratio>               Pages answered after --slow-delay seconds [default: 0.02].
+  --slow-delay=<seconds>       Delay of the slow pages [default: 2].
+  --js=<ratio>                 Pages whose content is only rendered by JavaScript [default: 0.1].
+  --seed=<n>                   Seed of the generator [default: 1].
+
+Any <scrawl_option> is passed to every run, after "--", e.g. `python -m benchmarks.crawl -- --fetch=hybrid`.
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import docopt
+
+from benchmarks import site as synthetic
+from scrawl import supervisor
+
+# seconds between two memory samples of a run
+SAMPLE_INTERVAL = 0.2
+SITE_OPTIONS = ("pages", "languages", "fanout", "words", "duplicates", "near-duplicates", "slow", "slow-delay", "js",
+                "seed")
+
+
+def directory_size(path):
+    size = 0
+    for root, _, files in os.walk(path):
+        for i in files:
+            try:
+                size += os.path.getsize(os.path.join(root, i))
+            except OSError:
+                pass
+    return size
+
+
+def run(mode, slot_size, url_file, locales, extra_options, keep):
+    """
+    Runs scrawl once and returns its measures. The memory of the run is that of every process whose command line
+    contains its working directory (scrawl itself) and of their descendants (the browsers).
+    """
+    workdir = tempfile.mkdtemp(prefix=f"scrawl-bench-{mode}-{slot_size}-")
+    destination = os.path.join(workdir, "out")
+    command = [sys.executable, "-m", "scrawl.main", mode, f"--simultaneous-pages={slot_size}", "--loglevel=warning",
+               *extra_options]
+    if mode == "crawl":
+        command += [locales, "file", url_file, destination]
+    else:
+        command += ["file", url_file, destination]
+
+    peak_rss = 0
+    finished = threading.Event()
+
+    def sample():
+        nonlocal peak_rss
+        while not finished.wait(SAMPLE_INTERVAL):
+            peak_rss = max(peak_rss, supervisor.process_tree_rss(destination) or 0)
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    with open(os.path.join(workdir, "scrawl.log"), "wb") as flog:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=flog, stderr=subprocess.STDOUT)
+        sampler.start()
+        process.wait()
+    seconds = time.perf_counter() - start
+    finished.set()
+    sampler.join()
+
+    try:
+        with open(os.path.join(destination, "stats.json"), "rt") as fstats:
+            stats = json.load(fstats)
+    except FileNotFoundError:
+        stats = {}
+    stored = sum(stats.get("counters", {}).get("pages_stored", {}).values())
+    stages = stats.get("stages", {})
+    result = {"mode": mode, "simultaneous_pages": slot_size, "returncode": process.returncode,
+              "seconds": round(seconds, 3), "pages": stored, "pages_per_second": round(stored / seconds, 3),
+              "skipped": stats.get("counters", {}).get("pages_skipped", {}),
+              "goto_p50": stages.get("goto", {}).get("p50"), "goto_p99": stages.get("goto", {}).get("p99"),
+              "http_p50": stages.get("http_fetch", {}).get("p50"), "http_p99": stages.get("http_fetch", {}).get("p99"),
+              "peak_rss": peak_rss, "disk_bytes": directory_size(os.path.join(destination, "json")),
+              "aligned_pages": stats.get("gauges", {}).get("aligned_pages"),
+              "renders": stats.get("gauges", {}).get("renders")}
+    if keep or process.returncode != 0:
+        result["directory"] = workdir
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+
+def milliseconds(seconds):
+    if seconds is None:
+        return "-"
+    return "inf" if seconds == float("inf") else f"{seconds * 1000:.0f}"
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    site = synthetic.from_options(args)
+    server, base_url = synthetic.serve(site)
+    extra_options = args["<scrawl_option>"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        seeds = os.path.join(tmp, "seeds.txt")
+        with open(seeds, "wt") as fseeds:
+            fseeds.write(f"{base_url}/{site.languages[0]}/0\n")
+        every_page = os.path.join(tmp, "urls.txt")
+        with open(every_page, "wt") as furls:
+            furls.writelines(f"{i}\n" for i in site.urls(base_url))
+
+        print(f"Site: {site.pages} pages x {len(site.languages)} languages on {base_url}; "
+              f"scrawl options: {' '.join(extra_options) or 'none'}")
+        print(f"{'mode':>8} {'slots':>5} {'pages':>6} {'seconds':>8} {'pages/s':>8} {'goto p50/p99 ms':>16} "
+              f"{'http p50/p99 ms':>16} {'peak MiB':>9} {'disk MiB':>9}")
+        for mode in [i.strip() for i in args["--modes"].split(",")]:
+            for slot_size in [int(i) for i in args["--simultaneous-pages"].split(",")]:
+                runs = [run(mode, slot_size, seeds if mode == "crawl" else every_page, args["--locales"],
+                            extra_options, args["--keep"]) for _ in range(int(args["--repeat"]))]
+                result = sorted(runs, key=lambda i: i["pages_per_second"])[len(runs) // 2]
+                if result["returncode"] != 0:
+                    print(f"{mode:>8} {slot_size:>5} failed with exit code {result['returncode']}, see "
+                          f"{os.path.join(result['directory'], 'scrawl.log')}")
+                print(f"{mode:>8} {slot_size:>5} {result['pages']:>6} {result['seconds']:>8.1f} "
+                      f"{result['pages_per_second']:>8.2f} "
+                      f"{milliseconds(result['goto_p50']) + '/' + milliseconds(result['goto_p99']):>16} "
+                      f"{milliseconds(result['http_p50']) + '/' + milliseconds(result['http_p99']):>16} "
+                      f"{result['peak_rss'] / 2**20:>9.0f} {result['disk_bytes'] / 2**20:>9.2f}")
+                if args["--output"]:
+                    with open(args["--output"], "at") as foutput:
+                        options = {i: args[f"--{i}"] for i in SITE_OPTIONS}
+                        foutput.write(json.dumps({**result, "site": options, "scrawl_options": extra_options,
+                                                  "time": time.time()}) + "\n")
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Compression ratio and throughput of stored pages with plain zstd and with a zstd dictionary trained per host on its
+first pages, as the crawler does with --dictionary-samples. Pages are read from the json/ directory of a crawl.
+
+Run from the repository root as `python -m benchmarks.dictionary`.
+
+Usage:
+  dictionary.py [options] <json_directory>
+
+Options:
+  -h --help              Shows this help.
+  --samples=<n>          Pages per host used to train the dictionary [default: 200].
+"""
+
+import json
+import time
+from urllib.parse import urlparse
+
+import docopt
+import zstandard
+
+from scrawl import output, storage
+
+
+def measure(cctx, pages):
+    raw = compressed = 0
+    start = time.perf_counter()
+    for i in pages:
+        raw += len(i)
+        compressed += len(cctx.compress(i))
+    return raw, compressed, time.perf_counter() - start
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    samples = int(args["--samples"])
+
+    by_host = {}
+    for obj in output.iter_records(args["<json_directory>"]):
+        by_host.setdefault(urlparse(obj["url"]).netloc, []).append(f"{json.dumps(obj)}\n".encode("utf-8"))
+
+    totals = {"plain": [0, 0, 0.0], "dictionary": [0, 0, 0.0]}
+    for host, pages in by_host.items():
+        if len(pages) <= samples:
+            print(f"{host}: only {len(pages)} pages, skipped")
+            continue
+        dictionary = zstandard.train_dictionary(storage.DICTIONARY_SIZE, pages[:samples])
+        for kind, cctx in (("plain", zstandard.ZstdCompressor()),
+                           ("dictionary", zstandard.ZstdCompressor(dict_data=dictionary))):
+            raw, compressed, seconds = measure(cctx, pages[samples:])
+            totals[kind][0] += raw
+            totals[kind][1] += compressed
+            totals[kind][2] += seconds
+
+    for kind, (raw, compressed, seconds) in totals.items():
+        if raw > 0:
+            print(f"{kind:>10}: {raw / 2**20:.1f} MiB -> {compressed / 2**20:.2f} MiB, "
+                  f"ratio {raw / compressed:.2f}, {raw / 2**20 / seconds:.1f} MiB/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""
+Check of the hybrid fetch mode against a local http.server serving a temporary directory: static pages have to be
+stored without a browser, pages rendered by JavaScript and missing pages have to go to the browser, and anything
+that is not HTML has to be skipped. Exits with status 1 if any verdict of fetcher.HttpFetcher is not the expected one.
+
+Run from the repository root as `python -m benchmarks.fetcher`.
+
+Usage:
+  fetcher.py [options]
+
+Options:
+  -h --help              Shows this help.
+"""
+
+import asyncio
+import functools
+import gzip
+import http.server
+import os
+import sys
+import tempfile
+import threading
+
+import docopt
+
+from scrawl import fetcher
+
+TEXT = "Scrawl fetches this page over plain HTTP because all of its text is already in the HTML. " * 5
+# file name -> (content, expected verdict, what the file stands for)
+FILES = {
+    "static.html": (f'<!doctype html><html lang="en"><head><title>Static</title>'
+                    f'<link rel="alternate" hreflang="es" href="/es/static.html"></head>'
+                    f'<body><h1>Static</h1><p>{TEXT}</p><a href="/other.html">other</a></body></html>',
+                    "static", "server-rendered page"),
+    "spa.html": ('<!doctype html><html><head><title>App</title><script src="/app.js"></script></head>'
+                 f'<body><div id="root"></div><footer>{TEXT}</footer></body></html>',
+                 "render", "empty framework mount point"),
+    "shell.html": ('<!doctype html><html><head><title>Shell</title></head>'
+                   '<body><script>document.body.innerHTML = "<p>late</p>";</script></body></html>',
+                   "render", "no visible text"),
+    "sniffed": (f"<!doctype html><html><body><p>{TEXT}</p></body></html>", "static",
+                "HTML served as application/octet-stream"),
+    "notes.txt": (TEXT, "skip", "text/plain"),
+    "page.html.gz": (gzip.compress(f"<html><body><p>{TEXT}</p></body></html>".encode("utf-8")), "skip",
+                     "gzip file"),
+    "image.png": (bytes.fromhex("89504e470d0a1a0a0000000d49484452"), "skip", "image"),
+    "binary": (bytes(range(256)), "skip", "binary served as application/octet-stream"),
+}
+# not in the directory: answered with an HTML error page
+MISSING = {"missing.html": "render"}
+
+
+def serve(directory):
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+async def fetch_all(base_url, names):
+    client = fetcher.HttpFetcher()
+    try:
+        return [await client.fetch(f"{base_url}/{i}", "en") for i in names]
+    finally:
+        await client.close()
+
+
+def main():
+    docopt.docopt(__doc__)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, (content, _, _) in FILES.items():
+            with open(os.path.join(tmp, name), "wb") as f:
+                f.write(content.encode("utf-8") if isinstance(content, str) else content)
+        server, base_url = serve(tmp)
+        try:
+            expected = {**{i: v for i, (_, v, _) in FILES.items()}, **MISSING}
+            results = asyncio.run(fetch_all(base_url, list(expected)))
+        finally:
+            server.shutdown()
+
+    failures = 0
+    print(f"{'file':>14} {'expected':>9} {'verdict':>9}  notes")
+    for (name, verdict), (found, url, snapshot) in zip(expected.items(), results):
+        notes = FILES[name][2] if name in FILES else "404"
+        if found == "static":
+            # what the crawler stores: text to hash, links to follow
+            notes += f", {len(snapshot['text'])} chars of text, {len(snapshot['links'])} links, " \
+                     f"{len(snapshot['alternates'])} alternates"
+            if not snapshot["text"].strip() or not snapshot["html"]:
+                found = "empty"
+        ok = found == verdict
+        failures += not ok
+        print(f"{name:>14} {verdict:>9} {found:>9}  {notes}{'' if ok else '  <- FAILED'}")
+    print(f"{len(expected) - failures}/{len(expected)} verdicts as expected")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
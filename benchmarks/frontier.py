@@ -0,0 +1,85 @@
+"""
+Micro-benchmark of the crawl queue: the list-based link_queue of the original batch loop (random.sample +
+np.delete + list(set(...))) against crawler.Frontier. Each batch pops `slot_size` URLs and enqueues `fanout`
+links per page, half of them already known.
+
+Run from the repository root as `python -m benchmarks.frontier`.
+
+Usage:
+  frontier.py [options] [<size>...]
+
+Options:
+  -h --help              Shows this help.
+  --batches=<n>          Batches measured per size [default: 20].
+  --slot-size=<n>        URLs popped per batch [default: 10].
+  --fanout=<n>           Links enqueued per popped URL [default: 20].
+
+Requires numpy, which the crawler itself no longer uses. Default sizes: 10000 100000 1000000.
+"""
+
+import random
+import time
+
+import docopt
+import numpy as np
+
+from scrawl.crawler import Frontier
+
+
+def make_urls(n, prefix="https://example.com/page"):
+    return [f"{prefix}/{i}" for i in range(n)]
+
+
+def new_links(batch, fanout, size):
+    # half of the discovered links are already queued, half are new
+    return [f"https://example.com/page/{random.randrange(size)}" if k % 2 == 0
+            else f"https://example.com/new/{batch}/{k}" for k in range(fanout)]
+
+
+def bench_list(size, batches, slot_size, fanout):
+    link_queue = make_urls(size)
+    visited = set()
+    start = time.perf_counter()
+    for b in range(batches):
+        indices = random.sample(range(len(link_queue)), min(len(link_queue), slot_size))
+        next_urls = [link_queue[n] for n in indices]
+        for u in next_urls:
+            visited.add(u)
+            for link in new_links(b, fanout, size):
+                if link not in visited:
+                    link_queue.append(link)
+        link_queue = list(np.delete(link_queue, indices))
+        link_queue = list(set(link_queue))
+    return (time.perf_counter() - start) / batches
+
+
+def bench_frontier(size, batches, slot_size, fanout):
+    visited = set()
+    frontier = Frontier(make_urls(size), visited)
+    start = time.perf_counter()
+    for b in range(batches):
+        next_urls = [frontier.pop_random() for _ in range(slot_size)]
+        for u in next_urls:
+            visited.add(u)
+            frontier.done(u)
+            for link in new_links(b, fanout, size):
+                frontier.add(link)
+    return (time.perf_counter() - start) / batches
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    sizes = [int(i) for i in args["<size>"]] or [10000, 100000, 1000000]
+    batches = int(args["--batches"])
+    slot_size = int(args["--slot-size"])
+    fanout = int(args["--fanout"])
+
+    print(f"{'size':>10} {'list ms/batch':>15} {'Frontier ms/batch':>18} {'speedup':>9}")
+    for size in sizes:
+        t_list = bench_list(size, batches, slot_size, fanout)
+        t_frontier = bench_frontier(size, batches, slot_size, fanout)
+        print(f"{size:>10} {t_list * 1000:>15.3f} {t_frontier * 1000:>18.3f} {t_list / t_frontier:>8.0f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of host filtering: the original is_valid_host, which recomputed the domain of every valid host on each
+call, against tools.HostMatcher, over a synthetic link corpus shaped like crawled pages (links to the seed sites and
+their subdomains, to external sites, and mailto:/javascript:/tel: links).
+
+Run from the repository root as `python -m benchmarks.hosts`.
+
+Usage:
+  hosts.py [options]
+
+Options:
+  -h --help              Shows this help.
+  --hosts=<n>            Number of seed hosts [default: 300].
+  --links=<n>            Number of links in the corpus [default: 20000].
+"""
+
+import random
+import re
+import time
+
+import docopt
+from tld import get_tld
+
+from scrawl import tools
+
+EXTERNAL = ["facebook.com", "twitter.com", "www.youtube.com", "www.linkedin.com", "www.google.com", "t.co",
+            "instagram.com", "bbc.co.uk", "en.wikipedia.org", "cdn.jsdelivr.net"]
+SUFFIXES = ["com", "es", "fr", "de", "co.uk", "com.br", "org", "eu"]
+
+
+def legacy_is_valid_host(valid_hosts, url2, patterns):
+    try:
+        if re.match(r"^mailto:", url2):
+            return False
+        valid_domains = {get_tld(i, as_object=True, fix_protocol=True).domain for i in valid_hosts}
+        url2_domain = get_tld(url2, as_object=True, fix_protocol=True).domain
+
+    except:
+        return False
+
+    return url2_domain in valid_domains and any(i in url2 for i in patterns)
+
+
+def make_corpus(hosts, n):
+    links = []
+    for i in range(n):
+        r = random.random()
+        if r < 0.7:
+            host = random.choice(hosts)
+            sub = random.choice(["", "www.", "blog.", "shop."])
+            links.append(f"https://{sub}{host}/section/{random.randrange(1000)}/page-{i}.html?ref={i % 7}")
+        elif r < 0.9:
+            links.append(f"https://{random.choice(EXTERNAL)}/share?u={i}")
+        else:
+            links.append(random.choice([f"mailto:info{i}@example.com", "javascript:void(0)", f"tel:+34{i:09d}"]))
+    return links
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    hosts = [f"site{i}.{random.choice(SUFFIXES)}" for i in range(int(args["--hosts"]))]
+    corpus = make_corpus(hosts, int(args["--links"]))
+
+    start = time.perf_counter()
+    legacy = [legacy_is_valid_host(hosts, i, [""]) for i in corpus]
+    t_legacy = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = tools.HostMatcher(hosts)
+    matched = [matcher.is_valid(i, [""]) for i in corpus]
+    t_matcher = time.perf_counter() - start
+
+    assert legacy == matched
+    print(f"{len(corpus)} links, {len(hosts)} hosts, {sum(matched)} valid")
+    print(f"is_valid_host: {t_legacy * 1e6 / len(corpus):10.2f} us/link")
+    print(f"HostMatcher:   {t_matcher * 1e6 / len(corpus):10.2f} us/link ({t_legacy / t_matcher:.0f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""
+Per-page link processing time: the original filter_urls (is_valid_host, sanitize_url and two FORBIDDEN_DOCUMENTS
+regex scans per link) against the single pass tools.UrlFilter, on synthetic pages with thousands of anchors. Both
+use the same HostMatcher, so only the pipeline differs.
+
+Run from the repository root as `python -m benchmarks.links`.
+
+Usage:
+  links.py [options]
+
+Options:
+  -h --help              Shows this help.
+  --anchors=<n>          Anchors per page [default: 3000].
+  --pages=<n>            Pages measured [default: 20].
+"""
+
+import random
+import re
+import time
+from urllib.parse import urlparse
+
+import docopt
+
+from scrawl import tools
+
+FORBIDDEN_DOCUMENTS = (r"(.| )+\.(pdf|pptx?|xlsx?|docx?|ods|odt|odf|odp|css|rss|js|jpeg|jpg|gif|webm|webp|tiff|ps|gz|png|"
+                       r"mp3|mp4|ogg|wav|aif|cda|mid|midi|wma|wpl|7z|arj|zip|gz|gzip|tar|rar|pkg|deb|rpm|z|bin|dmg|"
+                       r"iso|toast|vcd|csv|dat|db|dbf|sql|sav|mdb|ttf|otf|fon|fnt|ai|bmp|ico|psd|scr|svg|tif|key|3g2|"
+                       r"3gp|mkv|avi|flv|h264|m4v|mov|mpg|mpeg|rm|swf|vob|wmv|rtf|wpd|wsdl|xsd)$")
+
+
+def legacy_sanitize_url(url):
+    o = urlparse(url)
+    path = re.sub(r"[/]+", "/", o.path)
+    query = ""
+    if o.query != "":
+        query = f"?{o.query}"
+
+    return f"{o.scheme}://{o.netloc}{path}{query}".split("#")[0]
+
+
+def legacy_filter_urls(urls, links, valid_hosts, patterns):
+    links_filtered = [legacy_sanitize_url(n) for n in (urls + links) if tools.is_valid_host(valid_hosts, n, patterns)]
+
+    l2 = []
+    for i in links_filtered:
+        if re.match(FORBIDDEN_DOCUMENTS, i, re.IGNORECASE|re.DOTALL):
+            l2.append(i)
+
+    links_filtered2 = [i.split("#")[0] for i in links_filtered
+                       if not re.match(FORBIDDEN_DOCUMENTS, i, re.IGNORECASE|re.DOTALL)]
+
+    return list(set(links_filtered2)), l2
+
+
+def make_page(n):
+    links = []
+    for i in range(n):
+        r = random.random()
+        if r < 0.75:
+            sub = random.choice(["", "www.", "blog."])
+            path = random.choice(["/news//2024/", "/es/productos/", "/fr/produits/", "/en/products/"])
+            links.append(f"https://{sub}example.com{path}item-{random.randrange(5000)}-with-a-rather-long-slug-"
+                         f"for-seo-purposes{random.choice(['', '.html', '.pdf', '.jpg', '?page=2', '#top'])}")
+        elif r < 0.92:
+            links.append(f"https://{random.choice(['facebook.com', 'twitter.com', 'example.org'])}/share?u={i}")
+        else:
+            links.append(random.choice([f"mailto:info{i}@example.com", "javascript:void(0)", f"tel:+34{i:09d}"]))
+    return links
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    pages = [make_page(int(args["--anchors"])) for _ in range(int(args["--pages"]))]
+    matcher = tools.HostMatcher({"example.com"})
+    url_filter = tools.UrlFilter(matcher, [""])
+
+    start = time.perf_counter()
+    legacy = [legacy_filter_urls([], i, matcher, [""]) for i in pages]
+    t_legacy = (time.perf_counter() - start) / len(pages)
+
+    start = time.perf_counter()
+    single_pass = [url_filter.filter(i) for i in pages]
+    t_single_pass = (time.perf_counter() - start) / len(pages)
+
+    assert all(sorted(a[0]) == sorted(b[0]) and a[1] == b[1] for a, b in zip(legacy, single_pass))
+    print(f"{len(pages)} pages of {args['--anchors']} anchors")
+    print(f"filter_urls (legacy): {t_legacy * 1000:8.2f} ms/page")
+    print(f"UrlFilter:            {t_single_pass * 1000:8.2f} ms/page ({t_legacy / t_single_pass:.1f}x)")
+    url_filter.report()
+
+
+if __name__ == '__main__':
+    main()
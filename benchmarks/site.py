@@ -0,0 +1,191 @@
+"""
+Synthetic multi-language site for offline benchmarks, served from a local HTTP server. Every page exists in each
+language under /<lang>/<n>, links to `fanout` other pages of its language and to its translations (<link
+rel="alternate" hreflang>), and some pages are exact duplicates, near-duplicates, slow or rendered by JavaScript.
+The site is generated from the seed, so two runs with the same options crawl the same pages.
+
+Run from the repository root as `python -m benchmarks.site` to serve it until interrupted.
+
+Usage:
+  site.py [options]
+
+Options:
+  -h --help                  Shows this help.
+  --port=<n>                 Port to listen on, 0 for any [default: 8000].
+  --pages=<n>                Pages per language [default: 500].
+  --languages=<list>         Languages of the site [default: en,es,fr].
+  --fanout=<n>               Links to other pages of the same language per page [default: 10].
+  --words=<n>                Words of text per page [default: 300].
+  --duplicates=<ratio>       Pages whose text is the same as an earlier page [default: 0.05].
+  --near-duplicates=<ratio>  Pages whose text is an earlier page with a few words changed [default: 0.05].
+  --slow=<ratio>             Pages answered after --slow-delay seconds [default: 0.02].
+  --slow-delay=<seconds>     Delay of the slow pages [default: 2].
+  --js=<ratio>               Pages whose content is only rendered by JavaScript [default: 0.1].
+  --seed=<n>                 Seed of the generator [default: 1].
+"""
+
+import html
+import http.server
+import json
+import random
+import threading
+import time
+
+import docopt
+
+SYLLABLES = ("ka", "lo", "mi", "ne", "su", "ta", "ri", "po", "de", "an", "el", "or", "is", "um", "ve", "ch", "qu", "za")
+# 1x1 transparent PNG, for the <img> of every page (blocked by default with --block-resources)
+PIXEL = bytes.fromhex("89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+                      "1f15c4890000000d49444154789c6360000002000001e221bc330000000049454e44ae426082")
+
+
+class SyntheticSite:
+    """
+    Deterministic synthetic site. Pages are generated on request, so memory does not grow with the site size.
+    """
+    def __init__(self, pages=500, languages=("en", "es", "fr"), fanout=10, words=300, duplicates=0.05,
+                 near_duplicates=0.05, slow=0.02, slow_delay=2.0, js=0.1, seed=1):
+        self.pages = pages
+        self.languages = list(languages)
+        self.fanout = fanout
+        self.words = words
+        self.slow_delay = slow_delay
+        self.seed = seed
+        self.vocabulary = {lang: self.make_vocabulary(lang) for lang in self.languages}
+
+        # the kind of every page is shared by all its translations
+        rng = random.Random(seed)
+        self.kinds = []
+        for n in range(pages):
+            r = rng.random()
+            if n == 0:
+                self.kinds.append(("normal", None))
+            elif r < duplicates:
+                self.kinds.append(("duplicate", rng.randrange(n)))
+            elif r < duplicates + near_duplicates:
+                self.kinds.append(("near_duplicate", rng.randrange(n)))
+            elif r < duplicates + near_duplicates + slow:
+                self.kinds.append(("slow", None))
+            elif r < duplicates + near_duplicates + slow + js:
+                self.kinds.append(("js", None))
+            else:
+                self.kinds.append(("normal", None))
+
+    def make_vocabulary(self, lang):
+        rng = random.Random(f"{self.seed}-{lang}")
+        return ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 4))) for _ in range(2000)]
+
+    def text(self, lang, n):
+        kind, original = self.kinds[n]
+        if kind == "duplicate":
+            return self.text(lang, original)
+        if kind == "near_duplicate":
+            words = self.text(lang, original).split(" ")
+            rng = random.Random(f"{self.seed}-{lang}-{n}")
+            for i in rng.sample(range(len(words)), min(len(words), 3)):
+                words[i] = rng.choice(self.vocabulary[lang])
+            return " ".join(words)
+        rng = random.Random(f"{self.seed}-{lang}-{n}")
+        return " ".join(rng.choice(self.vocabulary[lang]) for _ in range(self.words))
+
+    def links(self, n):
+        # the next page keeps the whole site reachable from the first one
+        rng = random.Random(f"{self.seed}-links-{n}")
+        return [(n + 1) % self.pages] + [rng.randrange(self.pages) for _ in range(self.fanout - 1)]
+
+    def urls(self, base_url):
+        return [f"{base_url}/{lang}/{n}" for lang in self.languages for n in range(self.pages)]
+
+    def is_slow(self, n):
+        return self.kinds[n][0] == "slow"
+
+    def page(self, lang, n):
+        text = self.text(lang, n)
+        # copies also have the heading and links of their original, so that their whole body text is (nearly) equal
+        kind, original = self.kinds[n]
+        origin = original if kind in ("duplicate", "near_duplicate") else n
+        heading = html.escape(" ".join(text.split(" ")[:4]))
+        paragraphs = "".join(f"<p>{html.escape(text[i:i + 400])}</p>" for i in range(0, len(text), 400))
+        links = "".join(f'<li><a href="/{lang}/{i}">{html.escape(self.vocabulary[lang][i % 2000])}</a></li>'
+                        for i in self.links(origin))
+        switcher = "".join(f'<a href="/{i}/{n}">{i}</a> ' for i in self.languages if i != lang)
+        content = f'<h1>{heading}</h1>{paragraphs}<img src="/img/{n}.png" alt=""><ul>{links}</ul>'
+        if self.kinds[n][0] == "js":
+            script = json.dumps(content).replace("</", "<\\/")
+            body = f'<div id="root"></div><script>document.getElementById("root").innerHTML = {script};</script>'
+        else:
+            body = content
+        alternates = "".join(f'<link rel="alternate" hreflang="{i}" href="/{i}/{n}">' for i in self.languages)
+        return (f'<!doctype html><html lang="{lang}"><head><meta charset="utf-8"><title>{lang} {n}</title>'
+                f'{alternates}</head><body><nav>{switcher}</nav>{body}</body></html>')
+
+
+def make_handler(site):
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            path = self.path.split("?")[0].split("#")[0].strip("/").split("/")
+            if len(path) == 2 and path[0] == "img":
+                self.answer(200, "image/png", PIXEL)
+            elif len(path) == 2 and path[0] in site.languages and path[1].isdigit() and int(path[1]) < site.pages:
+                lang, n = path[0], int(path[1])
+                if site.is_slow(n):
+                    time.sleep(site.slow_delay)
+                self.answer(200, "text/html; charset=utf-8", site.page(lang, n).encode("utf-8"))
+            elif path == [""]:
+                self.send_response(302)
+                self.send_header("Location", f"/{site.languages[0]}/0")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            else:
+                self.answer(404, "text/plain", b"not found")
+
+        def answer(self, status, content_type, body):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(site, port=0, host="127.0.0.1"):
+    """
+    Serves `site` from a background thread. Returns the server (call shutdown() to stop it) and its base URL.
+    """
+    server = http.server.ThreadingHTTPServer((host, port), make_handler(site))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+
+def from_options(args):
+    return SyntheticSite(pages=int(args["--pages"]), languages=[i.strip() for i in args["--languages"].split(",")],
+                         fanout=int(args["--fanout"]), words=int(args["--words"]),
+                         duplicates=float(args["--duplicates"]), near_duplicates=float(args["--near-duplicates"]),
+                         slow=float(args["--slow"]), slow_delay=float(args["--slow-delay"]), js=float(args["--js"]),
+                         seed=int(args["--seed"]))
+
+
+def main():
+    args = docopt.docopt(__doc__)
+    site = from_options(args)
+    server, base_url = serve(site, int(args["--port"]))
+    kinds = {}
+    for kind, _ in site.kinds:
+        kinds[kind] = kinds.get(kind, 0) + 1
+    print(f"Serving {site.pages} pages x {len(site.languages)} languages on {base_url}/ "
+          f"({', '.join(f'{k}={v}' for k, v in sorted(kinds.items()))})")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+from playwright.async_api import Error as PlaywrightError
+
+from scrawl import logger
+
+RESOURCE_TYPES = ("document", "stylesheet", "image", "media", "font", "script", "texttrack", "xhr", "fetch",
+                  "eventsource", "websocket", "manifest", "other")
+# nothing of this ends up in the stored HTML or text
+DEFAULT_RESOURCE_TYPES = ("image", "media", "font")
+TRACKERS = ("google-analytics.com", "googletagmanager.com", "googlesyndication.com", "doubleclick.net",
+            "googleadservices.com", "adservice.google.", "connect.facebook.net", "facebook.com/tr", "hotjar.com",
+            "clarity.ms", "scorecardresearch.com", "quantserve.com", "criteo.com", "criteo.net", "taboola.com",
+            "outbrain.com", "adnxs.com", "amazon-adsystem.com", "ads-twitter.com", "analytics.tiktok.com",
+            "snap.licdn.com", "bat.bing.com", "matomo.", "piwik.", "newrelic.com", "nr-data.net", "segment.io",
+            "mixpanel.com", "optimizely.com", "youtube.com/embed", "player.vimeo.com", "vimeocdn.com")
+# rough median transfer size per resource, only used to estimate what blocking saves
+ESTIMATED_SIZES = {"image": 15000, "media": 250000, "font": 30000, "stylesheet": 10000, "script": 20000,
+                   "blocklist": 20000}
+
+
+class ResourceBlocker:
+    """
+    context.route policy that aborts subresource requests by resource type or by URL (`url_patterns` substrings,
+    trackers and media players by default). Navigation requests are never blocked.
+    """
+    def __init__(self, resource_types=DEFAULT_RESOURCE_TYPES, url_patterns=TRACKERS):
+        self.resource_types = frozenset(resource_types)
+        self.url_patterns = tuple(url_patterns)
+        self.blocked = {}
+        self.allowed = 0
+        self.allowed_bytes = 0
+
+    async def install(self, context):
+        if len(self.resource_types) == 0 and len(self.url_patterns) == 0:
+            return
+        await context.route("**/*", self.handle)
+        context.on("response", self.on_response)
+
+    async def handle(self, route):
+        request = route.request
+        reason = None
+        if request.resource_type in self.resource_types:
+            reason = request.resource_type
+        elif any(i in request.url for i in self.url_patterns):
+            reason = "blocklist"
+
+        try:
+            if reason and not request.is_navigation_request():
+                self.blocked[reason] = self.blocked.get(reason, 0) + 1
+                await route.abort("blockedbyclient")
+            else:
+                self.allowed += 1
+                await route.continue_()
+        except PlaywrightError:
+            # page closed in the meantime
+            pass
+
+    def on_response(self, response):
+        length = response.headers.get("content-length", "")
+        if length.isdigit():
+            self.allowed_bytes += int(length)
+
+    def report(self):
+        if len(self.resource_types) == 0 and len(self.url_patterns) == 0:
+            return
+        saved = sum(ESTIMATED_SIZES.get(i, 0) * n for i, n in self.blocked.items())
+        blocked = ", ".join(f"{i}={n}" for i, n in sorted(self.blocked.items())) or "none"
+        logger.logger.info(f"Blocked requests: {blocked}; allowed {self.allowed} requests "
+                           f"({self.allowed_bytes / 2**20:.1f} MiB with known size); "
+                           f"~{saved / 2**20:.1f} MiB saved (estimated)")
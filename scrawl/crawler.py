@@ -1,30 +1,245 @@
+import asyncio
+import collections
 import json
+import logging
 import os
+import heapq
 import random
-import re
 import tempfile
+import time
+import weakref
 
 import xxhash
-from playwright.sync_api import sync_playwright, expect, TimeoutError as PlaywrightTimeoutError, Error as PlaywrightError
-from scrawl import tools, output, logger
+from playwright.async_api import async_playwright, expect, TimeoutError as PlaywrightTimeoutError, Error as PlaywrightError
+from scrawl import tools, output, logger, store, journal, storage, blocking, fetcher, dedup, politeness, supervisor, \
+    metrics, sharding, readiness, startup, sitemaps, recrawl, priority
 from urllib.parse import urlparse
 import zstandard
 
-import numpy as np
+
+ENGINES = ("batch", "pool")
+JOURNAL_MIN_RECORDS = 100000
+DOWNLOAD_BACKOFF = 2.0
+
+
+async def gather_or_cancel(*aws):
+    """
+    Like asyncio.gather, but cancels (and waits for) the remaining awaitables as soon as one of them fails.
+    """
+    tasks = [asyncio.ensure_future(i) for i in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class Frontier:
+    """
+    Set of URLs pending to be crawled for one locale. Enqueueing is O(1) and ignores URLs that are already queued,
+    in flight or in `visited` (the crawler's visited set for the locale, shared, not copied). URLs can be popped at
+    random (swap with the last element) or by priority (lazy max-heap). A popped URL stays in flight, still part of
+    to_json(), until done() forgets it or requeue() puts it back with its priority, so that the pages being crawled
+    when a crawl stops are crawled again when it is resumed.
+    """
+    def __init__(self, urls=(), visited=None):
+        self.urls = []
+        self.index = {}
+        self.priorities = {}
+        self.heap = []
+        # popped URL -> its priority, until done() or requeue()
+        self.inflight = {}
+        self.visited = visited if visited is not None else set()
+        for i in urls:
+            self.add(i)
+
+    def __len__(self):
+        return len(self.urls)
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def __iter__(self):
+        return iter(list(self.urls))
+
+    def add(self, url, priority=None):
+        """
+        Queues `url`, returns False if it was already queued, in flight or visited. A priority only matters for
+        pop_best().
+        """
+        if url in self.index or url in self.inflight or url in self.visited:
+            return False
+        self.index[url] = len(self.urls)
+        self.urls.append(url)
+        if priority is not None:
+            self.priorities[url] = priority
+            heapq.heappush(self.heap, (-priority, url))
+        return True
+
+    def promote(self, url, priority):
+        """
+        Raises the priority of a queued URL. Returns True if it was queued with a lower one.
+        """
+        if url not in self.index or self.priorities.get(url, float("-inf")) >= priority:
+            return False
+        self.priorities[url] = priority
+        heapq.heappush(self.heap, (-priority, url))
+        return True
+
+    def discard(self, url):
+        n = self.index.pop(url, None)
+        if n is None:
+            return
+        last = self.urls.pop()
+        if n < len(self.urls):
+            self.urls[n] = last
+            self.index[last] = n
+        self.priorities.pop(url, None)
+
+    def pop_random(self):
+        """
+        Removes and returns a random URL that has not been visited yet, None if there is none.
+        """
+        while len(self.urls) > 0:
+            url = self.urls[random.randrange(len(self.urls))]
+            priority = self.priorities.get(url)
+            self.discard(url)
+            if url not in self.visited:
+                self.inflight[url] = priority
+                return url
+        return None
+
+    def pop_best(self):
+        """
+        Removes and returns the highest priority URL that has not been visited yet. URLs queued without priority come
+        after all prioritised ones, at random. None if there is none.
+        """
+        while len(self.heap) > 0:
+            priority, url = heapq.heappop(self.heap)
+            if self.priorities.get(url) == -priority:
+                self.discard(url)
+                if url not in self.visited:
+                    self.inflight[url] = -priority
+                    return url
+        return self.pop_random()
+
+    def done(self, url):
+        """
+        Forgets a popped URL once it has been dealt with. Returns True if it was in flight.
+        """
+        return self.inflight.pop(url, False) is not False
+
+    def requeue(self, url):
+        """
+        Puts a popped URL back in the queue, with the priority it had.
+        """
+        if url in self.inflight:
+            self.add(url, self.inflight.pop(url))
+
+    def to_json(self):
+        """
+        The queued URLs and the ones in flight, which from_json() queues again.
+        """
+        entries = [(i, self.priorities.get(i)) for i in self.urls] + list(self.inflight.items())
+        if all(priority is None for _, priority in entries):
+            return [i for i, _ in entries]
+        return [list(i) for i in entries]
+
+    @classmethod
+    def from_json(cls, json_obj, visited=None):
+        """
+        Accepts both Frontier.to_json() output and plain URL lists from older dumps.
+        """
+        obj = cls(visited=visited)
+        for i in json_obj:
+            if isinstance(i, str):
+                obj.add(i)
+            else:
+                obj.add(i[0], i[1])
+        return obj
+
+
+class Throughput:
+    """
+    Sustained pages/sec counter, logged every `interval` seconds so that the crawl engines can be compared.
+    """
+    def __init__(self, label, interval=30.0):
+        self.label = label
+        self.interval = interval
+        self.start = time.monotonic()
+        self.last_report = self.start
+        self.pages = 0
+
+    def rate(self):
+        elapsed = time.monotonic() - self.start
+        return self.pages / elapsed if elapsed > 0 else 0.0
+
+    def tick(self):
+        self.pages += 1
+        if time.monotonic() - self.last_report >= self.interval:
+            self.report()
+
+    def report(self):
+        self.last_report = time.monotonic()
+        logger.logger.info(f"[{self.label}] {self.pages} pages stored in {self.last_report - self.start:.1f}s: "
+                           f"{self.rate():.2f} pages/s")
 
 
 class Crawler:
     def __init__(self, url_list, lang_code_list, destination):
         self.url = url_list
         self.original_url = self.url
-        self.link_queue = []
         self.locales = lang_code_list
         self.visited = {i: set() for i in self.locales}
+        self.link_queue = {i: Frontier(visited=self.visited[i]) for i in self.locales}
         self.hashes = set()
         self.hashes_click = {i: set() for i in self.locales}
+        self.simhashes = set()
+        self.near_duplicate_distance = 0
+        self.near_duplicates = None
         self.valid_hosts = {urlparse(url1).netloc.replace("www.", "") for url1 in self.url}
+        self.host_matcher = tools.HostMatcher(self.valid_hosts)
         self.patterns = [""]
-        
+        self.skip_extensions = None
+        self.exclude_patterns = []
+        self.url_filter = None
+        self.block_resources = list(blocking.DEFAULT_RESOURCE_TYPES)
+        self.block_urls = list(blocking.TRACKERS)
+        self.resource_blocker = None
+        self.fetch_mode = "browser"
+        self.fetcher = None
+        self.min_delay = 0.0
+        self.adaptive_hosts = False
+        self.hosts = None
+        self.recycle_pages = 0
+        self.max_browser_memory = 4096
+        self.metrics_port = None
+        self.worker = 0
+        self.workers = 1
+        self.partition = "host"
+        self.coordinator_file = None
+        self.coordinator = None
+        self.readiness_strategy = "load"
+        self.quiet_time = readiness.DEFAULT_QUIET
+        self.max_inflight = readiness.DEFAULT_MAX_INFLIGHT
+        self.readiness = None
+        self.startup = None
+        self.sitemaps = False
+        self.sitemaps_done = False
+        self.max_sitemap_urls = 1000000
+        self.previous_dir = None
+        self.previous = None
+        self.revalidator = None
+        # validators of the responses to revalidation requests, by (locale, URL), until the page is stored
+        self.probes = {}
+        self.page_validators = weakref.WeakKeyDictionary()
+        self.frontier_mode = "random"
+        self.alignment = None
+        # link depth of the URLs queued with a priority, by (locale, URL), until they are taken from the frontier (or
+        # forgotten: pages of unknown depth count as seeds)
+        self.depths = priority.BoundedDict()
+
         self.destination = destination
         self.idx = 0
         logger.logger.debug(self.url)
@@ -32,9 +247,20 @@ class Crawler:
         self.max_pages = 10000
         self.no_links = 0
         self.max_no_links = 5
-        self.current_locale = self.locales[0]
+        self.done_locales = set()
+        self.parallel_locales = False
         self.slot_size = 10
         self.downloader = False
+        self.max_retries = 3
+        self.engine = "batch"
+        self.disk_store = None
+        self.journal = None
+        self.journal_generation = 0
+        self.snapshot_size = 0
+        self.storage_mode = "files"
+        self.shard_size = 10000
+        self.dictionary_samples = 0
+        self.storage = None
 
         os.makedirs(self.destination, exist_ok=True)
         os.makedirs(os.path.join(self.destination, "json"), exist_ok=True)
@@ -54,19 +280,67 @@ class Crawler:
                 obj = cls(json_obj["url"], json_obj["locales"], directory)
                 obj.url = json_obj["url"]
                 obj.original_url = json_obj["original_url"]
-                obj.link_queue = json_obj["link_queue"]
-                obj.visited = {i: set(json_obj["visited"][i]) for i in json_obj["visited"]}
+                obj.visited = {i: set(json_obj["visited"].get(i, [])) for i in obj.locales}
                 obj.hashes = set(json_obj["hashes"])
-                obj.hashes_click = {i: set(json_obj["hashes_click"][i]) for i in json_obj["hashes_click"]}
+                obj.hashes_click = {i: set(json_obj["hashes_click"].get(i, [])) for i in obj.locales}
+                obj.simhashes = set(json_obj.get("simhashes", []))
+                obj.near_duplicate_distance = json_obj.get("near_duplicate_distance", 0)
                 obj.valid_hosts = set(json_obj["valid_hosts"])
-                obj.patterns = set(json_obj["patterns"])
+                obj.host_matcher = tools.HostMatcher(obj.valid_hosts)
+                obj.patterns = json_obj["patterns"]
+                obj.skip_extensions = json_obj.get("skip_extensions")
+                obj.exclude_patterns = json_obj.get("exclude_patterns", [])
+                obj.block_resources = json_obj.get("block_resources", obj.block_resources)
+                obj.block_urls = json_obj.get("block_urls", obj.block_urls)
+                obj.fetch_mode = json_obj.get("fetch_mode", "browser")
+                obj.min_delay = json_obj.get("min_delay", 0.0)
+                obj.adaptive_hosts = json_obj.get("adaptive_hosts", False)
+                obj.recycle_pages = json_obj.get("recycle_pages", 0)
+                obj.max_browser_memory = json_obj.get("max_browser_memory", 4096)
+                obj.worker = json_obj.get("worker", 0)
+                obj.workers = json_obj.get("workers", 1)
+                obj.partition = json_obj.get("partition", "host")
+                obj.coordinator_file = json_obj.get("coordinator_file")
+                obj.readiness_strategy = json_obj.get("readiness_strategy", "load")
+                obj.sitemaps = json_obj.get("sitemaps", False)
+                obj.sitemaps_done = json_obj.get("sitemaps_done", False)
+                obj.max_sitemap_urls = json_obj.get("max_sitemap_urls", 1000000)
+                obj.previous_dir = json_obj.get("previous_dir")
+                obj.frontier_mode = json_obj.get("frontier_mode", "random")
+                obj.quiet_time = json_obj.get("quiet_time", readiness.DEFAULT_QUIET)
+                obj.max_inflight = json_obj.get("max_inflight", readiness.DEFAULT_MAX_INFLIGHT)
                 obj.idx = json_obj["idx"]
                 obj.max_pages = json_obj["max_pages"]
                 obj.no_links = json_obj["no_links"]
                 obj.max_no_links = json_obj["max_no_links"]
-                obj.current_locale = json_obj["current_locale"]
+                obj.link_queue = {i: Frontier(visited=obj.visited[i]) for i in obj.locales}
+                if "done_locales" in json_obj:
+                    for i in json_obj["link_queue"]:
+                        obj.link_queue[i] = Frontier.from_json(json_obj["link_queue"][i], obj.visited[i])
+                    obj.done_locales = set(json_obj["done_locales"])
+                else:
+                    # dump from the sequential-only crawler: a single queue for `current_locale`
+                    lang_code = json_obj["current_locale"]
+                    obj.link_queue[lang_code] = Frontier.from_json(json_obj["link_queue"], obj.visited[lang_code])
+                    obj.done_locales = set(obj.locales[:obj.locales.index(lang_code)])
+                obj.parallel_locales = json_obj.get("parallel_locales", False)
                 obj.slot_size = json_obj["slot_size"]
                 obj.downloader = json_obj["downloader"]
+                obj.max_retries = json_obj.get("max_retries", 3)
+                obj.engine = json_obj.get("engine", "batch")
+                obj.storage_mode = json_obj.get("storage_mode", "files")
+                obj.shard_size = json_obj.get("shard_size", 10000)
+                obj.dictionary_samples = json_obj.get("dictionary_samples", 0)
+                if json_obj.get("disk_store", False):
+                    obj.open_disk_store()
+
+                obj.journal_generation = json_obj.get("journal_generation", 0)
+                replayed = 0
+                for record in journal.Journal.replay(os.path.join(directory, "crawler.journal"),
+                                                     obj.journal_generation):
+                    obj.apply_journal_record(record)
+                    replayed += 1
+                logger.logger.info(f"Replayed {replayed} journal records")
 
                 return obj
         else:
@@ -78,305 +352,1089 @@ class Crawler:
         obj.downloader = True
         return obj
 
+    @classmethod
+    def create_recrawl(cls, previous_dir, directory):
+        """
+        Crawl again the hosts and locales of the output in `previous_dir`, starting from every page stored there.
+        """
+        previous = recrawl.PreviousCrawl(previous_dir)
+        if len(previous) == 0:
+            raise FileNotFoundError(f"No stored pages in {previous_dir}")
+        obj = cls(list(previous.seeds.values()), previous.locales(), directory)
+        obj.previous_dir = os.path.abspath(previous_dir)
+        obj.previous = previous
+        return obj
 
-    def store_result(self, json_string):
+    def open_disk_store(self, reset=False):
+        """
+        Moves the frontier, visited URLs and hashes to an SQLite store in the working directory (crawler.sqlite).
+        They are no longer part of to_json(). An existing store is reopened as it is unless `reset` is set.
+        """
+        filename = os.path.join(self.destination, "crawler.sqlite")
+        if reset and os.path.exists(filename):
+            store.Store(filename).remove()
+        self.disk_store = store.Store(filename)
+        self.visited = {i: self.disk_store.set(f"visited:{i}", self.visited[i]) for i in self.locales}
+        self.hashes = self.disk_store.set("hashes", self.hashes)
+        self.hashes_click = {i: self.disk_store.set(f"hashes_click:{i}", self.hashes_click[i]) for i in self.locales}
+        self.simhashes = self.disk_store.set("simhashes", self.simhashes)
+        self.link_queue = {i: self.disk_store.frontier(i, self.visited[i], self.link_queue[i]) for i in self.locales}
+
+
+    def pages_stored(self):
+        """
+        Pages stored so far, which Crawler.max_pages applies to: by all the workers in multi-worker crawls.
+        """
+        return self.coordinator.pages() if self.coordinator else self.idx
+
+    def store_result(self, json_string, host=None, lang_code=None, url=None, page_hash=None):
+        """
+        Writes a page, then marks `url` as visited for `lang_code` and records `page_hash`, if given. The page that
+        reaches Crawler.max_pages (counted over all the workers) is written before ValueError is raised; the ones
+        after it are not written, nor marked.
+        """
+        # counting and checking the limit in one step, so that no page is marked and then not written
+        pages = self.coordinator.count_page() if self.coordinator else self.idx + 1
+        if pages > self.max_pages + 1:
+            # another concurrent page (of any worker) already hit the limit
+            raise ValueError(f"The limit Crawler.max_pages of {self.max_pages} has been reached")
         self.idx += 1
 
-        fname = os.path.join(os.path.join(self.destination, "json"), f"{self.idx:012d}.json.zst")
+        if self.storage is None:
+            json_dir = os.path.join(self.destination, "json")
+            compressor = storage.Compressor(json_dir, self.dictionary_samples)
+            if self.storage_mode == "shards":
+                self.storage = storage.ShardStorage(json_dir, self.shard_size, compressor=compressor)
+            else:
+                self.storage = storage.FileStorage(json_dir, compressor)
+
+        fname = self.storage.write(self.idx, json_string, host)
         logger.logger.info(f"Storing result in {fname}")
-        with zstandard.open(fname, "wt") as rfile:
-            rfile.write(json_string)
+        if url is not None:
+            self.visited[lang_code].add(url)
+        if page_hash is not None:
+            self.hashes.add(page_hash)
 
-        if self.idx > self.max_pages:
+        if self.journal:
+            self.journal.write("i", self.idx)
+
+        if pages > self.max_pages:
             logger.logger.info(f"The limit of {self.max_pages} has been reached")
             raise ValueError("The limit Crawler.max_pages of {self.max_pages} has been reached")
 
-        if (self.idx % 1000) == 0:
+        if self.journal:
+            self.checkpoint()
+        elif (self.idx % 1000) == 0:
             logger.logger.info(f"Persisting the crawling state after {self.idx} iterations")
             self.persist()
 
-    def try_to_accept_cookies(self, browser):
-        for i in self.original_url:
-            logger.logger.info(f"Trying to click accept in the cookies dialog at {i} if it does exist...")
-            page = browser.new_page()
+    async def try_to_accept_cookies(self, context):
+        """
+        Experimental support for cookie dialogs: opens one seed URL per host, concurrently, and clicks any button
+        containing accep, acep, ok or contin. Hosts checked before (by another locale or an earlier run) are skipped,
+        and the saved consent state of every host is added to `context`.
+        """
+        async with self.startup.lock:
+            seeds = {}
+            for i in self.original_url:
+                host = urlparse(i).netloc
+                if not self.startup.consent_checked(host):
+                    seeds.setdefault(host, i)
+            if len(seeds) > 0:
+                logger.logger.info(f"Looking for cookie dialogs in {len(seeds)} hosts...")
+                semaphore = asyncio.Semaphore(startup.CONSENT_CONCURRENCY)
+                outcomes = await asyncio.gather(*[self.accept_cookies(context, i, semaphore) for i in seeds.values()])
+                for host, outcome in zip(seeds, outcomes):
+                    self.startup.set_consent(host, outcome)
+                self.startup.merge_state(await context.storage_state())
+                self.startup.save()
+                summary = collections.Counter(outcomes)
+                logger.logger.info(f"Cookie dialogs: {', '.join(f'{k}={v}' for k, v in sorted(summary.items()))}")
+        await self.startup.apply(context)
 
+    async def accept_cookies(self, context, url, semaphore):
+        """
+        Clicks the accept button of the cookie dialog of `url`, if there is one. Returns the outcome.
+        """
+        async with semaphore:
+            logger.logger.info(f"Trying to click accept in the cookies dialog at {url} if it does exist...")
+            page = await context.new_page()
             try:
-                page.goto(i)
-            except PlaywrightError:
-                #traceback.print_exc()
                 try:
-                    logger.logger.info(f"Failed to retrieve URL {i}, retrying one more time...")
-                    page.goto(i)
-                    logger.logger.warning(f"Finally {i} has been retrieved.")
+                    await page.goto(url, wait_until="commit")
                 except PlaywrightError:
-                    logger.logger.warning(f"Couldn't retrieve {i}, skipping...")
-                    continue
+                    logger.logger.info(f"Failed to retrieve URL {url}, retrying one more time...")
+                    try:
+                        await page.goto(url, wait_until="commit")
+                    except PlaywrightError:
+                        logger.logger.warning(f"Couldn't retrieve {url}, skipping...")
+                        return "unreachable"
 
+                try:
+                    await page.wait_for_load_state("load", timeout=startup.CONSENT_TIMEOUT)
+                except PlaywrightTimeoutError:
+                    return "timeout"
 
-            try:
-                #page.wait_for_load_state("domcontentloaded", timeout=100)
-                #page.wait_for_load_state("networkidle", timeout=100)
-                page.wait_for_load_state("load", timeout=5000)
-            except PlaywrightTimeoutError:
-                continue
-
-            try:
-                l = page.get_by_role("button", name=re.compile(r"\bacep|\baccep|\bok\b|\bcontin",
-                                                               re.IGNORECASE))
-                expect(l.last).to_be_visible()
-                l.last.click()
-            except AssertionError:
-                break
-            except PlaywrightError:
-                break
+                try:
+                    l = page.get_by_role("button", name=startup.CONSENT_BUTTON)
+                    await expect(l.last).to_be_visible(timeout=startup.CONSENT_TIMEOUT)
+                    await l.last.click()
+                    return "accepted"
+                except AssertionError:
+                    return "no-dialog"
+                except PlaywrightError:
+                    return "failed"
+            finally:
+                await page.close()
 
-            page.close()
+    async def test_kelloggs_problem(self, my_playwright):
+        host = urlparse(self.original_url[0]).netloc
+        found = self.startup.http2_error(host)
+        if found is not None:
+            logger.logger.info(f"K problem {'found' if found else 'not found'} for {host} (cached)")
+            return found
 
-    def test_kelloggs_problem(self, my_playwright):
         logger.logger.info("Checking for K problem")
+        found = False
         with tempfile.TemporaryDirectory() as workdir:
-            browser = my_playwright.chromium.launch_persistent_context(workdir, locale="en")
-            page = browser.new_page()
+            browser = await my_playwright.chromium.launch_persistent_context(workdir, locale="en")
+            page = await browser.new_page()
             try:
-                page.goto(self.original_url[0])
+                await page.goto(self.original_url[0])
+                await page.close()
             except Exception as e:
-                s = str(e)
-                browser.close()
-                if "ERR_HTTP2_PROTOCOL_ERROR" in s:
-                    logger.logger.info("K problem found: using Firefox")
-                    return True
-                else:
-                    logger.logger.info("K problem not found")
-                    return False
-            browser.close()
-            page.close()
-            logger.logger.info("K problem not found")
-            return False
+                found = "ERR_HTTP2_PROTOCOL_ERROR" in str(e)
+            await browser.close()
+        logger.logger.info("K problem found: using Firefox" if found else "K problem not found")
+        self.startup.set_http2_error(host, found)
+        self.startup.save()
+        return found
+
+    async def download_page(self, browser, u):
+        """
+        Loads `u`, stores it and marks it as done. A page that does not get ready in time is stored as it is, unless it
+        has no text yet. Raises PlaywrightError if it cannot be retrieved or stored, and ValueError when
+        Crawler.max_pages is reached.
+        """
+        p = await browser.new_page()
+        try:
+            await self.navigate(p, u, "en")
+            ready = await self.wait_for_load(p)
+            try:
+                with metrics.registry.timer("snapshot"):
+                    snapshot = await p.evaluate(tools.PAGE_SNAPSHOT)
+            except Exception:
+                snapshot = {"html": "", "text": ""}
+            if not ready:
+                if not snapshot["text"].strip():
+                    raise PlaywrightTimeoutError(f"{u} did not get ready and has no text yet")
+                metrics.registry.inc("pages_partial")
+            validators = self.page_validators.pop(p, {})
+
+            with metrics.registry.timer("store"):
+                self.store_result(json.dumps({"lang": "en",
+                                              "url": p.url,
+                                              "html": snapshot["html"],
+                                              "hash": xxhash.xxh64(snapshot["text"]).hexdigest(),
+                                              **validators}),
+                                  urlparse(p.url).netloc, "en", u)
+            metrics.registry.inc("pages_stored", lang="en")
+        finally:
+            await p.close(run_before_unload=False)
 
-    def download(self, default_browser, workdir):
+    async def download(self, default_browser, workdir):
+        """
+        Downloads the URL list with `slot_size` concurrent pages. Progress is the set of done URLs (downloaded or
+        given up, kept in visited["en"]), so a resumed download queues again every URL of the list that is not done.
+        Failed URLs are retried up to `max_retries` times with exponential backoff.
+        """
         logger.logger.info(f"Downloading URL list...")
         dir_context = os.path.join(workdir, "en")
         os.mkdir(dir_context)
-        browser = default_browser.launch_persistent_context(dir_context, locale="en")
+        browser = self.browser_supervisor(default_browser, dir_context, "en")
+        await browser.launch()
+        link_queue = self.link_queue["en"]
+        done = self.visited["en"]
 
-        if len(self.link_queue) == 0:
-            for i in self.url:
-                self.link_queue.append(i)
-        else:
-            logger.logger.info("Resuming partial download...")
+        if len(done) > 0:
+            logger.logger.info(f"Resuming partial download, {len(done)} URLs already done...")
+        for i in self.url:
+            if self.owns(i):
+                link_queue.add(i)
 
-        while True:
-            if len(self.link_queue) == 0:
-                return
-            u = self.link_queue[0]
+        throughput = Throughput("download")
+        scheduler = politeness.HostScheduler(link_queue, self.hosts, self.slot_size)
+        cond = asyncio.Condition()
+        retries = []  # heap of (due time, failed attempts, url)
+        fetching = 0
+        failed = 0
+        limit_reached = False
 
-            p = None
-            try:
-                logger.logger.info(f"Trying to download {u}")
-                p = browser.new_page()
-                p.goto(u, wait_until="commit", timeout=5000)
-            except PlaywrightError:
+        def next_url():
+            now = time.monotonic()
+            if len(retries) > 0 and retries[0][0] <= now and self.hosts.available(urlparse(retries[0][2]).netloc, now):
+                _, attempts, u = heapq.heappop(retries)
+                return attempts, scheduler.take(u, now)
+            u = scheduler.pop()
+            return None if u is None else (0, u)
+
+        async def worker():
+            nonlocal fetching, failed, limit_reached
+            while not limit_reached:
+                async with cond:
+                    task = next_url()
+                    while task is None and (fetching > 0 or len(retries) > 0 or scheduler.size > 0) \
+                            and not limit_reached:
+                        waits = [i for i in (scheduler.next_ready(), politeness.POLL_INTERVAL if len(retries) > 0
+                                             else None) if i is not None]
+                        try:
+                            await asyncio.wait_for(cond.wait(), min(waits) if waits else None)
+                        except asyncio.TimeoutError:
+                            pass
+                        task = next_url()
+                    if task is None or limit_reached:
+                        cond.notify_all()
+                        return
+                    fetching += 1
+
+                attempts, u = task
                 try:
-                    logger.logger.warning(f"Failed to retrieve URL {u}, retrying one more time...")
-                    if p:
-                        p.goto(u, wait_until="commit", timeout=5000)
-                        logger.logger.warning(f"Finally {u} has been retrieved.")
-                except PlaywrightError:
-                    logger.logger.warning(f"Couldn't retrieve {u}, skipping...")
-                    self.visited["en"].add(u)
-                    self.link_queue.pop(0)
-                    if p:
-                        p.close()
-                    continue
+                    logger.logger.info(f"Trying to download {u}")
+                    await browser.recycle_if_due()
+                    await self.download_page(browser, u)
+                    throughput.tick()
+                except PlaywrightError as e:
+                    attempts += 1
+                    if attempts < self.max_retries:
+                        delay = DOWNLOAD_BACKOFF * 2 ** (attempts - 1) * random.uniform(1, 1.5)
+                        logger.logger.warning(f"Failed to retrieve URL {u} ({attempts}/{self.max_retries}: "
+                                              f"{str(e).splitlines()[0]}), retrying in {delay:.1f}s...")
+                        heapq.heappush(retries, (time.monotonic() + delay, attempts, u))
+                    else:
+                        logger.logger.warning(f"Couldn't retrieve {u}, skipping...")
+                        done.add(u)
+                        failed += 1
+                except ValueError:
+                    limit_reached = True
+                finally:
+                    scheduler.done(u)
+                    async with cond:
+                        fetching -= 1
+                        cond.notify_all()
+
+        try:
+            await gather_or_cancel(*[worker() for _ in range(self.slot_size)])
+        finally:
+            scheduler.release()
+            throughput.report()
+            self.resource_blocker.report()
+            self.hosts.report()
+            self.readiness.report()
+            await browser.close()
+
+        if limit_reached:
+            raise ValueError(f"The limit Crawler.max_pages of {self.max_pages} has been reached")
+        logger.logger.info(f"Download finished, {failed} URLs could not be retrieved")
+
+    def context_options(self):
+        """
+        Extra options for launch_persistent_context: service workers would fetch behind the back of context.route.
+        """
+        if len(self.block_resources) > 0 or len(self.block_urls) > 0:
+            return {"service_workers": "block"}
+        return {}
+
+    async def prepare_context(self, context):
+        """
+        Runs on every new browser context, recycled ones included.
+        """
+        await self.resource_blocker.install(context)
+        await self.startup.apply(context)
+
+    def browser_supervisor(self, default_browser, dir_context, lang_code):
+        """
+        The persistent context of a locale, relaunched after `recycle_pages` pages or when its processes use more
+        than `max_browser_memory` MiB.
+        """
+        browser = supervisor.BrowserSupervisor(default_browser, dir_context,
+                                               {"locale": lang_code, **self.context_options()},
+                                               self.prepare_context, self.recycle_pages,
+                                               self.max_browser_memory * 2**20, lang_code)
+        metrics.registry.gauge("browser_rss_bytes", lambda: browser.rss, lang=lang_code)
+        metrics.registry.gauge("browser_recycles", lambda: browser.recycles, lang=lang_code)
+        return browser
+
+    async def open_page(self, browser, u, lang_code):
+        """
+        Opens a new page and starts the navigation to `u`, retrying once. Returns None (and marks `u` as visited)
+        if the URL cannot be retrieved.
+        """
+        p = None
+        try:
+            p = await browser.new_page()
+            await self.navigate(p, u, lang_code)
+            return p
+        except PlaywrightError:
             try:
-                # tools.scroll_down(p, 20)
-                #p.wait_for_load_state("domcontentloaded", timeout=100)
-                #p.wait_for_load_state("networkidle", timeout=100)
-                p.wait_for_load_state("load",
-                                      timeout=5000)  # main mechanism to wait for pages to be loaded
-            except PlaywrightTimeoutError:
-                logger.logger.warning("Operation timed out.")
-                self.link_queue.pop(0)
-                p.close(run_before_unload=False)
-                continue
+                logger.logger.warning(f"Failed to retrieve URL {u}, retrying one more time...")
+                if p:
+                    await self.navigate(p, u, lang_code)
+                    logger.logger.warning(f"Finally {u} has been retrieved.")
+                    return p
+            except PlaywrightError:
+                pass
 
+        logger.logger.warning(f"Couldn't retrieve {u}, skipping...")
+        metrics.registry.inc("pages_skipped", reason="navigation_failed")
+        self.probes.pop((lang_code, u), None)
+        self.visited[lang_code].add(u)
+        if p:
+            await p.close()
+        return None
+
+    async def navigate(self, p, u, lang_code):
+        """
+        Starts the navigation of `p` to `u`, queued for `lang_code`, with the timeout of its host, and records the
+        outcome for the host.
+        """
+        host = urlparse(u).netloc
+        self.readiness.watch(p)
+        await self.hosts.turn(host)
+        start = time.monotonic()
+        try:
+            with metrics.registry.timer("goto"):
+                response = await p.goto(u, wait_until="commit", timeout=self.hosts.timeout(host))
+        except PlaywrightTimeoutError:
+            self.hosts.failure(host, timeout=True)
+            metrics.registry.inc("timeouts", stage="goto")
+            raise
+        except PlaywrightError:
+            self.hosts.failure(host)
+            raise
+        self.alignment.rendered += 1
+        if response:
+            self.hosts.response(host, time.monotonic() - start, response.status, response.headers)
+            self.page_validators[p] = {**self.probes.pop((lang_code, u), {}), **fetcher.validators(response.headers)}
+
+    async def wait_for_load(self, p):
+        """
+        Waits until `p` is ready according to the readiness strategy, within the timeout of its host. Returns False if
+        it did not get ready, in which case its DOM may still be usable.
+        """
+        host = urlparse(p.url).netloc
+        # tools.scroll_down(p, 20)
+        with metrics.registry.timer("load"):
+            outcome = await self.readiness.wait(p, host, self.hosts.timeout(host))
+        metrics.registry.inc("readiness", outcome=outcome)
+        if outcome == "timeout":
+            self.hosts.failure(host, timeout=True)
+            metrics.registry.inc("timeouts", stage="load")
+        return outcome == "ready"
+
+    async def process_page(self, p, lang_code, depth=0):
+        """
+        Waits for an opened page, found `depth` links away from the seeds, stores it unless it is a duplicate or out
+        of scope, and queues its links. Returns True if the page has been stored. Raises ValueError when
+        Crawler.max_pages is reached.
+        """
+        try:
+            ready = await self.wait_for_load(p)
+
+            if not self.in_scope(p.url, lang_code):
+                metrics.registry.inc("pages_skipped", reason="out_of_scope")
+                return False
             try:
-                p_content = p.content()
+                # HTML, body text and links in a single round trip to the browser
+                with metrics.registry.timer("snapshot"):
+                    snapshot = await p.evaluate(tools.PAGE_SNAPSHOT)
             except Exception:
-                p_content = ""
+                metrics.registry.inc("pages_skipped", reason="snapshot_error" if ready else "load_timeout")
+                return False
+            if not ready:
+                # whatever DOM there is: some subresources may never finish
+                if not snapshot["text"].strip():
+                    metrics.registry.inc("pages_skipped", reason="load_timeout")
+                    return False
+                metrics.registry.inc("pages_partial")
 
-            self.store_result(json.dumps({"lang": "en",
-                                          "url": p.url,
-                                          "html": p_content,
-                                          "hash": xxhash.xxh64(p.text_content("body")).hexdigest()}))
-            self.link_queue.pop(0)
-            p.close()
+            snapshot["validators"] = self.page_validators.pop(p, {})
+            return self.store_snapshot(p.url, snapshot, lang_code, depth)
+        finally:
+            await p.close(run_before_unload=False)
 
+    async def fetch_static(self, u, lang_code, depth=0):
+        """
+        Hybrid fetch mode: fetches `u` over plain HTTP. Returns None if the page has to be rendered in the browser,
+        otherwise whether it has been stored. Raises ValueError when Crawler.max_pages is reached.
+        """
+        with metrics.registry.timer("http_fetch"):
+            verdict, url, snapshot = await self.fetcher.fetch(u, lang_code)
+        metrics.registry.inc("http_fetch", verdict=verdict)
+        if verdict == "render":
+            return None
+        self.probes.pop((lang_code, u), None)
+        self.alignment.rendered += 1
+        if verdict == "skip":
+            metrics.registry.inc("pages_skipped", reason="not_html")
+            stored = False
+        elif not self.in_scope(url, lang_code):
+            metrics.registry.inc("pages_skipped", reason="out_of_scope")
+            stored = False
+        else:
+            stored = self.store_snapshot(url, snapshot, lang_code, depth)
+        self.visited[lang_code].add(u)
+        return stored
 
-    def crawl(self):
-        with (tempfile.TemporaryDirectory() as workdir):
-            with sync_playwright() as pw:
-                default_browser = pw.chromium
-                if self.test_kelloggs_problem(pw):
-                    default_browser = pw.firefox
-
-                if self.downloader:
-                    self.download(default_browser, workdir)
-                else:
-                    for lang_code in self.locales[self.locales.index(self.current_locale):]:
-                        self.current_locale = lang_code
-
-                        logger.logger.info(f"Starting with [{lang_code}] locale...")
-                        dir_context = os.path.join(workdir, lang_code)
-                        os.mkdir(dir_context)
-                        browser = default_browser.launch_persistent_context(dir_context, locale=lang_code)
-
-                        """
-                        Experimental support for cookie dialog: search any button containing accep acep ok and click
-                        in the entry page
-                        """
-                        self.try_to_accept_cookies(browser)
-
-                        # if not resuming stopped crawl
-                        if len(self.link_queue) == 0:
-                            for i in self.url:
-                                self.link_queue.append(i)
-                        else:
-                            logger.logger.info("Resuming partial crawl...")
-
-                        self.link_queue = list(set(self.link_queue))  # unique links, important
-
-                        while True:
-                            no_action_performed = True
-                            indices = random.sample(range(len(self.link_queue)),
-                                                    min(len(self.link_queue), self.slot_size))
-                            next_urls = [self.link_queue[n] for n in indices]
-
-                            pages = []
-                            for u in next_urls:
-                                try:
-                                    p = browser.new_page()
-                                    p.goto(u, wait_until="commit", timeout=5000)
-                                    pages.append(p)
-                                except PlaywrightError:
-                                    try:
-                                        logger.logger.warning(f"Failed to retrieve URL {u}, retrying one more time...")
-                                        p.goto(u, wait_until="commit", timeout=5000)
-                                        logger.logger.warning(f"Finally {u} has been retrieved.")
-                                    except PlaywrightError:
-                                        logger.logger.warning(f"Couldn't retrieve {u}, skipping...")
-                                        self.visited[lang_code].add(u)
-                                        p.close()
-                                        pages = pages[0:-1]
-                                        continue
-
-                            for p in pages:
-                                try:
-                                    # tools.scroll_down(p, 20)
-                                    #p.wait_for_load_state("domcontentloaded", timeout=100)
-                                    #p.wait_for_load_state("networkidle", timeout=100)
-                                    p.wait_for_load_state("load",
-                                                          timeout=5000)  # main mechanism to wait for pages to be loaded
-                                except PlaywrightTimeoutError:
-                                    p.close(run_before_unload=False)
-                                    continue
-
-                                if p.url in self.visited[lang_code]:
-                                    p.close(run_before_unload=False)
-                                    continue
-                                if not tools.is_valid_host(self.valid_hosts, p.url, self.patterns):
-                                    p.close(run_before_unload=False)
-                                    continue
-                                try:
-                                    current_hash = xxhash.xxh64(p.text_content("body")).hexdigest()
-                                    if current_hash in self.hashes:
-                                        p.close(run_before_unload=False)
-                                        continue
-                                except Exception:
-                                    continue
-
-                                self.hashes.add(current_hash)
-                                logger.logger.debug(p.text_content("body"))
-                                logger.logger.info(f"Storing URL {p.url}")
-                                try:
-                                    self.store_result(json.dumps({"lang": lang_code,
-                                                                  "url": p.url,
-                                                                  "html": p.content(),
-                                                                  # "text": p.text_content("body"),
-                                                                  "hash": current_hash}))
-                                except ValueError:
-                                    logger.logger.warning(f"Maximum number of {self.max_pages} pages has been reached")
-                                    logger.logger.info("Crawling ends. Generating HTML output")
-                                    json_src = os.path.join(self.destination, "json")
-                                    html_trg = os.path.join(self.destination, "html")
-                                    output.generate_output(json_src, html_trg)
-                                    return
-
-                                self.visited[lang_code].add(p.url)
+    async def revalidate(self, u, lang_code):
+        """
+        Recrawls: asks the host whether a page stored by the previous crawl has changed, and if it has not, stores a
+        reference to the previous record instead of rendering it (its links are not followed). Returns True if `u`
+        has been dealt with, False if it has to be fetched.
+        """
+        entry = self.previous.get(lang_code, u)
+        if entry is None:
+            metrics.registry.inc("recrawl", outcome="new")
+            return False
+        if not self.in_scope(u, lang_code):
+            return False
+        with metrics.registry.timer("revalidate"):
+            outcome, validators = await self.revalidator.revalidate(u, lang_code, entry)
+        metrics.registry.inc("recrawl", outcome=outcome or "unknown")
+        if outcome != "unchanged":
+            self.probes[lang_code, u] = validators
+            return False
+
+        if entry.hash in self.hashes:
+            metrics.registry.inc("pages_skipped", reason="duplicate")
+            self.visited[lang_code].add(u)
+            return True
+        logger.logger.info(f"Unchanged URL {u}")
+        validators = {**{i: getattr(entry, i) for i in fetcher.VALIDATORS if getattr(entry, i)}, **validators}
+        with metrics.registry.timer("store"):
+            self.store_result(json.dumps({"lang": lang_code,
+                                          "url": u,
+                                          "hash": entry.hash,
+                                          **validators,
+                                          "reference": recrawl.reference(entry, self.json_directory())}),
+                              urlparse(u).netloc, lang_code, u, entry.hash)
+        metrics.registry.inc("pages_unchanged", lang=lang_code)
+        return True
+
+    def json_directory(self):
+        return os.path.abspath(os.path.join(self.destination, "json"))
+
+    def in_scope(self, url, lang_code):
+        return url not in self.visited[lang_code] and self.host_matcher.is_valid(url, self.patterns)
+
+    def store_snapshot(self, url, snapshot, lang_code, depth=0):
+        """
+        Stores a page snapshot (see tools.PAGE_SNAPSHOT) unless it is a duplicate, and queues its links, `depth` + 1
+        links away from the seeds. Returns True if the page has been stored.
+        """
+        # the page may have been queued under the URL it redirected to
+        self.depths.pop((lang_code, url), None)
+        with metrics.registry.timer("hash"):
+            current_hash = xxhash.xxh64(snapshot["text"]).hexdigest()
+        if current_hash in self.hashes:
+            metrics.registry.inc("pages_skipped", reason="duplicate")
+            return False
+
+        if self.near_duplicates:
+            with metrics.registry.timer("simhash"):
+                fingerprint = dedup.simhash(snapshot["text"])
+                near_duplicate = self.near_duplicates.find(fingerprint)
+            if near_duplicate is not None:
+                # neither stored nor expanded
+                logger.logger.debug(f"Skipping near-duplicate {url}")
+                metrics.registry.inc("pages_skipped", reason="near_duplicate")
+                self.near_duplicates.skipped += 1
+                self.visited[lang_code].add(url)
+                return False
+            self.near_duplicates.add(fingerprint)
+
+        if logger.logger.isEnabledFor(logging.DEBUG):
+            logger.logger.debug(snapshot["text"])
+        logger.logger.info(f"Storing URL {url}")
+        with metrics.registry.timer("store"):
+            self.store_result(json.dumps({"lang": lang_code,
+                                          "url": url,
+                                          "html": snapshot["html"],
+                                          # "text": snapshot["text"],
+                                          "hash": current_hash,
+                                          **snapshot.get("validators", {})}),
+                              urlparse(url).netloc, lang_code, url, current_hash)
+        metrics.registry.inc("pages_stored", lang=lang_code)
+
+        alternates = [(self.url_filter.verdict(i["href"])[0], i["hreflang"]) for i in snapshot["alternates"]
+                      if isinstance(i["href"], str)]
+        self.alignment.store(url, alternates, snapshot.get("lang"))
+
+        # Links from the HTML code: <a href> + <link rel alternate>
+        more_links, discarded = self.url_filter.filter([i["href"] for i in snapshot["alternates"]] +
+                                                       snapshot["links"])
+
+        for link in discarded:
+            if link not in self.visited[lang_code]:
+                logger.logger.info(f"Discarding link {link}")
+                self.visited[lang_code].add(link)
+
+        for link in more_links:
+            self.queue_link(lang_code, link, depth + 1)
+
+        return True
+
+    def seed_from_previous(self):
+        """
+        Recrawls: queues every page stored by the previous crawl that has not been visited yet, in its locale. Done on
+        every run, since unchanged pages are not parsed for links: pages that were in flight when a run stopped would
+        not be found again otherwise.
+        """
+        queued = 0
+        for lang_code in self.locales:
+            if lang_code in self.done_locales:
+                continue
+            for url in self.previous.urls(lang_code):
+                if self.owns(url):
+                    queued += self.link_queue[lang_code].add(url, self.priority(url))
+        logger.logger.info(f"{queued} URLs of {self.previous_dir} queued")
+
+    async def seed_from_sitemaps(self):
+        """
+        Queues the URLs (and hreflang alternates) of the sitemaps of the seed hosts that pass the URL filter, in every
+        locale that is still to be crawled. Done once per crawl.
+        """
+        reader = sitemaps.SitemapReader(self.max_sitemap_urls)
+        pending = [i for i in self.locales if i not in self.done_locales]
+        queued = 0
+        batch = []
+
+        def queue():
+            nonlocal queued
+            accepted, _ = self.url_filter.filter(batch)
+            for url in accepted:
+                if self.owns(url):
+                    queued += sum(self.link_queue[i].add(url, self.priority(url)) for i in pending)
+            batch.clear()
+
+        logger.logger.info("Reading sitemaps...")
+        try:
+            async for url in reader.urls(self.original_url):
+                batch.append(url)
+                if len(batch) >= 1000:
+                    queue()
+            queue()
+        finally:
+            await reader.close()
+        reader.report()
+        logger.logger.info(f"{queued} URLs queued from sitemaps")
+        self.sitemaps_done = True
+        self.persist()
+
+    def owns(self, url):
+        return self.coordinator is None or self.coordinator.owns(url)
+
+    def queue_link(self, lang_code, url, depth=1):
+        """
+        Queues `url`, found `depth` links away from the seeds, or routes it to the worker that owns it in a
+        multi-worker crawl. With the priority frontier, a URL that is already queued gets its new score if higher.
+        """
+        if not self.owns(url):
+            self.coordinator.send(lang_code, url)
+            return
+        score = self.priority(url, depth)
+        if self.link_queue[lang_code].add(url, score):
+            if score is not None:
+                self.depths[lang_code, url] = depth
+        elif score is not None:
+            self.link_queue[lang_code].promote(url, score)
+
+    def priority(self, url, depth=1):
+        """
+        Priority of `url` in the frontier, None for the random frontier.
+        """
+        if self.frontier_mode != "priority":
+            return None
+        return self.alignment.score(url, depth)
+
+    async def wait_for_links(self, lang_code):
+        """
+        Multi-worker crawls: once this worker has run out of `lang_code` links, waits until another worker routes
+        some to it (returns True) or the locale is finished for every worker (returns False). Raises ValueError once
+        the workers have stored Crawler.max_pages between them.
+        """
+        logger.logger.info(f"[{lang_code}] No links left, waiting for the other workers...")
+        while True:
+            if self.pages_stored() > self.max_pages:
+                raise ValueError(f"The limit Crawler.max_pages of {self.max_pages} has been reached")
+            # hands over the links found for other workers and takes the ones routed to this one
+            self.checkpoint(force=True)
+            if len(self.link_queue[lang_code]) > 0:
+                return True
+            self.coordinator.idle(lang_code)
+            if self.coordinator.finished(lang_code):
+                return False
+            await asyncio.sleep(sharding.POLL_INTERVAL)
+
+    async def crawl_batch(self, browser, lang_code, throughput):
+        """
+        Lock-step engine: opens `slot_size` random URLs from the queue and waits for all of them before sampling
+        the next batch. URLs are picked by a politeness.HostScheduler.
+        """
+        scheduler = politeness.HostScheduler(self.link_queue[lang_code], self.hosts, self.slot_size,
+                                             self.frontier_mode == "priority")
+        try:
+            while True:
+                no_action_performed = True
+                next_urls = []
+                while len(next_urls) < self.slot_size:
+                    u = scheduler.pop()
+                    if u is None:
+                        break
+                    next_urls.append(u)
+                depths = {u: self.depths.pop((lang_code, u), 0) for u in next_urls}
+
+                if len(next_urls) == 0 and scheduler.size > 0:
+                    # every pending host has to wait
+                    await asyncio.sleep(scheduler.next_ready())
+                    continue
+
+                completed = False
+                try:
+                    if self.previous:
+                        unchanged = await gather_or_cancel(*[self.revalidate(u, lang_code) for u in next_urls])
+                        for u, i in zip(next_urls, unchanged):
+                            if i:
+                                scheduler.done(u)
+                                no_action_performed = False
+                                throughput.tick()
+                        next_urls = [u for u, i in zip(next_urls, unchanged) if not i]
+
+                    if self.fetcher:
+                        stored = await gather_or_cancel(*[self.fetch_static(u, lang_code, depths[u])
+                                                          for u in next_urls])
+                        for u, i in zip(next_urls, stored):
+                            if i is not None:
+                                scheduler.done(u)
+                            if i:
                                 no_action_performed = False
+                                throughput.tick()
+                        # only the pages that need a browser are left
+                        next_urls = [u for u, i in zip(next_urls, stored) if i is None]
+
+                    # no page is open between batches
+                    await browser.recycle_if_due()
+                    pages = []
+                    for u in next_urls:
+                        p = await self.open_page(browser, u, lang_code)
+                        if p:
+                            pages.append((p, depths[u]))
+
+                    for p, depth in pages:
+                        if await self.process_page(p, lang_code, depth):
+                            no_action_performed = False
+                            throughput.tick()
+                    completed = True
+                finally:
+                    # when the limit is reached or the crawl is interrupted, the pages not stored are crawled again
+                    # on resume
+                    for u in next_urls:
+                        if completed or u in self.visited[lang_code]:
+                            scheduler.done(u)
+                        else:
+                            scheduler.requeue(u)
+
+                if no_action_performed:
+                    if len(self.link_queue[lang_code]) > 0 or scheduler.size > 0:
+                        continue
+                    else:
+                        break
+        finally:
+            scheduler.release()
 
-                                # Links from the HTML code: <a href> + <link rel alternate>
-                                try:
-                                    p_content = p.content()
-                                except Exception:
-                                    p_content = ""
+    async def crawl_pool(self, browser, lang_code, throughput):
+        """
+        Pool engine: `slot_size` workers share the queue and each one starts a new navigation as soon as its
+        previous page is done, so a slow page only holds up its own slot.
+        """
+        scheduler = politeness.HostScheduler(self.link_queue[lang_code], self.hosts, self.slot_size,
+                                             self.frontier_mode == "priority")
+        cond = asyncio.Condition()
+        fetching = set()
+        limit_reached = False
 
-                                more_links, discarded = tools.retrieve_more_links(self.valid_hosts, p.url, p_content, self.patterns)
+        def pop_url():
+            u = scheduler.pop()
+            while u is not None and u in fetching:
+                scheduler.done(u)
+                u = scheduler.pop()
+            return u
 
-                                for link in discarded:
-                                    if link not in self.visited[lang_code]:
-                                        logger.logger.info(f"Discarding link {link}")
-                                        self.visited[lang_code].add(link)
+        async def worker():
+            nonlocal limit_reached
+            while not limit_reached:
+                async with cond:
+                    u = pop_url()
+                    while u is None and (len(fetching) > 0 or scheduler.size > 0) and not limit_reached:
+                        try:
+                            await asyncio.wait_for(cond.wait(), scheduler.next_ready())
+                        except asyncio.TimeoutError:
+                            pass
+                        u = pop_url()
+                    if u is None or limit_reached:
+                        cond.notify_all()
+                        return
+                    fetching.add(u)
 
-                                for link in more_links:
-                                    if link not in self.visited[lang_code]:
-                                        self.link_queue.append(link)
+                depth = self.depths.pop((lang_code, u), 0)
+                completed = False
+                try:
+                    stored = True if self.previous and await self.revalidate(u, lang_code) else None
+                    if stored is None and self.fetcher:
+                        stored = await self.fetch_static(u, lang_code, depth)
+                    if stored is None:
+                        await browser.recycle_if_due()
+                        p = await self.open_page(browser, u, lang_code)
+                        stored = p is not None and await self.process_page(p, lang_code, depth)
+                    if stored:
+                        throughput.tick()
+                    completed = True
+                except ValueError:
+                    limit_reached = True
+                finally:
+                    # when the limit is reached or the crawl is interrupted, a page not stored is crawled again on
+                    # resume
+                    if completed:
+                        self.visited[lang_code].add(u)
+                    if u in self.visited[lang_code]:
+                        scheduler.done(u)
+                    else:
+                        scheduler.requeue(u)
+                    async with cond:
+                        fetching.discard(u)
+                        cond.notify_all()
 
-                                p.close(run_before_unload=False)
+        try:
+            await gather_or_cancel(*[worker() for _ in range(self.slot_size)])
+        finally:
+            scheduler.release()
 
-                            self.link_queue = list(np.delete(self.link_queue, indices))
-                            self.link_queue = list(set(self.link_queue))  # unique links
+        if limit_reached:
+            raise ValueError(f"The limit Crawler.max_pages of {self.max_pages} has been reached")
 
-                            if no_action_performed:
-                                self.link_queue = [i for i in self.link_queue if i not in self.visited[lang_code]]
-                                if len(self.link_queue) > 0:
-                                    continue
-                                else:
-                                    break
+    async def crawl_locale(self, default_browser, workdir, lang_code):
+        logger.logger.info(f"Starting with [{lang_code}] locale...")
+        dir_context = os.path.join(workdir, lang_code)
+        os.mkdir(dir_context)
+        browser = self.browser_supervisor(default_browser, dir_context, lang_code)
+        await browser.launch()
 
-        logger.logger.info("Crawling ends. Generating HTML output")
-        json_src = os.path.join(self.destination, "json")
-        html_trg = os.path.join(self.destination, "html")
-        output.generate_output(json_src, html_trg)
+        """
+        Experimental support for cookie dialog: search any button containing accep acep ok and click
+        in the entry page
+        """
+        await self.try_to_accept_cookies(browser.context)
 
-        core_file = os.path.join(self.destination, "crawler.json.zst")
-        if os.path.exists(core_file):
-            logger.logger.info("Cleaning persistent crawler file")
-            os.unlink(core_file)
+        # if not resuming stopped crawl (the frontier may have been seeded from sitemaps or a previous crawl)
+        if len(self.visited[lang_code]) == 0:
+            seed_priority = priority.SEED_SCORE if self.frontier_mode == "priority" else None
+            for i in self.url:
+                if self.owns(i):
+                    self.link_queue[lang_code].add(i, seed_priority)
+        else:
+            logger.logger.info(f"Resuming partial crawl of [{lang_code}] locale...")
+
+        throughput = Throughput(f"{self.engine}:{lang_code}")
+        try:
+            while True:
+                if self.engine == "pool":
+                    await self.crawl_pool(browser, lang_code, throughput)
+                else:
+                    await self.crawl_batch(browser, lang_code, throughput)
+                if self.coordinator is None or not await self.wait_for_links(lang_code):
+                    break
+        finally:
+            throughput.report()
+            self.url_filter.report()
+            self.resource_blocker.report()
+            if self.fetcher:
+                self.fetcher.report()
+            if self.near_duplicates:
+                self.near_duplicates.report()
+            self.hosts.report()
+            self.readiness.report()
+            self.alignment.report()
+            await browser.close()
+
+        self.done_locales.add(lang_code)
+        logger.logger.info(f"Finished with [{lang_code}] locale")
+
+    async def crawl_async(self):
+        self.start_journal()
+        self.url_filter = tools.UrlFilter(self.host_matcher, self.patterns,
+                                          self.skip_extensions or tools.FORBIDDEN_EXTENSIONS, self.exclude_patterns)
+        self.resource_blocker = blocking.ResourceBlocker(self.block_resources, self.block_urls)
+        if self.near_duplicate_distance > 0:
+            self.near_duplicates = dedup.SimHashIndex(self.near_duplicate_distance, self.simhashes)
+        self.hosts = politeness.HostController(self.slot_size, self.min_delay, self.adaptive_hosts)
+        self.readiness = readiness.Readiness(self.readiness_strategy, self.quiet_time, self.max_inflight)
+        self.startup = startup.StartupCache(self.destination)
+        self.alignment = priority.Alignment(self.locales)
+        if self.fetch_mode == "hybrid" and not self.downloader:
+            self.fetcher = fetcher.HttpFetcher(max_connections=self.slot_size * len(self.locales), hosts=self.hosts)
+        if self.coordinator_file:
+            self.coordinator = sharding.Coordinator(self.coordinator_file, self.worker, self.workers, self.partition)
+            if not self.downloader:
+                self.coordinator.register([i for i in self.locales if i not in self.done_locales])
+        self.register_gauges()
+        if self.previous_dir:
+            if self.previous is None:
+                self.previous = recrawl.PreviousCrawl(self.previous_dir)
+            self.revalidator = self.fetcher or fetcher.HttpFetcher(max_connections=self.slot_size * len(self.locales),
+                                                                   hosts=self.hosts)
+            self.seed_from_previous()
+        if self.sitemaps and not self.sitemaps_done and not self.downloader:
+            await self.seed_from_sitemaps()
+        stats = asyncio.ensure_future(metrics.registry.write_periodically(os.path.join(self.destination, "stats.json")))
+        checkpoints = asyncio.ensure_future(self.checkpoint_periodically())
+        server = await metrics.registry.serve(self.metrics_port) if self.metrics_port else None
+        try:
+            with (tempfile.TemporaryDirectory() as workdir):
+                async with async_playwright() as pw:
+                    default_browser = pw.chromium
+                    if await self.test_kelloggs_problem(pw):
+                        default_browser = pw.firefox
+
+                    pending = [i for i in self.locales if i not in self.done_locales]
+                    try:
+                        if self.downloader:
+                            await self.download(default_browser, workdir)
+                        elif self.parallel_locales:
+                            # one persistent context (and browser process) per locale, all of them at the same time
+                            await gather_or_cancel(*[self.crawl_locale(default_browser, workdir, i) for i in pending])
+                        else:
+                            for lang_code in pending:
+                                await self.crawl_locale(default_browser, workdir, lang_code)
+                    except ValueError:
+                        logger.logger.warning(f"Maximum number of {self.max_pages} pages has been reached")
+                        self.checkpoint(force=True)
+                        self.close_storage()
+                        logger.logger.info("Crawling ends. Generating HTML output")
+                        json_src = os.path.join(self.destination, "json")
+                        html_trg = os.path.join(self.destination, "html")
+                        output.generate_output(json_src, html_trg)
+                        return
+                    finally:
+                        if self.fetcher:
+                            await self.fetcher.close()
+                        if self.revalidator and self.revalidator is not self.fetcher:
+                            await self.revalidator.close()
+
+            self.close_storage()
+            logger.logger.info("Crawling ends. Generating HTML output")
+            json_src = os.path.join(self.destination, "json")
+            html_trg = os.path.join(self.destination, "html")
+            output.generate_output(json_src, html_trg)
+
+            core_file = os.path.join(self.destination, "crawler.json.zst")
+            if os.path.exists(core_file):
+                logger.logger.info("Cleaning persistent crawler file")
+                os.unlink(core_file)
+            self.journal.remove()
+            if self.disk_store:
+                logger.logger.info("Cleaning disk store")
+                self.disk_store.remove()
+        finally:
+            if self.coordinator:
+                # whatever the reason, so that the other workers do not wait for this one
+                self.coordinator.stop()
+                self.coordinator.report()
+                self.coordinator.close()
+                self.coordinator = None
+            stats.cancel()
+            checkpoints.cancel()
+            await asyncio.gather(stats, checkpoints, return_exceptions=True)
+            if server:
+                server.close()
+                await server.wait_closed()
+
+    def register_gauges(self):
+        """
+        Crawl state exported with the metrics (stats.json and the Prometheus endpoint).
+        """
+        registry = metrics.registry
+        registry.gauge("pages", lambda: self.idx)
+        registry.gauge("rss_bytes", metrics.rss)
+        registry.gauge("aligned_pages", lambda: self.alignment.aligned)
+        registry.gauge("renders", lambda: self.alignment.rendered)
+        for i in self.locales:
+            registry.gauge("frontier", lambda i=i: len(self.link_queue[i]), lang=i)
+            registry.gauge("visited", lambda i=i: len(self.visited[i]), lang=i)
+        for i in tools.UrlFilter.RULES:
+            registry.gauge("links", lambda i=i: self.url_filter.hits[i], rule=i)
+        if self.coordinator:
+            coordinator = self.coordinator
+            registry.gauge("links_routed", lambda: coordinator.sent, direction="sent")
+            registry.gauge("links_routed", lambda: coordinator.received, direction="received")
+
+    def crawl(self):
+        asyncio.run(self.crawl_async())
 
     def to_json(self):
+        if self.disk_store:
+            state = {"link_queue": {}, "visited": {}, "hashes": [], "hashes_click": {}, "simhashes": []}
+        else:
+            state = {
+                "link_queue": {i: self.link_queue[i].to_json() for i in self.link_queue},
+                "visited": {i: list(self.visited[i]) for i in self.visited},
+                "hashes": list(self.hashes),
+                "hashes_click": {i: list(self.hashes_click[i]) for i in self.hashes_click},
+                "simhashes": list(self.simhashes)
+            }
+
         obj = {
             "url": self.url,
             "original_url": self.original_url,
-            "link_queue": self.link_queue,
             "locales": self.locales,
-            "visited": {i: list(self.visited[i]) for i in self.visited},
-            "hashes": list(self.hashes),
-            "hashes_click": {i: list(self.hashes_click[i]) for i in self.hashes_click},
             "valid_hosts": list(self.valid_hosts),
             "patterns": self.patterns,
+            "skip_extensions": self.skip_extensions,
+            "exclude_patterns": self.exclude_patterns,
+            "block_resources": self.block_resources,
+            "block_urls": self.block_urls,
+            "fetch_mode": self.fetch_mode,
+            "min_delay": self.min_delay,
+            "adaptive_hosts": self.adaptive_hosts,
+            "recycle_pages": self.recycle_pages,
+            "max_browser_memory": self.max_browser_memory,
+            "worker": self.worker,
+            "workers": self.workers,
+            "partition": self.partition,
+            "coordinator_file": self.coordinator_file,
+            "readiness_strategy": self.readiness_strategy,
+            "sitemaps": self.sitemaps,
+            "sitemaps_done": self.sitemaps_done,
+            "max_sitemap_urls": self.max_sitemap_urls,
+            "previous_dir": self.previous_dir,
+            "frontier_mode": self.frontier_mode,
+            "quiet_time": self.quiet_time,
+            "max_inflight": self.max_inflight,
             "destination": self.destination,
             "idx": self.idx,
             "max_pages": self.max_pages,
             "no_links": self.no_links,
             "max_no_links": self.max_no_links,
-            "current_locale": self.current_locale,
+            "done_locales": list(self.done_locales),
+            "parallel_locales": self.parallel_locales,
             "slot_size": self.slot_size,
-            "downloader": self.downloader
+            "downloader": self.downloader,
+            "max_retries": self.max_retries,
+            "engine": self.engine,
+            "disk_store": self.disk_store is not None,
+            "journal_generation": self.journal_generation,
+            "storage_mode": self.storage_mode,
+            "shard_size": self.shard_size,
+            "dictionary_samples": self.dictionary_samples,
+            "near_duplicate_distance": self.near_duplicate_distance,
+            **state
         }
 
         return obj
 
+    def start_journal(self):
+        """
+        Writes a fresh snapshot and from then on records every state change in the journal (crawler.journal) instead
+        of rewriting the whole state.
+        """
+        if self.journal:
+            return
+        self.persist()
+        self.journal = journal.Journal(os.path.join(self.destination, "crawler.journal"), self.journal_generation)
+        if not self.disk_store:
+            self.link_queue = {i: journal.JournaledFrontier(self.link_queue[i], self.journal, i) for i in self.locales}
+            self.visited = {i: journal.JournaledSet(self.visited[i], self.journal, "v", i) for i in self.locales}
+            self.hashes = journal.JournaledSet(self.hashes, self.journal, "h")
+            self.hashes_click = {i: journal.JournaledSet(self.hashes_click[i], self.journal, "c", i)
+                                 for i in self.locales}
+            self.simhashes = journal.JournaledSet(self.simhashes, self.journal, "s")
+        self.done_locales = journal.JournaledSet(self.done_locales, self.journal, "l")
+
+    def apply_journal_record(self, record):
+        op, *args = record
+        if op == "q":
+            self.link_queue[args[0]].add(args[1], args[2])
+        elif op == "r":
+            self.link_queue[args[0]].promote(args[1], args[2])
+        elif op == "d":
+            self.link_queue[args[0]].discard(args[1])
+        elif op == "v":
+            self.visited[args[0]].add(args[1])
+        elif op == "h":
+            self.hashes.add(args[0])
+        elif op == "c":
+            self.hashes_click[args[0]].add(args[1])
+        elif op == "s":
+            self.simhashes.add(args[0])
+        elif op == "l":
+            self.done_locales.add(args[0])
+        elif op == "i":
+            self.idx = args[0]
+
+    def close_storage(self):
+        if self.storage:
+            self.storage.close()
+            self.storage = None
+
+    def checkpoint(self, force=False):
+        """
+        Makes the crawling state durable: syncs the journal every few seconds (or right now if `force`), and compacts
+        it into a new snapshot once it holds more records than the last snapshot.
+        """
+        if self.journal is None:
+            self.persist()
+            return
+
+        if force or self.journal.due():
+            with metrics.registry.timer("checkpoint"):
+                if self.coordinator:
+                    # the links of the other workers are handed over before the pages they come from are durable
+                    self.coordinator.flush()
+                    for lang_code, url in self.coordinator.receive():
+                        self.link_queue[lang_code].add(url, self.priority(url))
+                if self.storage:
+                    self.storage.flush()
+                if self.disk_store:
+                    self.disk_store.commit()
+                self.journal.flush()
+                if self.coordinator:
+                    self.coordinator.acknowledge()
+
+        if self.journal.records > max(JOURNAL_MIN_RECORDS, self.snapshot_size):
+            logger.logger.info(f"Compacting {self.journal.records} journal records into a new snapshot")
+            with metrics.registry.timer("compaction"):
+                self.persist()
+
+    async def checkpoint_periodically(self):
+        """
+        Calls checkpoint() whenever the journal is due for a sync, so that it is synced while no page is being stored
+        (runs of duplicates, out of scope or failing pages, or a worker waiting for links).
+        """
+        while True:
+            await asyncio.sleep(max(0.0, self.journal.last_flush + self.journal.interval - time.monotonic()))
+            self.checkpoint()
+
     def persist(self):
-        with zstandard.open(os.path.join(self.destination, "crawler.json.zst"), "wt") as fstore:
+        """
+        Writes the whole crawling state (snapshot) and starts a new, empty journal generation.
+        """
+        if self.disk_store:
+            self.disk_store.commit()
+        self.journal_generation += 1
+        dumpfile = os.path.join(self.destination, "crawler.json.zst")
+        with zstandard.open(f"{dumpfile}.tmp", "wt") as fstore:
             fstore.write(json.dumps(self.to_json()))
+        os.replace(f"{dumpfile}.tmp", dumpfile)  # a kill while writing leaves the previous snapshot in place
+        if not self.disk_store:
+            self.snapshot_size = len(self.hashes) + len(self.simhashes) + sum(len(self.visited[i]) + len(self.link_queue[i])
+                                                        for i in self.locales)
+        if self.journal:
+            self.journal.reset(self.journal_generation)
@@ -0,0 +1,80 @@
+import re
+
+import xxhash
+
+from scrawl import logger
+
+BITS = 64
+LANE = 32
+# largest near-duplicate distance: up to 8 bits, every band keeps at least 7 bits (128 buckets); beyond that the
+# buckets hold most of the fingerprints and the index becomes a linear scan
+MAX_DISTANCE = 8
+WORD = re.compile(r"\w+")
+# byte -> its 8 bits spread over 8 lanes of LANE bits, so that summing spread hashes counts every bit position at once
+SPREAD = [sum(((b >> i) & 1) << (LANE * i) for i in range(8)) for b in range(256)]
+
+
+def shingles(text, size=4):
+    words = WORD.findall(text.lower())
+    if len(words) <= size:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+def simhash(text, size=4):
+    """
+    64-bit SimHash of the word `size`-shingles of `text`: bit i is set if it is set in most shingle hashes.
+    """
+    features = [xxhash.xxh64_intdigest(i) for i in shingles(text, size)]
+    counts = 0
+    for h in features:
+        for j in range(BITS // 8):
+            counts += SPREAD[(h >> (8 * j)) & 0xFF] << (LANE * 8 * j)
+    mask = (1 << LANE) - 1
+    fingerprint = 0
+    for i in range(BITS):
+        if 2 * ((counts >> (LANE * i)) & mask) > len(features):
+            fingerprint |= 1 << i
+    return fingerprint
+
+
+class SimHashIndex:
+    """
+    Near-duplicate detection: two texts are near-duplicates if their SimHashes differ in at most `max_distance` bits.
+    The fingerprint is split in `max_distance` + 1 bands, so a near-duplicate matches at least one band exactly and
+    only the fingerprints sharing a band are compared, which only pays off up to MAX_DISTANCE. `fingerprints` is the
+    crawler set (hex strings) that keeps them across resumes; it is indexed on creation.
+    """
+    def __init__(self, max_distance, fingerprints):
+        self.max_distance = max_distance
+        self.fingerprints = fingerprints
+        bands = max_distance + 1
+        self.bands = [(BITS * i // bands, BITS * (i + 1) // bands) for i in range(bands)]
+        self.tables = [{} for _ in self.bands]
+        self.skipped = 0
+        for i in fingerprints:
+            self.index(int(i, 16))
+
+    def keys(self, fingerprint):
+        return [(fingerprint >> start) & ((1 << (end - start)) - 1) for start, end in self.bands]
+
+    def index(self, fingerprint):
+        for table, key in zip(self.tables, self.keys(fingerprint)):
+            table.setdefault(key, []).append(fingerprint)
+
+    def find(self, fingerprint):
+        """
+        Returns an indexed fingerprint within `max_distance` bits of `fingerprint`, or None.
+        """
+        for table, key in zip(self.tables, self.keys(fingerprint)):
+            for i in table.get(key, ()):
+                if (i ^ fingerprint).bit_count() <= self.max_distance:
+                    return i
+        return None
+
+    def add(self, fingerprint):
+        self.fingerprints.add(f"{fingerprint:016x}")
+        self.index(fingerprint)
+
+    def report(self):
+        logger.logger.info(f"Near-duplicates skipped: {self.skipped} (SimHash distance <= {self.max_distance} bits)")
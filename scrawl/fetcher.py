@@ -0,0 +1,182 @@
+import re
+import time
+from urllib.parse import urlparse
+
+import httpx
+import xxhash
+from bs4 import BeautifulSoup, Comment
+from bs4.dammit import EncodingDetector
+
+from scrawl import logger, tools
+
+FETCH_MODES = ("browser", "hybrid")
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+HTML_TYPES = ("text/html", "application/xhtml+xml")
+# content types that say nothing about the body: look at its first bytes, like browsers do
+SNIFF_TYPES = ("", "application/octet-stream", "application/unknown", "unknown/unknown", "*/*")
+HTML_SIGNATURE = re.compile(rb"^(?:\xef\xbb\xbf)?\s*(?:<!--|<(?:!doctype html|html|head|script|iframe|h1|div|font|table|"
+                            rb"a|style|title|b|body|br|p)[\s>])", re.IGNORECASE)
+# answers that a real browser may well get past (bot protection, overload)
+ESCALATE_STATUS = (403, 429)
+# mount points of client-side frameworks, empty until their JavaScript runs
+SPA_ROOT_IDS = ("root", "app", "__next", "__nuxt", "___gatsby", "svelte", "q-app")
+SPA_ROOT_TAGS = ("app-root",)
+SPA_ROOT_ATTRIBUTES = ("ng-app", "data-reactroot")
+INVISIBLE_TAGS = ("script", "style", "noscript", "template")
+# kept in the record of a page, to revalidate it when it is crawled again
+VALIDATORS = ("etag", "last_modified", "http_hash")
+
+
+class HttpFetcher:
+    """
+    Plain HTTP/2 client (pooled keep-alive connections) for the hybrid fetch mode: pages are fetched without a
+    browser and only escalated to one when they look client-rendered, failed, or were refused. Responses that are not
+    HTML are dropped after reading their headers. With a politeness.HostController in `hosts`, requests use the
+    timeout of their host and report their outcome to it.
+    """
+    def __init__(self, max_connections=10, timeout=10.0, max_size=10 * 2**20, min_text=200, hosts=None):
+        self.client = httpx.AsyncClient(http2=True, follow_redirects=True, timeout=timeout,
+                                        headers={"User-Agent": USER_AGENT},
+                                        limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_connections))
+        self.max_size = max_size
+        self.min_text = min_text
+        self.hosts = hosts
+        # (verdict, reason) -> number of URLs
+        self.outcomes = {}
+
+    def verdict(self, verdict, reason, url, snapshot=None):
+        self.outcomes[(verdict, reason)] = self.outcomes.get((verdict, reason), 0) + 1
+        if verdict != "static":
+            logger.logger.debug(f"HTTP fetch of {url}: {verdict} ({reason})")
+        return verdict, url, snapshot
+
+    async def fetch(self, url, lang_code):
+        """
+        Returns (verdict, final url, snapshot). verdict is "static" (snapshot as returned by tools.html_snapshot),
+        "render" (the page has to be loaded in the browser) or "skip" (not HTML).
+        """
+        host = urlparse(url).netloc
+        timeout = self.hosts.timeout(host) / 1000 if self.hosts else httpx.USE_CLIENT_DEFAULT
+        if self.hosts:
+            await self.hosts.turn(host)
+        start = time.monotonic()
+        try:
+            async with self.client.stream("GET", url, headers={"Accept-Language": lang_code}, timeout=timeout) as r:
+                if self.hosts:
+                    self.hosts.response(host, time.monotonic() - start, r.status_code, r.headers)
+                final_url = str(r.url)
+                if r.status_code in ESCALATE_STATUS or r.status_code >= 500:
+                    return self.verdict("render", f"http-{r.status_code}", url)
+
+                content_type = r.headers.get("content-type", "").split(";")[0].strip().lower()
+                if content_type not in HTML_TYPES and content_type not in SNIFF_TYPES:
+                    return self.verdict("skip", content_type, final_url)
+
+                body = bytearray()
+                async for chunk in r.aiter_bytes():
+                    body += chunk
+                    if len(body) > self.max_size:
+                        return self.verdict("render", "too-large", url)
+                charset = r.charset_encoding
+                headers = r.headers
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            if self.hosts:
+                self.hosts.failure(host, timeout=isinstance(e, httpx.TimeoutException))
+            return self.verdict("render", type(e).__name__, url)
+
+        if content_type in SNIFF_TYPES and not HTML_SIGNATURE.match(body[:512]):
+            return self.verdict("skip", content_type or "no-content-type", final_url)
+
+        html = decode(bytes(body), charset)
+        soup = BeautifulSoup(html, "lxml")
+        reason = self.needs_rendering(soup)
+        if reason:
+            return self.verdict("render", reason, url)
+        snapshot = tools.html_snapshot(final_url, html, soup)
+        snapshot["validators"] = validators(headers, xxhash.xxh64(body).hexdigest())
+        return self.verdict("static", content_type or "sniffed", final_url, snapshot)
+
+    async def revalidate(self, url, lang_code, entry):
+        """
+        Conditional request for a page stored by an earlier crawl (a recrawl.Entry): If-None-Match and
+        If-Modified-Since with its validators, and if the page is sent anyway, the xxh64 of the body compared with the
+        earlier one. Returns ("unchanged" or "changed", validators of the response), or (None, {}) if it cannot tell.
+        """
+        host = urlparse(url).netloc
+        timeout = self.hosts.timeout(host) / 1000 if self.hosts else httpx.USE_CLIENT_DEFAULT
+        headers = {"Accept-Language": lang_code}
+        if entry.etag:
+            headers["If-None-Match"] = entry.etag
+        if entry.last_modified:
+            headers["If-Modified-Since"] = entry.last_modified
+        if self.hosts:
+            await self.hosts.turn(host)
+        start = time.monotonic()
+        try:
+            async with self.client.stream("GET", url, headers=headers, timeout=timeout) as r:
+                if self.hosts:
+                    self.hosts.response(host, time.monotonic() - start, r.status_code, r.headers)
+                if r.status_code == 304:
+                    return "unchanged", validators(r.headers)
+                if r.status_code != 200 or str(r.url) != url:
+                    return None, {}
+                body = bytearray()
+                async for chunk in r.aiter_bytes():
+                    body += chunk
+                    if len(body) > self.max_size:
+                        return None, {}
+        except (httpx.HTTPError, httpx.InvalidURL) as e:
+            if self.hosts:
+                self.hosts.failure(host, timeout=isinstance(e, httpx.TimeoutException))
+            return None, {}
+        found = validators(r.headers, xxhash.xxh64(body).hexdigest())
+        return ("unchanged" if found["http_hash"] == entry.http_hash else "changed"), found
+
+    def needs_rendering(self, soup):
+        """
+        Heuristics for client-rendered pages: an empty framework mount point, or almost no visible text.
+        """
+        if soup.body is None:
+            return "no-body"
+        for root in (soup.find(id=SPA_ROOT_IDS), soup.find(SPA_ROOT_TAGS),
+                     *(soup.find(attrs={i: True}) for i in SPA_ROOT_ATTRIBUTES)):
+            if root is not None and visible_text_length(root) == 0:
+                return "spa-root"
+        if visible_text_length(soup.body) < self.min_text:
+            return "empty-body"
+        return None
+
+    async def close(self):
+        await self.client.aclose()
+
+    def report(self):
+        if len(self.outcomes) == 0:
+            return
+        outcomes = ", ".join(f"{verdict}:{reason}={n}" for (verdict, reason), n in sorted(self.outcomes.items()))
+        logger.logger.info(f"HTTP fetch: {outcomes}")
+
+
+def validators(headers, http_hash=None):
+    """
+    What is kept of a response to revalidate it later: its ETag and Last-Modified headers, and the xxh64 of its body.
+    """
+    found = {"etag": headers.get("etag"), "last_modified": headers.get("last-modified"), "http_hash": http_hash}
+    return {i: found[i] for i in VALIDATORS if found[i]}
+
+
+def decode(body, charset=None):
+    """
+    Decodes an HTML body with the charset of the Content-Type header, or else the one declared in the document.
+    """
+    for encoding in (charset, EncodingDetector.find_declared_encoding(body, is_html=True), "utf-8"):
+        if encoding:
+            try:
+                return body.decode(encoding, errors="replace")
+            except LookupError:
+                continue
+
+
+def visible_text_length(element):
+    return sum(len(i.strip()) for i in element.find_all(string=True)
+               if i.parent.name not in INVISIBLE_TAGS and not isinstance(i, Comment))
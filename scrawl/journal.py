@@ -0,0 +1,162 @@
+import json
+import os
+import time
+
+from scrawl import logger
+
+
+class Journal:
+    """
+    Append-only log of crawler state changes, one JSON array per line, written next to the crawler.json.zst snapshot.
+    The first line holds the generation of the snapshot the journal applies to, so a journal left behind by a crash
+    during compaction is recognised as stale and ignored. Lines are flushed and synced at most every `interval`
+    seconds, which bounds what a crash can lose.
+    """
+    def __init__(self, filename, generation, interval=2.0):
+        self.filename = filename
+        self.interval = interval
+        self.records = 0
+        self.last_flush = time.monotonic()
+        self.file = None
+        self.reset(generation)
+
+    def reset(self, generation):
+        """
+        Starts an empty journal for snapshot `generation`.
+        """
+        if self.file:
+            self.file.close()
+        self.file = open(self.filename, "wt")
+        self.generation = generation
+        self.records = 0
+        self.write("g", generation)
+        self.flush()
+
+    def write(self, *record):
+        self.file.write(json.dumps(record))
+        self.file.write("\n")
+        self.records += 1
+
+    def due(self):
+        return time.monotonic() - self.last_flush >= self.interval
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def remove(self):
+        self.file.close()
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+
+    @staticmethod
+    def replay(filename, generation):
+        """
+        Yields the records of the journal for snapshot `generation`, nothing if there is no such journal. A truncated
+        last line (crash in the middle of a write) is skipped.
+        """
+        if not os.path.exists(filename):
+            return
+        with open(filename, "rt") as fjournal:
+            for n, line in enumerate(fjournal):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.logger.warning(f"Skipping truncated journal record at line {n + 1} of {filename}")
+                    continue
+                if n == 0:
+                    if record != ["g", generation]:
+                        logger.logger.info(f"Ignoring stale journal {filename}")
+                        return
+                    continue
+                yield record
+
+
+class JournaledSet:
+    """
+    Set wrapper that writes every new item to the journal as `(*prefix, item)`.
+    """
+    def __init__(self, items, journal, *prefix):
+        self.items = items
+        self.journal = journal
+        self.prefix = prefix
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.items
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def add(self, item):
+        if item not in self.items:
+            self.items.add(item)
+            self.journal.write(*self.prefix, item)
+
+    def update(self, items):
+        for i in items:
+            self.add(i)
+
+
+class JournaledFrontier:
+    """
+    crawler.Frontier wrapper that writes enqueued ("q"), promoted ("r") and removed ("d") URLs to the journal. Popped
+    URLs are only written as removed once done() is called, so a replayed journal queues again the URLs that were
+    in flight when the crawl stopped.
+    """
+    def __init__(self, frontier, journal, lang):
+        self.frontier = frontier
+        self.journal = journal
+        self.lang = lang
+
+    def __len__(self):
+        return len(self.frontier)
+
+    def __contains__(self, url):
+        return url in self.frontier
+
+    def __iter__(self):
+        return iter(self.frontier)
+
+    def add(self, url, priority=None):
+        if self.frontier.add(url, priority):
+            self.journal.write("q", self.lang, url, priority)
+            return True
+        return False
+
+    def promote(self, url, priority):
+        if self.frontier.promote(url, priority):
+            self.journal.write("r", self.lang, url, priority)
+            return True
+        return False
+
+    def discard(self, url):
+        if url in self.frontier:
+            self.frontier.discard(url)
+            self.journal.write("d", self.lang, url)
+
+    def pop_random(self):
+        return self.frontier.pop_random()
+
+    def pop_best(self):
+        return self.frontier.pop_best()
+
+    def done(self, url):
+        if self.frontier.done(url):
+            self.journal.write("d", self.lang, url)
+            return True
+        return False
+
+    def requeue(self, url):
+        # still queued as far as the journal is concerned
+        self.frontier.requeue(url)
+
+    def to_json(self):
+        return self.frontier.to_json()
@@ -5,13 +5,60 @@ Usage:
   scrawl crawl [options] <locale_list> file <url_list_filename> <working_directory>
   scrawl download [options] <url_list> <working_directory>
   scrawl download file [options] <url_list_filename> <working_directory>
+  scrawl recrawl [options] <previous_directory> <working_directory>
   scrawl resume [options] <working_directory>
 
 Options:
   -h --help                          Shows this help.
   --patterns=<pattern-list>          Force string to be part of the url.
+  --exclude-patterns=<pattern-list>  Links containing any of these strings are not followed.
+  --sitemaps                         Also queue the URLs listed in the sitemaps of the seed hosts (from their robots.txt,
+                                     or /sitemap.xml) that pass the filters, before crawling.
+  --max-sitemap-urls=<n>             Maximum number of URLs read from sitemaps [default: 1000000].
+  --skip-extensions=<ext-list>       File extensions of links that are not followed, replacing the built-in list.
   --max-pages=<n>                    Maximum number of pages to store, 0 for no limit [default: 10000000].
   --simultaneous-pages=<n>           Number of windows opened at once [default: 10].
+  --retries=<n>                      Attempts per URL before giving it up, in download mode [default: 3].
+  --engine=<name>                    One of: batch (lock-step slots), pool (continuously-full page pool) [default: batch].
+  --frontier=<mode>                  Which queued URL is crawled next, one of: random, priority (translations of stored
+                                     pages, hreflang alternates and pages in <locale_list> languages first, then
+                                     shallower pages, from what is known about the last 200000 URLs)
+                                     [default: random].
+  --parallel-locales                 Crawl all locales at the same time, one browser context per locale.
+  --min-delay=<seconds>              Minimum time between the start of two requests to the same host [default: 0].
+  --adaptive-hosts                   Adapt the number of simultaneous pages (up to --simultaneous-pages) and the timeout of
+                                     every host to its latency, errors and timeouts.
+  --fetch=<mode>                     One of: browser (render every page), hybrid (plain HTTP first, browser only for
+                                     pages that look client-rendered) [default: browser].
+  --readiness=<strategy>             When a page is ready to be stored, one of: load (load event), domcontentloaded,
+                                     dom-quiet (no DOM change for --quiet-time), network-quiet (at most --max-inflight
+                                     requests for --quiet-time), learned (load event, waited for up to 1.5 times the
+                                     p90 load time of the host). Pages not ready in time are stored as they are
+                                     [default: load].
+  --quiet-time=<ms>                  Quiet period of the dom-quiet and network-quiet strategies [default: 500].
+  --max-inflight=<n>                 Requests still in flight that count as network-quiet [default: 2].
+  --block-resources=<type-list>      Resource types the browser does not download, or none [default: image,media,font].
+  --block-urls=<pattern-list>        Requests containing any of these strings are not made, "trackers" for the built-in
+                                     list of trackers, ads and media players, or none [default: trackers].
+  --near-duplicates=<bits>           Skip pages whose body text SimHash is within this many bits (of 64) of an already
+                                     stored page, 0 to only skip exact duplicates, at most 8 so that the SimHash index
+                                     stays fast [default: 0].
+  --recycle-pages=<n>                Relaunch the browser of a locale after this many pages, 0 for never [default: 0].
+  --max-browser-memory=<MiB>         Relaunch the browser of a locale when its processes use more memory, 0 for no
+                                     limit [default: 4096].
+  --disk-store                       Keep the frontier, visited URLs and hashes in an SQLite file instead of memory.
+  --storage=<mode>                   One of: files (one .json.zst per page), shards (rolling .jsonl.zst shards) [default: files].
+  --shard-size=<n>                   Maximum number of pages per shard [default: 10000].
+  --dictionary-samples=<n>           Train a zstd dictionary per host on its first n pages, 0 to disable [default: 0].
+  --workers=<n>                      Crawl with this many scrawl processes, each one with its own browsers, share of the
+                                     URLs and output in <working_directory>/worker<k> [default: 1].
+  --partition=<key>                  How URLs are shared out between workers, by a hash of their: host, url
+                                     [default: host].
+  --worker=<k/n>                     Run only worker k (from 0) of a crawl with n workers, to spread a crawl over several
+                                     machines. Requires --coordinator, and --max-pages applies to all the workers.
+  --coordinator=<file>               SQLite file shared by the workers of the crawl, through which they pass each other
+                                     the links they find.
+  --metrics-port=<port>              Serve the crawl metrics in the Prometheus text format on this local port.
   --loglevel=<value>                 One of: warning, info, debug, error [default: info].
   --logfile=<value>                  Log filename.
 """
@@ -23,7 +70,7 @@ import re
 import docopt
 import schema
 import iso639
-from scrawl import tools, crawler, output, logger
+from scrawl import tools, crawler, output, logger, storage, blocking, fetcher, sharding, readiness, priority, dedup
 import sys
 import signal
 
@@ -34,7 +81,7 @@ def main():
 
         logger.logger.info("Signal received: exiting program")
         logger.logger.info("Persisting crawler")
-        c.persist()
+        c.checkpoint(force=True)
         logger.logger.info("Generating output")
         output.generate_output(os.path.join(c.destination, "json"),
                                os.path.join(c.destination, "html"))
@@ -53,24 +100,76 @@ def main():
                                 lambda url_list: all(re.match("^http[s]://", n.strip()) for n in url_list.split(",")),
                                 error="URLs must start with http:// or https://"),
         '<working_directory>': schema.And(tools.is_path_exists_or_creatable, error="cannot create output"),
+        '<previous_directory>': schema.Or(None, schema.And(os.path.isdir, error="<previous_directory> does not exist")),
         '<url_list_filename>': schema.Or(None,
                                          schema.And(lambda f: os.path.exists(f) and os.path.isfile(f),
                                                     error="the file <url_list_filename> does not exist")),
         '<locale_list>': schema.Or(None, schema.And(lambda n: all(i.strip() in iso639.languages.part1 for i in n.split(",")),
                                     error="all locales specified must be 2-letter ISO-639 codes")),
         '--patterns': schema.Or(None, schema.And(lambda n: all(len(i.strip()) > 0 for i in n.split(",")), error="--patterns have to be non-empty")),
+        '--exclude-patterns': schema.Or(None, schema.And(lambda n: all(len(i.strip()) > 0 for i in n.split(",")),
+                                                         error="--exclude-patterns have to be non-empty")),
+        '--skip-extensions': schema.Or(None, schema.And(lambda n: all(len(i.strip()) > 0 for i in n.split(",")),
+                                                        error="--skip-extensions have to be non-empty")),
+        '--sitemaps': schema.And(schema.Use(bool)),
+        '--max-sitemap-urls': schema.And(schema.Use(int), lambda n: n > 0, error="--max-sitemap-urls should be > 0"),
         '--max-pages': schema.And(schema.Use(int), lambda n: n >= 0, error='--max-pages should be >= 0'),
         '--simultaneous-pages': schema.And(schema.Use(int), lambda n: n >= 1, error="--simultaneous-pages should be >= 1"),
+        '--retries': schema.And(schema.Use(int), lambda n: n >= 1, error="--retries should be >= 1"),
+        '--engine': schema.And(schema.Use(str), lambda n: n in crawler.ENGINES,
+                               error=f"--engine should be one of: {', '.join(crawler.ENGINES)}"),
+        '--frontier': schema.And(schema.Use(str), lambda n: n in priority.FRONTIERS,
+                                 error=f"--frontier should be one of: {', '.join(priority.FRONTIERS)}"),
         '--loglevel': schema.And(schema.Use(str), lambda n: n in levels),
         '--logfile': schema.Or(None, schema.And(tools.is_path_exists_or_creatable,
                                                 error="cannot create logfile")),
+        '--parallel-locales': schema.And(schema.Use(bool)),
+        '--min-delay': schema.And(schema.Use(float), lambda n: n >= 0, error="--min-delay should be >= 0"),
+        '--adaptive-hosts': schema.And(schema.Use(bool)),
+        '--fetch': schema.And(schema.Use(str), lambda n: n in fetcher.FETCH_MODES,
+                              error=f"--fetch should be one of: {', '.join(fetcher.FETCH_MODES)}"),
+        '--readiness': schema.And(schema.Use(str), lambda n: n in readiness.STRATEGIES,
+                                  error=f"--readiness should be one of: {', '.join(readiness.STRATEGIES)}"),
+        '--quiet-time': schema.And(schema.Use(int), lambda n: n >= 0, error="--quiet-time should be >= 0"),
+        '--max-inflight': schema.And(schema.Use(int), lambda n: n >= 0, error="--max-inflight should be >= 0"),
+        '--block-resources': schema.And(schema.Use(str),
+                                        lambda n: n == "none" or all(i.strip() in blocking.RESOURCE_TYPES
+                                                                     for i in n.split(",")),
+                                        error=f"--block-resources should be none or a list of: "
+                                              f"{', '.join(blocking.RESOURCE_TYPES)}"),
+        '--block-urls': schema.And(schema.Use(str), lambda n: all(len(i.strip()) > 0 for i in n.split(",")),
+                                   error="--block-urls have to be non-empty"),
+        '--disk-store': schema.And(schema.Use(bool)),
+        '--near-duplicates': schema.And(schema.Use(int), lambda n: 0 <= n <= dedup.MAX_DISTANCE,
+                                        error=f"--near-duplicates should be between 0 and {dedup.MAX_DISTANCE}"),
+        '--recycle-pages': schema.And(schema.Use(int), lambda n: n >= 0, error="--recycle-pages should be >= 0"),
+        '--max-browser-memory': schema.And(schema.Use(int), lambda n: n >= 0,
+                                           error="--max-browser-memory should be >= 0"),
+        '--storage': schema.And(schema.Use(str), lambda n: n in storage.STORAGES,
+                                error=f"--storage should be one of: {', '.join(storage.STORAGES)}"),
+        '--shard-size': schema.And(schema.Use(int), lambda n: n >= 1, error="--shard-size should be >= 1"),
+        '--dictionary-samples': schema.And(schema.Use(int), lambda n: n >= 0,
+                                           error="--dictionary-samples should be >= 0"),
+        '--metrics-port': schema.Or(None, schema.And(schema.Use(int), lambda n: 0 < n < 65536),
+                                    error="--metrics-port should be a TCP port"),
+        '--workers': schema.And(schema.Use(int), lambda n: n >= 1, error="--workers should be >= 1"),
+        '--partition': schema.And(schema.Use(str), lambda n: n in sharding.PARTITIONS,
+                                  error=f"--partition should be one of: {', '.join(sharding.PARTITIONS)}"),
+        '--worker': schema.Or(None, schema.And(schema.Use(lambda n: tuple(int(i) for i in n.split("/"))),
+                                               lambda n: len(n) == 2 and 0 <= n[0] < n[1]),
+                              error="--worker should be k/n, with 0 <= k < n"),
+        '--coordinator': schema.Or(None, schema.And(tools.is_path_exists_or_creatable,
+                                                    error="cannot create the coordinator file")),
         '--help': schema.And(schema.Use(bool)),
         "download": schema.And(schema.Use(bool)),
         "crawl": schema.And(schema.Use(bool)),
         "file": schema.And(schema.Use(bool)),
+        "recrawl": schema.And(schema.Use(bool)),
         "resume": schema.And(schema.Use(bool))
     })
 
+    # as given, to build the command lines of the workers of a multi-worker crawl
+    arguments = dict(args)
     try:
         args = s.validate(args)
     except schema.SchemaError as e:
@@ -95,6 +194,17 @@ def main():
     root_handler.setFormatter(logger.formatter)
     root.setLevel(logging.INFO)
 
+    if args["resume"]:
+        workers = sharding.coordinated_workers(args["<working_directory>"])
+        if workers is not None:
+            sys.exit(sharding.run_workers(arguments, workers, args["<working_directory>"], resume=True))
+    elif args["--workers"] > 1:
+        if args["--worker"] is not None:
+            exit("Error: --workers and --worker cannot be used together")
+        sys.exit(sharding.run_workers(arguments, args["--workers"], args["<working_directory>"]))
+    if args["--worker"] is not None and args["--coordinator"] is None:
+        exit("Error: --worker requires --coordinator")
+
     url_list = []
     if args["<url_list>"] is not None:
         url_list = [n.strip() for n in args["<url_list>"].split(",")]
@@ -113,18 +223,67 @@ def main():
         except FileNotFoundError:
             print(__doc__)
             exit(f"Error: Cannot recover download from <working_directory> {args['<working_directory>']}")
-    elif args["crawl"]:
-        c = crawler.Crawler.from_cli_options(url_list, locale_list, args["<working_directory>"])
-        c.max_pages = int(args["--max-pages"])
-        c.slot_size = int(args["--simultaneous-pages"])
+        if c.previous_dir and not os.path.isdir(c.previous_dir):
+            # it holds the HTML of the unchanged pages, stored as references
+            exit(f"Error: Cannot resume the recrawl, the output of the previous crawl {c.previous_dir} does not exist")
+    elif args["crawl"] or args["recrawl"]:
+        if args["recrawl"]:
+            try:
+                c = crawler.Crawler.create_recrawl(args["<previous_directory>"], args["<working_directory>"])
+            except FileNotFoundError as e:
+                exit(f"Error: {e}")
+        else:
+            c = crawler.Crawler.from_cli_options(url_list, locale_list, args["<working_directory>"])
+        c.engine = args["--engine"]
+        c.frontier_mode = args["--frontier"]
+        c.near_duplicate_distance = args["--near-duplicates"]
+        c.parallel_locales = args["--parallel-locales"]
         if args["--patterns"] is not None:
             c.patterns = [i.strip() for i in args["--patterns"].split(",")]
+        if args["--exclude-patterns"] is not None:
+            c.exclude_patterns = [i.strip() for i in args["--exclude-patterns"].split(",")]
+        if args["--skip-extensions"] is not None:
+            c.skip_extensions = [i.strip() for i in args["--skip-extensions"].split(",")]
+        c.sitemaps = args["--sitemaps"]
+        c.max_sitemap_urls = args["--max-sitemap-urls"]
     elif args["download"]:
         c = crawler.Crawler.create_downloader(url_list, args["<working_directory>"])
+        c.max_retries = args["--retries"]
     else:
         print(__doc__)
         exit(f"Error: unsupported execution mode")
 
+    if not args["resume"]:
+        c.max_pages = int(args["--max-pages"])
+        c.slot_size = int(args["--simultaneous-pages"])
+        c.fetch_mode = args["--fetch"]
+        c.min_delay = args["--min-delay"]
+        c.adaptive_hosts = args["--adaptive-hosts"]
+        c.readiness_strategy = args["--readiness"]
+        c.quiet_time = args["--quiet-time"]
+        c.max_inflight = args["--max-inflight"]
+        c.recycle_pages = args["--recycle-pages"]
+        c.max_browser_memory = args["--max-browser-memory"]
+        c.block_resources = [] if args["--block-resources"] == "none" else \
+            [i.strip() for i in args["--block-resources"].split(",")]
+        c.block_urls = []
+        for i in args["--block-urls"].split(","):
+            if i.strip() == "trackers":
+                c.block_urls.extend(blocking.TRACKERS)
+            elif i.strip() != "none":
+                c.block_urls.append(i.strip())
+        c.storage_mode = args["--storage"]
+        c.shard_size = args["--shard-size"]
+        c.dictionary_samples = args["--dictionary-samples"]
+        if args["--worker"] is not None:
+            c.worker, c.workers = args["--worker"]
+            c.partition = args["--partition"]
+            c.coordinator_file = os.path.abspath(args["--coordinator"])
+        if args["--disk-store"]:
+            c.open_disk_store(reset=True)
+
+    c.metrics_port = args["--metrics-port"]
+
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
     c.crawl()
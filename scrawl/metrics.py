@@ -0,0 +1,180 @@
+import asyncio
+import bisect
+import contextlib
+import json
+import os
+import resource
+import time
+
+from scrawl import logger
+
+# upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STATS_INTERVAL = 10.0
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """
+        Upper bound of the bucket holding the `q` quantile (inf for the overflow bucket).
+        """
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS + (float("inf"),), self.counts):
+            seen += n
+            if seen >= rank and n > 0:
+                return bound
+        return 0.0
+
+    def to_json(self):
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+                "p50": self.quantile(0.5), "p95": self.quantile(0.95), "p99": self.quantile(0.99)}
+
+
+class Metrics:
+    """
+    Crawl metrics: per-stage timing histograms, counters and gauges (callables evaluated on export), all of them
+    with optional labels. Exported as JSON (stats file) and in the Prometheus text format.
+    """
+    def __init__(self):
+        self.start = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage, seconds):
+        histogram = self.stages.get(stage)
+        if histogram is None:
+            histogram = self.stages[stage] = Histogram()
+        histogram.observe(seconds)
+
+    def inc(self, name, n=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + n
+
+    def gauge(self, name, fn, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = fn
+
+    def gauge_values(self):
+        values = []
+        for (name, labels), fn in list(self.gauges.items()):
+            try:
+                values.append((name, labels, fn()))
+            except Exception as e:
+                logger.logger.debug(f"Cannot read gauge {name}: {e}")
+        return values
+
+    def to_json(self):
+        def grouped(items):
+            obj = {}
+            for name, labels, value in items:
+                if labels:
+                    obj.setdefault(name, {})[",".join(f"{k}={v}" for k, v in labels)] = value
+                else:
+                    obj[name] = value
+            return obj
+
+        uptime = time.time() - self.start
+        stored = sum(v for (name, _), v in self.counters.items() if name == "pages_stored")
+        return {"time": time.time(), "uptime": round(uptime, 3),
+                "pages_per_second": round(stored / uptime, 3) if uptime > 0 else 0.0,
+                "counters": grouped((name, labels, v) for (name, labels), v in self.counters.items()),
+                "gauges": grouped(self.gauge_values()),
+                "stages": {stage: h.to_json() for stage, h in self.stages.items()}}
+
+    def to_prometheus(self):
+        def labelled(name, labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return f"scrawl_{name}"
+            return f"scrawl_{name}{{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f"# TYPE scrawl_{name}_total counter")
+            lines.extend(f"{labelled(name + '_total', labels)} {v}" for (n, labels), v in self.counters.items()
+                         if n == name)
+        values = self.gauge_values()
+        for name in sorted({name for name, _, _ in values}):
+            lines.append(f"# TYPE scrawl_{name} gauge")
+            lines.extend(f"{labelled(name, labels)} {v}" for n, labels, v in values if n == name and v is not None)
+        lines.append("# TYPE scrawl_stage_seconds histogram")
+        for stage, h in sorted(self.stages.items()):
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), h.counts):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{labelled('stage_seconds_bucket', [('stage', stage), ('le', le)])} {cumulative}")
+            lines.append(f"{labelled('stage_seconds_sum', [('stage', stage)])} {h.sum}")
+            lines.append(f"{labelled('stage_seconds_count', [('stage', stage)])} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename):
+        with open(f"{filename}.tmp", "wt") as fstats:
+            json.dump(self.to_json(), fstats, indent=1)
+        os.replace(f"{filename}.tmp", filename)
+
+    async def write_periodically(self, filename, interval=STATS_INTERVAL):
+        """
+        Rewrites the stats file every `interval` seconds, until cancelled (and once more then).
+        """
+        try:
+            while True:
+                self.write(filename)
+                await asyncio.sleep(interval)
+        finally:
+            self.write(filename)
+
+    async def serve(self, port, host="127.0.0.1"):
+        """
+        Starts the Prometheus endpoint (any path) on `host`:`port`. Returns the asyncio server.
+        """
+        async def handle(reader, writer):
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+                body = self.to_prometheus().encode("utf-8")
+                writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                             b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body)
+                await writer.drain()
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        server = await asyncio.start_server(handle, host, port)
+        logger.logger.info(f"Serving Prometheus metrics on http://{host}:{port}/metrics")
+        return server
+
+
+def rss():
+    """
+    Resident memory of this process in bytes (peak resident memory where /proc is not available).
+    """
+    try:
+        with open("/proc/self/statm", "rt") as fstatm:
+            return int(fstatm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+# shared by the crawler and the tools it uses
+registry = Metrics()
@@ -1,14 +1,177 @@
+import concurrent.futures
+import contextlib
 import glob
 import json
 import os
+import re
 
 import xxhash
 import zstandard
 
+from scrawl import storage, logger
 
-def read_json_object(fname):
-    with zstandard.open(fname, "r") as f:
-        return json.loads(f.read())
+RECORD_FILE = re.compile(r"^(\d+)\.json\.zst$")
+INDEX_HEADER = b"<html><head></head><body>\n"
+INDEX_FOOTER = b"</body></html>\n"
+# characters of a stored page decoded at a time by the HTML export
+CHUNK_SIZE = 1 << 16
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+# longest run of string characters and complete escapes
+STRING_PIECE = re.compile(r'[^"\\]*(?:\\(?:["\\/bfnrt]|u[0-9a-fA-F]{4})[^"\\]*)*')
+DECODER = json.JSONDecoder()
+
+
+def read_json_object(fname, decompressor=None):
+    decompressor = decompressor or storage.Decompressor(os.path.dirname(fname))
+    with open(fname, "rb") as f:
+        return json.loads(decompressor.decompress(f.read()))
+
+
+class PageDecoder:
+    """
+    Streaming decoder of the JSON object of a stored page, read from a text stream CHUNK_SIZE characters at a time.
+    The "html" member is decoded a piece at a time into a file, or skipped, instead of being kept in memory; the
+    other members are small and decoded as usual.
+    """
+    def __init__(self, text):
+        self.text = text
+        self.buf = ""
+        self.pos = 0
+
+    def fill(self):
+        chunk = self.text.read(CHUNK_SIZE)
+        if not chunk:
+            raise ValueError("Truncated JSON object")
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+
+    def next_char(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            self.fill()
+
+    def expect(self, c):
+        if self.next_char() != c:
+            raise ValueError(f"Expected {c!r} in JSON object")
+        self.pos += 1
+
+    def value(self):
+        self.next_char()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buf, self.pos)
+                # a member is always followed by , or }: otherwise the value may go on in the next chunk
+                if end < len(self.buf):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                pass
+            self.fill()
+
+    def string(self, out):
+        """
+        Decodes the string at the current position into the file-like `out`, or skips it if `out` is None.
+        """
+        self.expect('"')
+        while True:
+            end = STRING_PIECE.match(self.buf, self.pos).end()
+            closed = end < len(self.buf) and self.buf[end] == '"'
+            if not closed and len(self.buf) - end >= 6:
+                raise ValueError("Invalid JSON string")
+            if out is not None:
+                piece = json.loads(f'"{self.buf[self.pos:end]}"')
+                if not closed and piece and "\ud800" <= piece[-1] <= "\udbff":
+                    # the first half of a surrogate pair (a \uXXXX escape) waits for the second one
+                    piece = piece[:-1]
+                    end -= 6
+                out.write(piece)
+            self.pos = end
+            if closed:
+                self.pos += 1
+                return
+            self.fill()
+
+    def read(self, html_file=None):
+        """
+        Returns the members of the object but "html", which is written to html_file(members read before it), or
+        skipped without `html_file`.
+        """
+        obj = {}
+        self.expect("{")
+        if self.next_char() == "}":
+            return obj
+        while True:
+            key = self.value()
+            self.expect(":")
+            if key == "html" and self.next_char() == '"':
+                self.string(html_file(obj) if html_file else None)
+            else:
+                obj[key] = self.value()
+            c = self.next_char()
+            self.pos += 1
+            if c == "}":
+                return obj
+            if c != ",":
+                raise ValueError("Expected ',' or '}' in JSON object")
+
+
+def read_page(fname, offset, length, decompressors, html_file=None):
+    """
+    Decodes the page stored in `fname` (`length` bytes at `offset` in a shard) with a PageDecoder, a chunk at a time.
+    `decompressors` caches a Decompressor per directory.
+    """
+    with open(fname, "rb") as f:
+        if offset is not None:
+            f.seek(offset)
+        with directory_decompressor(decompressors, fname).text_reader(f, length) as text:
+            return PageDecoder(text).read(html_file)
+
+
+def directory_decompressor(decompressors, fname):
+    """
+    Decompressor for the pages stored next to `fname`, cached by directory in `decompressors`.
+    """
+    directory = os.path.dirname(fname)
+    if directory not in decompressors:
+        decompressors[directory] = storage.Decompressor(directory)
+    return decompressors[directory]
+
+
+def reference_location(obj, source_path):
+    """
+    File, offset and length of the record a reference (see resolve_reference) points to.
+    """
+    location = obj["reference"]
+    fname = os.path.normpath(os.path.join(source_path, location["file"]))
+    return fname, location.get("offset"), location.get("length")
+
+
+def resolve_reference(obj, source_path, decompressors):
+    """
+    Unchanged pages of a recrawl are stored without their HTML, as a reference to the record of an earlier crawl
+    (relative to `source_path`): returns the page with the HTML of that record. `decompressors` caches a Decompressor
+    per directory.
+    """
+    if obj.get("reference") is None:
+        return obj
+    fname, offset, length = reference_location(obj, source_path)
+    previous = storage.read_record(fname, offset, length, directory_decompressor(decompressors, fname))
+    return {**obj, "html": previous["html"]}
+
+
+def iter_records(source_path):
+    """
+    Yields every stored page, whether it was stored as a single .json.zst file or in shards.
+    """
+    decompressor = storage.Decompressor(source_path)
+    decompressors = {}
+    for jsonfile in glob.iglob(f"{source_path}/*.json.zst"):
+        yield resolve_reference(read_json_object(jsonfile, decompressor), source_path, decompressors)
+    for shard in storage.shard_files(source_path):
+        for _, obj in storage.read_shard(shard, decompressor):
+            yield resolve_reference(obj, source_path, decompressors)
 
 
 def sanitize_filename(filename_str):
@@ -37,24 +200,136 @@ def get_filename(prefix, url, counter):
     return fullpath, filename
 
 
-def generate_output(source_path, target_path):
-    counter = 0
-    relpaths = []
-    for jsonfile in glob.iglob(f"{source_path}/*.json.zst"):
-        obj = read_json_object(jsonfile)
-        url = obj["url"]
-        counter += 1
-        filename, relpath = get_filename(target_path, url, counter)
-        os.makedirs(os.path.dirname(filename), exist_ok=True)
-        with open(filename, "w") as f:
-            f.write(obj["html"])
-        relpaths.append(relpath)
-
-    special_file = f"{target_path}/index.html"
-    with open(special_file, "wt") as findex:
-        print("<html><head></head><body>", file=findex)
-        for i in relpaths:
-            print(f"<a href='{i}'>page</a>", file=findex)
-        print("</body></html>", file=findex)
+def export_page(fname, offset, length, idx, source_path, target_path, decompressors):
+    """
+    Writes the HTML of the page stored in `fname` (`length` bytes at `offset` in a shard), decompressing and decoding
+    it a chunk at a time, and returns its relpath. The HTML file is named after the URL, which scrawl stores before
+    the HTML.
+    """
+    with contextlib.ExitStack() as stack:
+        paths = []
+
+        def html_file(obj):
+            if "url" not in obj:
+                raise ValueError(f"The URL of page {idx} is not stored before its HTML")
+            filename, relpath = get_filename(target_path, obj["url"], idx)
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            paths.append(relpath)
+            return stack.enter_context(open(filename, "w"))
+
+        obj = read_page(fname, offset, length, decompressors, html_file)
+        if obj.get("reference") is not None:
+            read_page(*reference_location(obj, source_path), decompressors, lambda _: html_file(obj))
+        if len(paths) == 0:
+            raise ValueError(f"Page {idx} has no HTML")
+        return paths[0]
+
+
+def export_task(source_path, target_path, min_idx, task):
+    """
+    Writes the HTML of the pages of one task (a batch of .json.zst files or a shard) whose idx is above `min_idx`,
+    one page at a time and streaming each one (see export_page). Returns [(idx, relpath)]. Runs in the export worker
+    processes.
+    """
+    kind, source = task
+    if kind == "files":
+        locations = ((int(RECORD_FILE.search(os.path.basename(i)).group(1)), i, None, None) for i in source)
+    else:
+        locations = ((idx, source, offset, length) for idx, offset, length in storage.shard_index(source, min_idx))
+
+    exported = []
+    decompressors = {}
+    for idx, fname, offset, length in locations:
+        try:
+            relpath = export_page(fname, offset, length, idx, source_path, target_path, decompressors)
+        except zstandard.ZstdError:
+            if kind == "files":
+                raise
+            logger.logger.warning(f"Truncated record {idx} in {source}")
+            break
+        except FileNotFoundError as e:
+            # a reference to the output of a previous crawl that has been moved or removed
+            logger.logger.warning(f"Skipping page {idx}, its HTML is in {e.filename}, which does not exist")
+            continue
+        exported.append((idx, relpath))
+    return exported
+
+
+def export_tasks(source_path, min_idx, batch_size=256):
+    """
+    Splits the pages with idx above `min_idx` into export tasks without listing the whole directory in memory.
+    """
+    batch = []
+    with os.scandir(source_path) as entries:
+        for entry in entries:
+            m = RECORD_FILE.search(entry.name)
+            if m and int(m.group(1)) > min_idx:
+                batch.append(entry.path)
+                if len(batch) >= batch_size:
+                    yield "files", batch
+                    batch = []
+    if batch:
+        yield "files", batch
+    for shard in storage.shard_files(source_path):
+        yield "shard", shard
+
+
+def generate_output(source_path, target_path, workers=None, incremental=True):
+    """
+    Exports the stored pages as HTML files plus an index.html linking all of them, using a pool of `workers`
+    processes (one per CPU by default) with a bounded number of tasks in flight. If `incremental`, only pages stored
+    after the previous export are written and appended to the existing index.
+    """
+    workers = workers or os.cpu_count() or 1
+    state_file = os.path.join(target_path, ".export.json")
+    special_file = os.path.join(target_path, "index.html")
+    os.makedirs(target_path, exist_ok=True)
+
+    min_idx = 0
+    if incremental and os.path.exists(state_file) and os.path.exists(special_file):
+        with open(state_file, "rt") as fstate:
+            min_idx = json.load(fstate)["last_idx"]
+
+    if min_idx > 0:
+        findex = open(special_file, "r+b")
+        findex.seek(-len(INDEX_FOOTER), os.SEEK_END)
+        if findex.read() != INDEX_FOOTER:
+            findex.close()
+            min_idx = 0
+        else:
+            findex.seek(-len(INDEX_FOOTER), os.SEEK_END)
+            findex.truncate()
+    if min_idx == 0:
+        findex = open(special_file, "wb")
+        findex.write(INDEX_HEADER)
+
+    last_idx = min_idx
+
+    def write_links(exported):
+        nonlocal last_idx
+        for idx, relpath in exported:
+            findex.write(f"<a href='{relpath}'>page</a>\n".encode("utf-8"))
+            last_idx = max(last_idx, idx)
 
+    with findex:
+        tasks = export_tasks(source_path, min_idx)
+        if workers == 1:
+            for task in tasks:
+                write_links(export_task(source_path, target_path, min_idx, task))
+        else:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                pending = set()
+                for task in tasks:
+                    if len(pending) >= 2 * workers:
+                        done, pending = concurrent.futures.wait(pending,
+                                                                return_when=concurrent.futures.FIRST_COMPLETED)
+                        for f in done:
+                            write_links(f.result())
+                    pending.add(pool.submit(export_task, source_path, target_path, min_idx, task))
+                for f in concurrent.futures.as_completed(pending):
+                    write_links(f.result())
+        findex.write(INDEX_FOOTER)
 
+    with open(state_file, "wt") as fstate:
+        json.dump({"last_idx": last_idx}, fstate)
+    logger.logger.info(f"Exported pages {min_idx + 1} to {last_idx} into {target_path}")
@@ -0,0 +1,223 @@
+import asyncio
+import collections
+import email.utils
+import time
+from urllib.parse import urlparse
+
+from scrawl import logger
+
+DEFAULT_TIMEOUT = 5000
+MIN_TIMEOUT = 2000
+MAX_TIMEOUT = 30000
+INITIAL_LIMIT = 2
+LATENCY_WINDOW = 100
+MIN_SAMPLES = 10
+MAX_RETRY_AFTER = 600
+# waiting engines look again after this many seconds: hosts can be released by other locales
+POLL_INTERVAL = 0.5
+FAILURE_STATUS = (429, 503)
+
+
+def parse_retry_after(value):
+    """
+    Seconds to wait according to a Retry-After header (delay in seconds or HTTP date), None if absent or invalid.
+    """
+    if not value:
+        return None
+    if value.strip().isdigit():
+        return int(value)
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class HostState:
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_flight = 0
+        self.next_start = 0.0
+        self.last_start = 0.0
+        self.retry_until = 0.0
+        self.last_decrease = 0.0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def percentile(self, q):
+        if len(self.latencies) == 0:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class HostController:
+    """
+    Per-host politeness and concurrency. Requests to a host start at least `min_delay` seconds apart and never before
+    what a Retry-After asked for. With `adaptive`, every host gets its own in-flight limit, adjusted with AIMD between
+    1 and `max_limit` (+1/limit per answered request, halved on errors, timeouts, 429 and 5xx at most once per
+    median round trip), and its own navigation timeout (4 times its p95 response latency, within
+    MIN_TIMEOUT..MAX_TIMEOUT ms). Otherwise every host can take `max_limit` requests with the default timeout.
+    """
+    def __init__(self, max_limit, min_delay=0.0, adaptive=False):
+        self.max_limit = max_limit
+        self.min_delay = min_delay
+        self.adaptive = adaptive
+        self.hosts = {}
+
+    def host(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(min(INITIAL_LIMIT, self.max_limit) if self.adaptive
+                                                 else self.max_limit)
+        return state
+
+    def available(self, host, now):
+        state = self.hosts.get(host)
+        return state is None or (state.in_flight < int(state.limit) and now >= state.next_start)
+
+    def start(self, host, now):
+        state = self.host(host)
+        state.in_flight += 1
+        state.next_start = max(state.next_start, now + self.min_delay)
+
+    async def turn(self, host):
+        """
+        Waits until a request to `host` may be sent (`min_delay` after the previous one and not before a
+        Retry-After), right before sending it. start() already spaces URLs out, but they may wait a while between
+        being picked and being requested.
+        """
+        state = self.host(host)
+        while True:
+            now = time.monotonic()
+            due = max(state.last_start + self.min_delay, state.retry_until)
+            if now >= due:
+                break
+            await asyncio.sleep(due - now)
+        state.last_start = now
+        state.requests += 1
+
+    def finish(self, host):
+        self.host(host).in_flight -= 1
+
+    def timeout(self, host):
+        """
+        Navigation timeout for `host`, in milliseconds.
+        """
+        state = self.hosts.get(host)
+        if not self.adaptive or state is None or len(state.latencies) < MIN_SAMPLES:
+            return DEFAULT_TIMEOUT
+        return int(min(MAX_TIMEOUT, max(MIN_TIMEOUT, 4000 * state.percentile(0.95))))
+
+    def success(self, host, latency):
+        state = self.host(host)
+        state.latencies.append(latency)
+        if self.adaptive:
+            state.limit = min(self.max_limit, state.limit + 1 / state.limit)
+
+    def failure(self, host, timeout=False, retry_after=None):
+        state = self.host(host)
+        now = time.monotonic()
+        if timeout:
+            state.timeouts += 1
+        else:
+            state.errors += 1
+        if retry_after is not None:
+            state.retry_until = max(state.retry_until, now + min(retry_after, MAX_RETRY_AFTER))
+            state.next_start = max(state.next_start, state.retry_until)
+        if self.adaptive and now - state.last_decrease > (state.percentile(0.5) or 1.0):
+            state.limit = max(1.0, state.limit / 2)
+            state.last_decrease = now
+
+    def response(self, host, latency, status, headers):
+        """
+        Records a request to `host` answered with HTTP `status` after `latency` seconds.
+        """
+        if status in FAILURE_STATUS or status >= 500:
+            self.failure(host, retry_after=parse_retry_after(headers.get("retry-after")))
+        else:
+            self.success(host, latency)
+
+    def report(self, top=10):
+        busiest = sorted(self.hosts.items(), key=lambda i: i[1].requests, reverse=True)[:top]
+        for host, state in busiest:
+            p50, p95 = state.percentile(0.5), state.percentile(0.95)
+            latency = f"p50 {p50 * 1000:.0f} ms, p95 {p95 * 1000:.0f} ms" if p50 is not None else "no latency data"
+            logger.logger.info(f"Host {host}: {state.requests} requests, {state.errors} errors, {state.timeouts} "
+                               f"timeouts, {latency}, limit {state.limit:.1f}, timeout {self.timeout(host)} ms")
+
+
+class HostScheduler:
+    """
+    Picks URLs from a frontier for the crawl loop, only among hosts that can take one more request right now. URLs of
+    busy hosts are parked (at most `max_parked`) and go first as soon as their host is available. Parked URLs are in
+    flight for the frontier, like the ones being fetched, so they survive an interrupted crawl, and release() puts
+    them back with their priority.
+    """
+    def __init__(self, frontier, controller, max_parked, best=False):
+        self.frontier = frontier
+        # highest priority first (Frontier.pop_best) or at random
+        self.next_url = frontier.pop_best if best else frontier.pop_random
+        self.controller = controller
+        self.max_parked = max_parked
+        self.parked = {}
+        self.size = 0
+
+    def take(self, u, now):
+        self.controller.start(urlparse(u).netloc, now)
+        return u
+
+    def pop(self):
+        """
+        Returns the next URL to fetch, None if the frontier is empty or every pending host has to wait. The URL
+        counts as in flight for its host, and for the frontier, until done() or requeue() is called.
+        """
+        now = time.monotonic()
+        for host, urls in self.parked.items():
+            if self.controller.available(host, now):
+                u = urls.popleft()
+                self.size -= 1
+                if len(urls) == 0:
+                    del self.parked[host]
+                return self.take(u, now)
+
+        while self.size < self.max_parked:
+            u = self.next_url()
+            if u is None:
+                return None
+            host = urlparse(u).netloc
+            if self.controller.available(host, now):
+                return self.take(u, now)
+            self.parked.setdefault(host, collections.deque()).append(u)
+            self.size += 1
+        return None
+
+    def done(self, u):
+        self.controller.finish(urlparse(u).netloc)
+        self.frontier.done(u)
+
+    def requeue(self, u):
+        """
+        Same as done() for a URL that has not been dealt with: it goes back to the frontier.
+        """
+        self.controller.finish(urlparse(u).netloc)
+        self.frontier.requeue(u)
+
+    def next_ready(self):
+        """
+        Seconds to wait before pop() may return a parked URL, None if nothing is parked.
+        """
+        if self.size == 0:
+            return None
+        now = time.monotonic()
+        # hosts that are only waiting for their requests in flight are released by done()
+        return min([POLL_INTERVAL] + [self.controller.host(i).next_start - now for i in self.parked
+                                      if self.controller.host(i).next_start > now])
+
+    def release(self):
+        for urls in self.parked.values():
+            for u in urls:
+                self.frontier.requeue(u)
+        self.parked = {}
+        self.size = 0
@@ -0,0 +1,144 @@
+import re
+from urllib.parse import urlparse, parse_qsl, urlencode
+
+import iso639
+
+from scrawl import logger
+
+FRONTIERS = ("random", "priority")
+# path segment, subdomain or query value naming a language: es, es-ES, es_es, pt-br
+LOCALE = re.compile(r"^([a-z]{2})(?:[-_][a-z]{2})?$", re.IGNORECASE)
+LOCALE_PARAMETERS = ("lang", "language", "locale", "hl", "lng")
+# score of a URL in the priority frontier
+SEED_SCORE = 100.0
+COUNTERPART_SCORE = 4.0
+ALTERNATE_SCORE = 2.0
+TARGET_SCORE = 1.0
+OTHER_LANGUAGE_SCORE = -2.0
+DEPTH_SCORE = -0.1
+MAX_DEPTH = 20
+# entries kept by each of the in-memory maps of the priority frontier
+MAX_ENTRIES = 200000
+
+
+def language_code(value):
+    m = LOCALE.match(value)
+    if m and m.group(1).lower() in iso639.languages.part1:
+        return m.group(1).lower()
+    return None
+
+
+def split_locale(url):
+    """
+    Language named in `url` (by a path segment, a lang-like query parameter or the first label of the host) and the
+    URL without it, which is the same for the translations of a page on sites that follow that scheme.
+    """
+    o = urlparse(url)
+    lang = None
+    segments = o.path.split("/")
+    for i, segment in enumerate(segments):
+        lang = language_code(segment)
+        if lang:
+            del segments[i]
+            break
+    query = parse_qsl(o.query, keep_blank_values=True)
+    for i, (name, value) in enumerate(query):
+        if name.lower() in LOCALE_PARAMETERS and language_code(value):
+            lang = lang or language_code(value)
+            del query[i]
+            break
+    host = o.netloc.lower()
+    label, _, rest = host.partition(".")
+    if rest.count(".") > 0 and language_code(label):
+        lang = lang or language_code(label)
+        host = rest
+    return lang, f"{host}{'/'.join(segments)}{'?' + urlencode(query) if query else ''}"
+
+
+class BoundedDict(dict):
+    """
+    Dict that forgets its oldest entries beyond `max_entries`, so that it does not grow with the size of the crawl.
+    """
+    def __init__(self, max_entries=MAX_ENTRIES):
+        super().__init__()
+        self.max_entries = max_entries
+
+    def __setitem__(self, key, value):
+        if key not in self and len(self) >= self.max_entries:
+            del self[next(iter(self))]
+        super().__setitem__(key, value)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+
+class Alignment:
+    """
+    Translations among the stored pages: pages are grouped by their <link rel="alternate" hreflang> edges, or else by
+    their URL without its locale part (/es/about and /fr/about), and a page counts as aligned once a page of the same
+    group in another target language has been stored. Also scores URLs for the priority frontier. Kept in memory and
+    bounded (BoundedDict): after a resume it only knows the pages stored since, and in long crawls the alternates and
+    groups seen first are forgotten, so the aligned count is approximate.
+    """
+    def __init__(self, languages):
+        self.languages = set(languages)
+        # url -> (group, hreflang) of the alternates of the stored pages
+        self.alternates = BoundedDict()
+        # group -> languages stored
+        self.groups = BoundedDict()
+        self.aligned = 0
+        self.rendered = 0
+
+    def language(self, url):
+        return self.alternates.get(url, (None, None))[1] or split_locale(url)[0]
+
+    def group(self, url):
+        if url in self.alternates:
+            return self.alternates[url][0]
+        return split_locale(url)[1]
+
+    def store(self, url, alternates, html_lang=""):
+        """
+        Records a stored page, with its (url, hreflang) alternates and the lang attribute of its <html> element. Its
+        language is the hreflang of its own alternate, the one of an alternate of another page, the one in its URL or
+        else the lang attribute.
+        """
+        group = self.group(url)
+        own = [language_code(hreflang) for href, hreflang in alternates if href == url and hreflang]
+        lang = next(filter(None, own), None) or self.language(url) or language_code(html_lang or "")
+        for href, hreflang in alternates:
+            if language_code(hreflang or "") and href not in self.alternates:
+                self.alternates[href] = (group, language_code(hreflang))
+        if lang not in self.languages:
+            return
+        stored = self.groups.setdefault(group, set())
+        if lang not in stored:
+            if len(stored) == 1:
+                # the first translation makes both pages aligned
+                self.aligned += 2
+            elif len(stored) > 1:
+                self.aligned += 1
+            stored.add(lang)
+
+    def score(self, url, depth=0):
+        """
+        Priority of `url`: pages whose translation has been stored first, then hreflang alternates and pages in the
+        target languages, and pages in other languages last. Shallower pages go first among equals.
+        """
+        score = DEPTH_SCORE * min(depth, MAX_DEPTH)
+        if url in self.alternates:
+            score += ALTERNATE_SCORE
+        lang = self.language(url)
+        if lang in self.languages:
+            score += TARGET_SCORE
+            if len(self.groups.get(self.group(url), set()) - {lang}) > 0:
+                score += COUNTERPART_SCORE
+        elif lang is not None:
+            score += OTHER_LANGUAGE_SCORE
+        return score
+
+    def report(self):
+        per_1k = 1000 * self.aligned / self.rendered if self.rendered else 0.0
+        logger.logger.info(f"Aligned pages: {self.aligned} in {self.rendered} renders ({per_1k:.1f} per 1k renders)")
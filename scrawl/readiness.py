@@ -0,0 +1,159 @@
+import asyncio
+import collections
+import time
+import weakref
+
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError, Error as PlaywrightError
+
+from scrawl import logger
+
+STRATEGIES = ("load", "domcontentloaded", "dom-quiet", "network-quiet", "learned")
+DEFAULT_QUIET = 500
+DEFAULT_MAX_INFLIGHT = 2
+# learned strategy: the wait for the load event of a host is cut at 1.5 times its p90 load time
+LOAD_WINDOW = 50
+MIN_SAMPLES = 5
+MIN_DEADLINE = 500
+# how often the network-quiet strategy looks at the requests in flight, in seconds
+NETWORK_POLL = 0.05
+
+# resolves "ready" once the document has not changed for `quiet` ms, "deadline" after `timeout` ms
+DOM_QUIET = """([quiet, timeout]) => new Promise(resolve => {
+    const start = Date.now();
+    let last = start;
+    const observer = new MutationObserver(() => { last = Date.now(); });
+    observer.observe(document, {childList: true, subtree: true, attributes: true, characterData: true});
+    const check = () => {
+        const now = Date.now();
+        if (now - last >= quiet || now - start >= timeout) {
+            observer.disconnect();
+            resolve(now - last >= quiet ? "ready" : "deadline");
+        } else {
+            setTimeout(check, Math.min(quiet, 100));
+        }
+    };
+    setTimeout(check, Math.min(quiet, 100));
+})"""
+
+
+class NetworkTracker:
+    """
+    Requests in flight of a page, and when that number last changed.
+    """
+    def __init__(self, page):
+        self.in_flight = 0
+        self.last_change = time.monotonic()
+        page.on("request", self.started)
+        page.on("requestfinished", self.finished)
+        page.on("requestfailed", self.finished)
+
+    def started(self, request):
+        self.in_flight += 1
+        self.last_change = time.monotonic()
+
+    def finished(self, request):
+        self.in_flight = max(0, self.in_flight - 1)
+        self.last_change = time.monotonic()
+
+
+class Readiness:
+    """
+    Decides when a navigated page is ready to be snapshotted:
+
+    - load: the load event (every subresource done);
+    - domcontentloaded: the HTML has been parsed, subresources are not waited for;
+    - dom-quiet: DOMContentLoaded, then no DOM mutation for `quiet` ms (client-rendered pages);
+    - network-quiet: DOMContentLoaded, then at most `max_inflight` requests in flight for `quiet` ms;
+    - learned: the load event, but no longer than 1.5 times the p90 load time of the host.
+
+    wait() never raises on timeouts: it returns "ready", "deadline" (the strategy stopped waiting before the host
+    timeout), "interrupted" (the page navigated or crashed meanwhile) or "timeout" (host timeout), and the caller
+    snapshots whatever DOM there is.
+    """
+    def __init__(self, strategy="load", quiet=DEFAULT_QUIET, max_inflight=DEFAULT_MAX_INFLIGHT):
+        self.strategy = strategy
+        self.quiet = quiet
+        self.max_inflight = max_inflight
+        self.trackers = weakref.WeakKeyDictionary()
+        self.load_times = {}
+        self.outcomes = collections.Counter()
+
+    def watch(self, page):
+        """
+        Called before navigating `page`: the network-quiet strategy has to see every request of the page.
+        """
+        if self.strategy == "network-quiet" and page not in self.trackers:
+            self.trackers[page] = NetworkTracker(page)
+
+    async def wait(self, page, host, timeout):
+        """
+        Waits until `page` (on `host`) is ready, at most `timeout` ms. Returns the outcome.
+        """
+        deadline = time.monotonic() + timeout / 1000
+        try:
+            if self.strategy == "load":
+                await page.wait_for_load_state("load", timeout=timeout)
+                outcome = "ready"
+            elif self.strategy == "learned":
+                outcome = await self.wait_learned(page, host, timeout)
+            else:
+                await page.wait_for_load_state("domcontentloaded", timeout=timeout)
+                if self.strategy == "dom-quiet":
+                    outcome = await page.evaluate(DOM_QUIET, [self.quiet, remaining(deadline)])
+                elif self.strategy == "network-quiet":
+                    outcome = await self.wait_network_quiet(page, deadline)
+                else:
+                    outcome = "ready"
+        except PlaywrightTimeoutError:
+            outcome = "timeout"
+        except PlaywrightError as e:
+            logger.logger.debug(f"Readiness of {page.url} interrupted: {str(e).splitlines()[0]}")
+            outcome = "interrupted"
+        self.outcomes[outcome] += 1
+        return outcome
+
+    async def wait_network_quiet(self, page, deadline):
+        tracker = self.trackers.get(page)
+        if tracker is None:
+            return "ready"
+        while time.monotonic() < deadline:
+            if tracker.in_flight <= self.max_inflight and time.monotonic() - tracker.last_change >= self.quiet / 1000:
+                return "ready"
+            await asyncio.sleep(NETWORK_POLL)
+        return "deadline"
+
+    async def wait_learned(self, page, host, timeout):
+        load_times = self.load_times.setdefault(host, collections.deque(maxlen=LOAD_WINDOW))
+        cut = self.learned_deadline(host, timeout)
+        start = time.monotonic()
+        try:
+            await page.wait_for_load_state("load", timeout=cut)
+        except PlaywrightTimeoutError:
+            if cut >= timeout:
+                raise
+            # recorded as a load time, so that the deadline grows back if the host gets slower
+            load_times.append(cut)
+            return "deadline"
+        load_times.append((time.monotonic() - start) * 1000)
+        return "ready"
+
+    def learned_deadline(self, host, timeout):
+        """
+        Time in ms the learned strategy waits for the load event of a page of `host`, within MIN_DEADLINE..`timeout`.
+        """
+        load_times = self.load_times.get(host)
+        if load_times is None or len(load_times) < MIN_SAMPLES:
+            return timeout
+        ordered = sorted(load_times)
+        p90 = ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))]
+        return int(min(timeout, max(MIN_DEADLINE, 1.5 * p90)))
+
+    def report(self):
+        if len(self.outcomes) == 0:
+            return
+        outcomes = ", ".join(f"{i}={n}" for i, n in sorted(self.outcomes.items()))
+        logger.logger.info(f"Page readiness ({self.strategy}): {outcomes}")
+
+
+def remaining(deadline):
+    return max(0, int((deadline - time.monotonic()) * 1000))
@@ -0,0 +1,92 @@
+import collections
+import glob
+import os
+import time
+from urllib.parse import urlparse
+
+import zstandard
+
+from scrawl import logger, output, storage
+
+# what is known of a page stored by the previous crawl: the xxh64 of its text ("hash" of the record), the validators
+# of its HTTP response (ETag, Last-Modified and the xxh64 of the body, when they were recorded) and where it is stored
+Entry = collections.namedtuple("Entry", ["hash", "etag", "last_modified", "http_hash", "file", "offset", "length"])
+
+
+def json_directories(directory):
+    """
+    json/ directories of the output of a crawl: its own, or those of its workers (worker<k>/json).
+    """
+    directories = [os.path.join(directory, "json")]
+    if not os.path.isdir(directories[0]) or len(os.listdir(directories[0])) == 0:
+        directories = sorted(glob.glob(os.path.join(directory, "worker*", "json"))) or directories
+    return [os.path.abspath(i) for i in directories]
+
+
+def located_records(json_dir):
+    """
+    Yields (file, offset, length, JSON object without its HTML) for every page stored in `json_dir`, the offset and
+    length of pages stored in .json.zst files being None. Records are streamed (output.read_page), so that the HTML
+    is skipped instead of decoded.
+    """
+    decompressors = {}
+    with os.scandir(json_dir) as entries:
+        for entry in entries:
+            if output.RECORD_FILE.search(entry.name):
+                yield entry.path, None, None, output.read_page(entry.path, None, None, decompressors)
+    for shard in storage.shard_files(json_dir):
+        for idx, offset, length in storage.shard_index(shard):
+            try:
+                record = output.read_page(shard, offset, length, decompressors)
+            except zstandard.ZstdError:
+                logger.logger.warning(f"Truncated record {idx} in {shard}")
+                break
+            yield shard, offset, length, record
+
+
+class PreviousCrawl:
+    """
+    Index (lang, url) -> Entry of the pages stored by an earlier crawl, for `scrawl recrawl`. Pages that were stored
+    as references by an earlier recrawl point to the record that holds their HTML, so references never chain.
+    """
+    def __init__(self, directory):
+        if not os.path.isdir(directory):
+            raise FileNotFoundError(f"The output of the previous crawl, {directory}, does not exist")
+        self.directory = directory
+        self.entries = {}
+        # host -> first URL stored for it, the seeds of the recrawl
+        self.seeds = {}
+        start = time.monotonic()
+        for json_dir in json_directories(directory):
+            for fname, offset, length, record in located_records(json_dir):
+                reference = record.get("reference")
+                if reference is not None:
+                    fname = os.path.normpath(os.path.join(os.path.dirname(fname), reference["file"]))
+                    offset, length = reference.get("offset"), reference.get("length")
+                self.entries[(record["lang"], record["url"])] = Entry(record["hash"], record.get("etag"),
+                                                                       record.get("last_modified"),
+                                                                       record.get("http_hash"), fname, offset, length)
+                self.seeds.setdefault(urlparse(record["url"]).netloc, record["url"])
+        logger.logger.info(f"Indexed {len(self.entries)} pages of {directory} in {time.monotonic() - start:.1f}s")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, lang, url):
+        return self.entries.get((lang, url))
+
+    def locales(self):
+        return sorted({lang for lang, _ in self.entries})
+
+    def urls(self, lang):
+        return (url for i, url in self.entries if i == lang)
+
+
+def reference(entry, json_dir):
+    """
+    Where a page of the previous crawl is stored, relative to `json_dir` (the json/ directory of the recrawl).
+    """
+    location = {"file": os.path.relpath(entry.file, json_dir)}
+    if entry.offset is not None:
+        location.update(offset=entry.offset, length=entry.length)
+    return location
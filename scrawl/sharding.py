@@ -0,0 +1,253 @@
+import os
+import signal
+import sqlite3
+import subprocess
+import sys
+from urllib.parse import urlparse
+
+import xxhash
+
+from scrawl import logger
+
+PARTITIONS = ("host", "url")
+# commands of the scrawl command line (see main)
+COMMANDS = ("crawl", "download", "recrawl", "resume")
+COORDINATOR_FILE = "coordinator.sqlite"
+# seconds between two looks at the coordinator of a worker that has run out of links
+POLL_INTERVAL = 1.0
+
+
+def owner(url, workers, partition="host"):
+    """
+    Worker (0 to `workers` - 1) that crawls `url`: a hash of its host (without www.), or of the whole URL.
+    """
+    key = urlparse(url).netloc.lower().removeprefix("www.") if partition == "host" else url
+    return xxhash.xxh64_intdigest(key) % workers
+
+
+class Coordinator:
+    """
+    SQLite file shared by the workers of a crawl (one process each, on one machine or on a shared filesystem). It
+    holds the links a worker has found for other workers until their owner takes them, which workers have run out of
+    links for every locale or stopped, and the number of pages stored by all of them (for --max-pages): a locale is
+    finished once all workers are idle or stopped and no link is in transit to a running worker.
+    """
+    def __init__(self, filename, worker, workers, partition="host"):
+        self.filename = filename
+        self.worker = worker
+        self.workers = workers
+        self.partition = partition
+        self.outbox = {}
+        self.unacknowledged = None
+        self.sent = 0
+        self.received = 0
+        # transactions are explicit (BEGIN IMMEDIATE), so that concurrent writers queue up instead of failing
+        self.db = sqlite3.connect(filename, timeout=60, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS links (lang TEXT, url TEXT, worker INTEGER, taken INTEGER, "
+                        "PRIMARY KEY (lang, url))")
+        self.db.execute("CREATE INDEX IF NOT EXISTS links_pending ON links (worker, taken)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS workers (worker INTEGER, lang TEXT, idle INTEGER, "
+                        "PRIMARY KEY (worker, lang))")
+        self.db.execute("CREATE TABLE IF NOT EXISTS stopped (worker INTEGER PRIMARY KEY)")
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('workers', ?)", (workers,))
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('pages', 0)")
+
+    def owns(self, url):
+        return owner(url, self.workers, self.partition) == self.worker
+
+    def register(self, locales):
+        """
+        Marks this worker as busy with `locales`. Rows for the other workers are created busy as well, so that no
+        locale is considered finished before every worker has started.
+        """
+        with self.transaction():
+            self.db.execute("DELETE FROM stopped WHERE worker = ?", (self.worker,))
+            self.db.executemany("INSERT OR IGNORE INTO workers VALUES (?, ?, 0)",
+                                [(i, lang) for i in range(self.workers) for lang in locales])
+            self.db.executemany("UPDATE workers SET idle = 0 WHERE worker = ? AND lang = ?",
+                                [(self.worker, lang) for lang in locales])
+
+    def send(self, lang, url):
+        self.outbox.setdefault(lang, set()).add(url)
+
+    def flush(self):
+        """
+        Hands the links found for other workers over to the coordinator. A link is only delivered once.
+        """
+        if len(self.outbox) == 0:
+            return
+        with self.transaction():
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO links VALUES (?, ?, ?, 0)",
+                                [(lang, url, owner(url, self.workers, self.partition))
+                                 for lang, urls in self.outbox.items() for url in urls])
+            self.sent += self.db.total_changes - before
+        self.outbox = {}
+
+    def receive(self):
+        """
+        Returns the (lang, url) links routed to this worker, and marks it as busy with their locales. They stay in
+        transit until acknowledge(), so a crash before they are durable in the worker does not lose them.
+        """
+        with self.transaction():
+            rows = self.db.execute("SELECT rowid, lang, url FROM links WHERE worker = ? AND taken = 0",
+                                   (self.worker,)).fetchall()
+            if len(rows) > 0:
+                self.db.executemany("UPDATE workers SET idle = 0 WHERE worker = ? AND lang = ?",
+                                    [(self.worker, lang) for lang in {i[1] for i in rows}])
+        if len(rows) > 0:
+            self.unacknowledged = max(i[0] for i in rows)
+            self.received += len(rows)
+        return [(lang, url) for _, lang, url in rows]
+
+    def acknowledge(self):
+        if self.unacknowledged is None:
+            return
+        with self.transaction():
+            self.db.execute("UPDATE links SET taken = 1 WHERE worker = ? AND taken = 0 AND rowid <= ?",
+                            (self.worker, self.unacknowledged))
+        self.unacknowledged = None
+
+    def idle(self, lang):
+        with self.transaction():
+            self.db.execute("UPDATE workers SET idle = 1 WHERE worker = ? AND lang = ?", (self.worker, lang))
+
+    def stop(self):
+        """
+        Marks this worker as stopped (finished, limit reached or interrupted) until it registers again: it no longer
+        keeps a locale from being finished, and the links routed to it wait for it to be resumed.
+        """
+        with self.transaction():
+            self.db.execute("INSERT OR IGNORE INTO stopped VALUES (?)", (self.worker,))
+
+    def finished(self, lang):
+        """
+        True once every running worker is idle for `lang` and no link of `lang` is in transit to a running worker (a
+        single consistent read).
+        """
+        busy, pending = self.db.execute("SELECT (SELECT COUNT(*) FROM workers WHERE lang = ? AND idle = 0 AND "
+                                        "worker NOT IN (SELECT worker FROM stopped)), "
+                                        "(SELECT COUNT(*) FROM links WHERE lang = ? AND taken = 0 AND "
+                                        "worker NOT IN (SELECT worker FROM stopped))",
+                                        (lang, lang)).fetchone()
+        return busy == 0 and pending == 0
+
+    def count_page(self):
+        """
+        Counts a page stored by this worker, returns the number of pages stored by all the workers.
+        """
+        with self.transaction():
+            self.db.execute("UPDATE meta SET value = value + 1 WHERE key = 'pages'")
+            return self.pages()
+
+    def pages(self):
+        return self.db.execute("SELECT value FROM meta WHERE key = 'pages'").fetchone()[0]
+
+    def transaction(self):
+        return Transaction(self.db)
+
+    def report(self):
+        logger.logger.info(f"Worker {self.worker}/{self.workers}: {self.sent} links sent to other workers, "
+                           f"{self.received} received")
+
+    def close(self):
+        self.db.close()
+
+
+class Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+def coordinated_workers(directory):
+    """
+    Number of workers of the multi-worker crawl in `directory`, None if it is not one.
+    """
+    filename = os.path.join(directory, COORDINATOR_FILE)
+    if not os.path.exists(filename):
+        return None
+    db = sqlite3.connect(filename)
+    try:
+        row = db.execute("SELECT value FROM meta WHERE key = 'workers'").fetchone()
+    finally:
+        db.close()
+    return None if row is None else int(row[0])
+
+
+def worker_arguments(arguments, worker, workers, directory, coordinator_file, resume=False):
+    """
+    Command line of a worker, rebuilt from the docopt arguments of the whole crawl (as parsed, before validation):
+    the working directory is the worker's own, --workers is dropped and every worker gets its own --metrics-port.
+    """
+    command = next(i for i in COMMANDS if arguments.get(i))
+    args = [command]
+    if command == "download" and arguments.get("file"):
+        args.append("file")
+    for name, value in arguments.items():
+        if not name.startswith("--") or name in ("--help", "--workers", "--worker", "--coordinator") \
+                or value is None or value is False:
+            continue
+        if name == "--metrics-port":
+            args.append(f"--metrics-port={int(value) + worker}")
+        elif value is True:
+            args.append(name)
+        else:
+            args.append(f"{name}={value}")
+    if not resume:
+        args.append(f"--worker={worker}/{workers}")
+        args.append(f"--coordinator={coordinator_file}")
+    if command == "crawl":
+        args.append(arguments["<locale_list>"])
+        if arguments.get("file"):
+            args.append("file")
+    if command == "recrawl":
+        args.append(arguments["<previous_directory>"])
+    if command in ("crawl", "download"):
+        args.append(arguments["<url_list_filename>"] if arguments.get("file") else arguments["<url_list>"])
+    return args + [directory]
+
+
+def run_workers(arguments, workers, directory, resume=False):
+    """
+    Runs (or resumes) a crawl as `workers` scrawl processes, each one in <directory>/worker<k>, and waits for them.
+    `arguments` are the docopt arguments of the whole crawl (see worker_arguments). SIGINT and SIGTERM are passed on to the workers, which persist their state. The coordinator file is removed
+    once every worker has finished its crawl. Returns the highest exit code of the workers.
+    """
+    os.makedirs(directory, exist_ok=True)
+    coordinator_file = os.path.join(directory, COORDINATOR_FILE)
+    worker_dirs = [os.path.join(directory, f"worker{k}") for k in range(workers)]
+    processes = []
+    for k, worker_dir in enumerate(worker_dirs):
+        command = [sys.executable, "-m", "scrawl.main",
+                   *worker_arguments(arguments, k, workers, worker_dir, coordinator_file, resume)]
+        logger.logger.info(f"Starting worker {k}/{workers}: {' '.join(command[3:])}")
+        # in a session of their own, so that a Ctrl-C reaches them once, through this process
+        processes.append(subprocess.Popen(command, start_new_session=True))
+
+    def forward(sig, frame):
+        logger.logger.info("Signal received: stopping the workers")
+        for p in processes:
+            if p.poll() is None:
+                p.send_signal(signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, forward)
+    signal.signal(signal.SIGTERM, forward)
+    codes = [p.wait() for p in processes]
+    for k, code in enumerate(codes):
+        if code != 0:
+            logger.logger.warning(f"Worker {k}/{workers} exited with code {code}")
+
+    if all(code == 0 and not os.path.exists(os.path.join(i, "crawler.json.zst")) for code, i in zip(codes, worker_dirs)):
+        for i in ("", "-wal", "-shm"):
+            if os.path.exists(coordinator_file + i):
+                os.unlink(coordinator_file + i)
+    logger.logger.info(f"Output of the workers in {', '.join(worker_dirs)}")
+    return max(codes)
@@ -0,0 +1,131 @@
+import contextlib
+import xml.etree.ElementTree as ET
+import zlib
+from urllib.parse import urljoin, urlparse
+
+import httpx
+
+from scrawl import logger, fetcher
+
+SITEMAP_NS = "{http://www.sitemaps.org/schemas/sitemap/0.9}"
+XHTML_NS = "{http://www.w3.org/1999/xhtml}"
+MAX_SITEMAPS = 1000
+MAX_DEPTH = 4
+SITEMAP_TIMEOUT = 30.0
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class SitemapReader:
+    """
+    Reads the sitemaps of a set of hosts: the Sitemap: lines of their robots.txt (or /sitemap.xml if there are none),
+    then sitemap index files recursively, up to MAX_DEPTH levels and MAX_SITEMAPS files. Sitemaps are parsed as
+    they are downloaded, gzipped or not, so neither big files nor the list of URLs are ever held in memory.
+    urls() yields page URLs and their <xhtml:link rel="alternate" hreflang> alternates.
+    """
+    def __init__(self, max_urls=1000000, max_sitemaps=MAX_SITEMAPS):
+        self.max_urls = max_urls
+        self.max_sitemaps = max_sitemaps
+        self.sitemaps = 0
+        self.errors = 0
+        self.found = 0
+        self.client = httpx.AsyncClient(http2=True, follow_redirects=True, timeout=SITEMAP_TIMEOUT,
+                                        headers={"User-Agent": fetcher.USER_AGENT})
+
+    async def robots_sitemaps(self, origin):
+        """
+        Sitemaps listed in the robots.txt of `origin`, relative ones resolved against its (final) URL.
+        """
+        robots_url = urljoin(origin, "/robots.txt")
+        try:
+            r = await self.client.get(robots_url)
+            robots_url = str(r.url)
+            lines = r.text.splitlines() if r.status_code == 200 else []
+        except httpx.HTTPError as e:
+            logger.logger.info(f"Cannot read robots.txt of {origin}: {type(e).__name__}")
+            lines = []
+        sitemaps = [urljoin(robots_url, line.split(":", 1)[1].strip()) for line in map(str.strip, lines)
+                    if line.lower().startswith("sitemap:") and line.split(":", 1)[1].strip()]
+        return sitemaps or [urljoin(origin, "/sitemap.xml")]
+
+    async def urls(self, seeds):
+        """
+        Yields the URLs of the sitemaps of the hosts of `seeds`, at most `max_urls`.
+        """
+        origins = list(dict.fromkeys(f"{urlparse(i).scheme}://{urlparse(i).netloc}" for i in seeds))
+        pending = []
+        for origin in origins:
+            pending.extend((i, 0) for i in await self.robots_sitemaps(origin))
+        seen = set()
+        while len(pending) > 0 and self.sitemaps < self.max_sitemaps and self.found < self.max_urls:
+            sitemap, depth = pending.pop()
+            if sitemap in seen:
+                continue
+            seen.add(sitemap)
+            self.sitemaps += 1
+            try:
+                async with contextlib.aclosing(self.read(sitemap)) as entries:
+                    async for kind, url in entries:
+                        if kind == "sitemap":
+                            if depth + 1 < MAX_DEPTH:
+                                pending.append((urljoin(sitemap, url), depth + 1))
+                        else:
+                            self.found += 1
+                            yield urljoin(sitemap, url)
+                            if self.found >= self.max_urls:
+                                break
+            except (httpx.HTTPError, ET.ParseError, zlib.error) as e:
+                self.errors += 1
+                logger.logger.info(f"Cannot read sitemap {sitemap}: {type(e).__name__}: {e}")
+
+    async def read(self, url):
+        """
+        Yields ("sitemap", url) for the entries of a sitemap index, and ("url", url) for the pages (and their
+        alternates) of a sitemap. Plain text sitemaps (one URL per line) are accepted as well.
+        """
+        async with self.client.stream("GET", url) as r:
+            r.raise_for_status()
+            parser = ET.XMLPullParser(events=("start", "end"))
+            root = None
+            decompressor = None
+            mode = None
+            text = b""
+            async for chunk in r.aiter_bytes():
+                if decompressor is None:
+                    # Content-Encoding is already undone, this is a .gz file
+                    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32) if chunk[:2] == GZIP_MAGIC else False
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                if mode is None:
+                    if not chunk.strip():
+                        continue
+                    mode = "xml" if chunk.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"<") else "text"
+
+                if mode == "text":
+                    *lines, text = (text + chunk).split(b"\n")
+                    for line in lines:
+                        if line.strip():
+                            yield "url", line.strip().decode("utf-8", "replace")
+                    continue
+
+                parser.feed(chunk)
+                for event, elem in parser.read_events():
+                    if event == "start":
+                        if root is None:
+                            root = elem
+                    elif elem.tag == f"{SITEMAP_NS}loc" and elem.text:
+                        yield ("sitemap" if root.tag == f"{SITEMAP_NS}sitemapindex" else "url"), elem.text.strip()
+                    elif elem.tag == f"{XHTML_NS}link" and elem.get("rel") == "alternate" and elem.get("href"):
+                        yield "url", elem.get("href").strip()
+                    elif elem.tag in (f"{SITEMAP_NS}url", f"{SITEMAP_NS}sitemap"):
+                        # entries are not needed once read
+                        root.clear()
+            if text.strip():
+                yield "url", text.strip().decode("utf-8", "replace")
+            if mode == "xml":
+                parser.close()
+
+    async def close(self):
+        await self.client.aclose()
+
+    def report(self):
+        logger.logger.info(f"Sitemaps: {self.sitemaps} files read ({self.errors} failed), {self.found} URLs found")
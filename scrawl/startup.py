@@ -0,0 +1,97 @@
+import asyncio
+import json
+import os
+import re
+import time
+import weakref
+
+
+STARTUP_FILE = "startup.json"
+# cookie consent dialogs are looked for in this many seed hosts at once
+CONSENT_CONCURRENCY = 8
+CONSENT_TIMEOUT = 5000
+CONSENT_BUTTON = re.compile(r"\bacep|\baccep|\bok\b|\bcontin", re.IGNORECASE)
+# sets the saved localStorage items of the page origin that are not set yet
+LOCAL_STORAGE = """(origins) => {
+    try {
+        for (const [name, value] of origins[location.origin] || []) {
+            if (localStorage.getItem(name) === null) {
+                localStorage.setItem(name, value);
+            }
+        }
+    } catch (e) {}
+}"""
+
+
+class StartupCache:
+    """
+    What scrawl learns about the seed hosts before crawling, kept in the working directory (startup.json) so that
+    other locales and resumed crawls do not redo it: whether a host needs Firefox (Chromium fails with
+    ERR_HTTP2_PROTOCOL_ERROR), which hosts have been checked for a cookie consent dialog, and the resulting
+    Playwright storage state (cookies and localStorage), which apply() adds to every new browser context.
+    """
+    def __init__(self, directory):
+        self.filename = os.path.join(directory, STARTUP_FILE)
+        self.http2_errors = {}
+        self.consent = {}
+        self.cookies = []
+        self.origins = {}
+        self.lock = asyncio.Lock()
+        self.applied = weakref.WeakKeyDictionary()
+        if os.path.exists(self.filename):
+            with open(self.filename, "rt") as fstartup:
+                json_obj = json.load(fstartup)
+            self.http2_errors = json_obj.get("http2_errors", {})
+            self.consent = json_obj.get("consent", {})
+            self.merge_state(json_obj.get("storage_state", {}))
+
+    def http2_error(self, host):
+        """
+        True or False if the probe has already been made for `host`, None otherwise.
+        """
+        return self.http2_errors.get(host)
+
+    def set_http2_error(self, host, found):
+        self.http2_errors[host] = found
+
+    def consent_checked(self, host):
+        return host in self.consent
+
+    def set_consent(self, host, outcome):
+        self.consent[host] = {"outcome": outcome, "time": time.time()}
+
+    def merge_state(self, state):
+        """
+        Adds a Playwright storage_state() to the saved one. Newer cookies and localStorage items replace older ones.
+        """
+        cookies = {(i["name"], i["domain"], i["path"]): i for i in self.cookies}
+        for i in state.get("cookies", []):
+            cookies[(i["name"], i["domain"], i["path"])] = i
+        self.cookies = list(cookies.values())
+        for i in state.get("origins", []):
+            items = dict(self.origins.get(i["origin"], []))
+            items.update((j["name"], j["value"]) for j in i.get("localStorage", []))
+            self.origins[i["origin"]] = list(items.items())
+
+    async def apply(self, context):
+        """
+        Adds the saved cookies to `context`, and the saved localStorage items it does not have yet (as an init script).
+        """
+        if len(self.cookies) > 0:
+            await context.add_cookies(self.cookies)
+        applied = self.applied.setdefault(context, set())
+        origins = {origin: items for origin, items in self.origins.items() if origin not in applied}
+        if len(origins) > 0:
+            await context.add_init_script(f"({LOCAL_STORAGE})({json.dumps(origins)})")
+            applied.update(origins)
+
+    def save(self):
+        json_obj = {"http2_errors": self.http2_errors,
+                    "consent": self.consent,
+                    "storage_state": {"cookies": self.cookies,
+                                      "origins": [{"origin": origin, "localStorage": [{"name": k, "value": v}
+                                                                                      for k, v in items]}
+                                                  for origin, items in self.origins.items()]}}
+        with open(f"{self.filename}.tmp", "wt") as fstartup:
+            json.dump(json_obj, fstartup)
+        os.replace(f"{self.filename}.tmp", self.filename)
@@ -0,0 +1,320 @@
+import glob
+import io
+import json
+import os
+import re
+import time
+
+import zstandard
+
+from scrawl import logger
+
+STORAGES = ("files", "shards")
+SHARD_MAX_BYTES = 1 << 30
+SHARD_NAME = re.compile(r"shard-(\d+)\.jsonl\.zst$")
+DICTIONARY_SIZE = 112640
+# training samples kept in memory, for all the hosts without a dictionary yet
+MAX_PENDING_BYTES = 256 << 20
+MAX_PENDING_HOSTS = 1000
+# a host whose dictionary cannot be trained is retried on twice as many samples, this many times at most
+MAX_TRAINING_ATTEMPTS = 3
+# enough bytes for any zstd frame header
+FRAME_HEADER_SIZE = 18
+
+
+class Compressor:
+    """
+    zstd compression of stored pages. With `samples` > 0, a dictionary is trained per host on its first `samples`
+    pages and used for every later page of the host. Dictionaries are saved as dict-{dict_id}.zdict next to the pages
+    (the frame header tells which one a page needs) and dictionaries.tsv maps hosts to them so that resumed crawls
+    keep using them.
+    Pages are always written at once, with plain zstd until their host has a dictionary: `pending` only holds copies
+    to train on. Those are bounded by MAX_PENDING_BYTES and MAX_PENDING_HOSTS, the samples of the host that started
+    collecting first being dropped when full, so long-tail hosts that never reach `samples` pages do not pile up.
+    """
+    def __init__(self, directory, samples=0):
+        self.directory = directory
+        self.samples = samples
+        self.plain = zstandard.ZstdCompressor()
+        # host -> training samples, in the order hosts started collecting them
+        self.pending = {}
+        self.pending_bytes = 0
+        self.evicted = 0
+        # host -> failed training attempts
+        self.attempts = {}
+        self.compressors = {}
+        # kind -> [pages, raw bytes, compressed bytes, seconds]
+        self.stats = {"plain": [0, 0, 0, 0.0], "dictionary": [0, 0, 0, 0.0]}
+
+        mapping = os.path.join(directory, "dictionaries.tsv")
+        if samples > 0 and os.path.exists(mapping):
+            with open(mapping, "rt") as fmapping:
+                for line in fmapping:
+                    host, dict_id = line.rstrip("\n").split("\t")
+                    self.compressors[host] = self.load(int(dict_id))
+
+    def load(self, dict_id):
+        with open(os.path.join(self.directory, f"dict-{dict_id}.zdict"), "rb") as fdict:
+            return zstandard.ZstdCompressor(dict_data=zstandard.ZstdCompressionDict(fdict.read()))
+
+    def drop(self, host):
+        samples = self.pending.pop(host)
+        self.pending_bytes -= sum(len(i) for i in samples)
+        return samples
+
+    def train(self, host):
+        samples = self.drop(host)
+        try:
+            dictionary = zstandard.train_dictionary(DICTIONARY_SIZE, samples)
+        except zstandard.ZstdError as e:
+            attempts = self.attempts[host] = self.attempts.get(host, 0) + 1
+            if attempts < MAX_TRAINING_ATTEMPTS:
+                logger.logger.warning(f"Cannot train a zstd dictionary for {host} on {len(samples)} pages ({e}), "
+                                      f"retrying on {self.samples_needed(host)} pages")
+            else:
+                logger.logger.warning(f"Cannot train a zstd dictionary for {host} ({e}): using plain zstd for it")
+                self.compressors[host] = None
+            return
+
+        with open(os.path.join(self.directory, f"dict-{dictionary.dict_id()}.zdict"), "wb") as fdict:
+            fdict.write(dictionary.as_bytes())
+        with open(os.path.join(self.directory, "dictionaries.tsv"), "at") as fmapping:
+            fmapping.write(f"{host}\t{dictionary.dict_id()}\n")
+        logger.logger.info(f"Trained zstd dictionary {dictionary.dict_id()} for {host} on {len(samples)} pages")
+        self.compressors[host] = zstandard.ZstdCompressor(dict_data=dictionary)
+
+    def compress(self, data, host=None):
+        cctx = self.compressors.get(host) if host else None
+        start = time.perf_counter()
+        frame = (cctx or self.plain).compress(data)
+        stats = self.stats["dictionary" if cctx else "plain"]
+        stats[0] += 1
+        stats[1] += len(data)
+        stats[2] += len(frame)
+        stats[3] += time.perf_counter() - start
+
+        if self.samples > 0 and host and host not in self.compressors:
+            self.collect(host, data)
+        return frame
+
+    def samples_needed(self, host):
+        return self.samples * 2 ** self.attempts.get(host, 0)
+
+    def collect(self, host, data):
+        self.pending.setdefault(host, []).append(data)
+        self.pending_bytes += len(data)
+        if len(self.pending[host]) >= self.samples_needed(host):
+            self.train(host)
+            return
+        while self.pending_bytes > MAX_PENDING_BYTES or len(self.pending) > MAX_PENDING_HOSTS:
+            oldest = next((i for i in self.pending if i != host), None)
+            if oldest is None:
+                # the samples of this host fill the memory budget on their own: enough to train on
+                self.train(host)
+                return
+            logger.logger.debug(f"Dropping the {len(self.pending[oldest])} training samples of {oldest}")
+            self.drop(oldest)
+            self.evicted += 1
+
+    def report(self):
+        if self.evicted > 0:
+            logger.logger.info(f"zstd dictionaries: training samples of {self.evicted} hosts dropped to bound memory")
+        for kind, (pages, raw, compressed, seconds) in self.stats.items():
+            if pages > 0:
+                logger.logger.info(f"zstd {kind}: {pages} pages, {raw / 2**20:.1f} MiB -> {compressed / 2**20:.1f} MiB "
+                                   f"(ratio {raw / max(compressed, 1):.2f}), {raw / 2**20 / max(seconds, 1e-9):.1f} MiB/s")
+
+
+class Decompressor:
+    """
+    Decodes pages written by Compressor, loading the dictionaries in `directory` as needed.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        self.dctxs = {0: zstandard.ZstdDecompressor()}
+
+    def dctx(self, dict_id):
+        if dict_id not in self.dctxs:
+            with open(os.path.join(self.directory, f"dict-{dict_id}.zdict"), "rb") as fdict:
+                self.dctxs[dict_id] = zstandard.ZstdDecompressor(dict_data=zstandard.ZstdCompressionDict(fdict.read()))
+        return self.dctxs[dict_id]
+
+    def decompress(self, frame):
+        return self.dctx(zstandard.get_frame_parameters(frame).dict_id).decompressobj().decompress(frame)
+
+    def text_reader(self, f, length=None):
+        """
+        Text stream over the page at the current position of the binary file `f` (`length` bytes of it in a shard,
+        where the frames of other pages follow), decompressed as it is read. Closing it leaves `f` open.
+        """
+        start = f.tell()
+        dict_id = zstandard.get_frame_parameters(f.read(FRAME_HEADER_SIZE)).dict_id
+        f.seek(start)
+        source = f if length is None else FrameReader(f, length)
+        reader = self.dctx(dict_id).stream_reader(source, closefd=False)
+        return io.TextIOWrapper(reader, encoding="utf-8", newline="")
+
+
+class FrameReader(io.RawIOBase):
+    """
+    The next `length` bytes of the binary file `f`: a stream reader would read on into the frames that follow.
+    """
+    def __init__(self, f, length):
+        self.f = f
+        self.left = length
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        n = self.f.readinto(memoryview(b)[:self.left])
+        self.left -= n
+        return n
+
+
+class FileStorage:
+    """
+    One zstd-compressed JSON file per page: json/{idx:012d}.json.zst
+    """
+    def __init__(self, directory, compressor=None):
+        self.directory = directory
+        self.compressor = compressor or Compressor(directory)
+
+    def write(self, idx, json_string, host=None):
+        fname = os.path.join(self.directory, f"{idx:012d}.json.zst")
+        with open(fname, "wb") as rfile:
+            rfile.write(self.compressor.compress(json_string.encode("utf-8"), host))
+        return fname
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.compressor.report()
+
+
+class ShardStorage:
+    """
+    Rolling shards json/shard-{n:06d}.jsonl.zst holding up to `max_records` pages or `max_bytes` compressed bytes.
+    Every page is a JSON line compressed as an independent zstd frame, and any page can be read on its own through
+    the json/shard-{n:06d}.idx index (idx, offset and length per line). Without --dictionary-samples a shard is a
+    regular .jsonl.zst file (zstdcat); otherwise the frames of a host with a dictionary only decompress with
+    `zstd -d -D json/dict-{dict_id}.zdict`, and a shard mixing hosts is best read with read_shard().
+    A resumed crawl always starts a new shard.
+    """
+    def __init__(self, directory, max_records=10000, max_bytes=SHARD_MAX_BYTES, compressor=None):
+        self.directory = directory
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.compressor = compressor or Compressor(directory)
+        self.shard = max((shard_number(i) for i in shard_files(directory)), default=0)
+        self.data = None
+        self.index = None
+        self.records = 0
+        self.offset = 0
+
+    def open_next(self):
+        self.close_shard()
+        self.shard += 1
+        fname = os.path.join(self.directory, f"shard-{self.shard:06d}.jsonl.zst")
+        logger.logger.info(f"Opening shard {fname}")
+        self.data = open(fname, "ab")
+        self.index = open(index_filename(fname), "at")
+        self.records = 0
+        self.offset = self.data.tell()
+
+    def write(self, idx, json_string, host=None):
+        if self.data is None or self.records >= self.max_records or self.offset >= self.max_bytes:
+            self.open_next()
+
+        frame = self.compressor.compress(f"{json_string}\n".encode("utf-8"), host)
+        self.data.write(frame)
+        self.index.write(f"{idx}\t{self.offset}\t{len(frame)}\n")
+        location = f"{self.data.name}@{self.offset}"
+        self.offset += len(frame)
+        self.records += 1
+        return location
+
+    def flush(self):
+        if self.data:
+            self.data.flush()
+            self.index.flush()
+
+    def close_shard(self):
+        if self.data:
+            self.data.close()
+            self.index.close()
+            self.data = None
+            self.index = None
+
+    def close(self):
+        self.close_shard()
+        self.compressor.report()
+
+
+def shard_files(directory):
+    return sorted(glob.glob(os.path.join(directory, "shard-*.jsonl.zst")))
+
+
+def shard_number(fname):
+    return int(SHARD_NAME.search(fname).group(1))
+
+
+def index_filename(shard_fname):
+    return shard_fname[:-len(".jsonl.zst")] + ".idx"
+
+
+def read_shard(fname, decompressor=None, min_idx=0):
+    """
+    Yields (idx, JSON object) for every page in a shard with idx above `min_idx`, following its index. Pages written
+    after the last index line (crash in the middle of a write) are ignored.
+    """
+    for idx, _, _, record in shard_records(fname, decompressor, min_idx):
+        yield idx, record
+
+
+def shard_index(fname, min_idx=0):
+    """
+    Yields (idx, offset, length) for every page in a shard with idx above `min_idx`, up to the first one that is not
+    entirely in the shard file (crash in the middle of a write).
+    """
+    size = os.path.getsize(fname)
+    with open(index_filename(fname), "rt") as findex:
+        for line in findex:
+            fields = line.split("\t")
+            if len(fields) != 3 or not line.endswith("\n"):
+                break
+            idx, offset, length = int(fields[0]), int(fields[1]), int(fields[2])
+            if offset + length > size:
+                logger.logger.warning(f"Truncated record {idx} in {fname}")
+                break
+            if idx > min_idx:
+                yield idx, offset, length
+
+
+def shard_records(fname, decompressor=None, min_idx=0):
+    """
+    read_shard() with the location of every page: yields (idx, offset, length, JSON object).
+    """
+    decompressor = decompressor or Decompressor(os.path.dirname(fname))
+    with open(fname, "rb") as fshard:
+        for idx, offset, length in shard_index(fname, min_idx):
+            fshard.seek(offset)
+            try:
+                record = decompressor.decompress(fshard.read(length))
+            except zstandard.ZstdError:
+                logger.logger.warning(f"Truncated record {idx} in {fname}")
+                break
+            yield idx, offset, length, json.loads(record)
+
+
+def read_record(fname, offset=None, length=None, decompressor=None):
+    """
+    Reads one stored page: a .json.zst file, or the record of a shard at `offset`.
+    """
+    decompressor = decompressor or Decompressor(os.path.dirname(fname))
+    with open(fname, "rb") as f:
+        if offset is None:
+            return json.loads(decompressor.decompress(f.read()))
+        f.seek(offset)
+        return json.loads(decompressor.decompress(f.read(length)))
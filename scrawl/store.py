@@ -0,0 +1,170 @@
+import os
+import random
+import sqlite3
+
+from scrawl import logger
+
+
+class Store:
+    """
+    SQLite database in the working directory holding the crawler collections that grow with the size of the crawl
+    (frontier, visited URLs and hashes), so that crawler memory stays flat and resuming does not load them.
+    Changes are committed by commit(), which the crawler calls every time it persists its state.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.db = sqlite3.connect(filename)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS sets (name TEXT, item TEXT, PRIMARY KEY (name, item)) "
+                        "WITHOUT ROWID")
+        self.db.execute("CREATE TABLE IF NOT EXISTS frontier (lang TEXT, url TEXT, priority REAL, rnd INTEGER, "
+                        "PRIMARY KEY (lang, url)) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS frontier_rnd ON frontier (lang, rnd)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS frontier_priority ON frontier (lang, priority)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS inflight (lang TEXT, url TEXT, priority REAL, "
+                        "PRIMARY KEY (lang, url)) WITHOUT ROWID")
+        self.db.commit()
+        logger.logger.info(f"Using disk store {filename}")
+
+    def set(self, name, items=()):
+        s = DiskSet(self, name)
+        s.update(items)
+        return s
+
+    def frontier(self, lang, visited, urls=()):
+        f = DiskFrontier(self, lang, visited)
+        for i in urls:
+            f.add(i)
+        return f
+
+    def commit(self):
+        self.db.commit()
+
+    def close(self):
+        self.db.commit()
+        self.db.close()
+
+    def remove(self):
+        self.close()
+        for i in ("", "-wal", "-shm"):
+            if os.path.exists(self.filename + i):
+                os.unlink(self.filename + i)
+
+
+class DiskSet:
+    """
+    Set of strings stored in Store, with the subset of the set interface used by the crawler.
+    """
+    def __init__(self, store, name):
+        self.db = store.db
+        self.name = name
+        self.size = self.db.execute("SELECT COUNT(*) FROM sets WHERE name = ?", (name,)).fetchone()[0]
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, item):
+        return self.db.execute("SELECT 1 FROM sets WHERE name = ? AND item = ?", (self.name, item)).fetchone() \
+            is not None
+
+    def __iter__(self):
+        return (i for i, in self.db.execute("SELECT item FROM sets WHERE name = ?", (self.name,)))
+
+    def add(self, item):
+        self.size += self.db.execute("INSERT OR IGNORE INTO sets VALUES (?, ?)", (self.name, item)).rowcount
+
+    def update(self, items):
+        for i in items:
+            self.add(i)
+
+    def discard(self, item):
+        self.size -= self.db.execute("DELETE FROM sets WHERE name = ? AND item = ?", (self.name, item)).rowcount
+
+
+class DiskFrontier:
+    """
+    Store-backed equivalent of crawler.Frontier. Every URL gets a random key on insertion, so pop_random() is an
+    index lookup instead of a scan. Popped URLs are kept in the inflight table until done() or requeue(), and the
+    ones left there by an interrupted crawl are queued again when the store is reopened.
+    """
+    def __init__(self, store, lang, visited):
+        self.db = store.db
+        self.lang = lang
+        self.visited = visited
+        self.size = self.db.execute("SELECT COUNT(*) FROM frontier WHERE lang = ?", (lang,)).fetchone()[0]
+        self.inflight = set()
+        for url, priority in self.db.execute("SELECT url, priority FROM inflight WHERE lang = ?", (lang,)).fetchall():
+            self.db.execute("DELETE FROM inflight WHERE lang = ? AND url = ?", (lang, url))
+            self.add(url, priority)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, url):
+        return self.db.execute("SELECT 1 FROM frontier WHERE lang = ? AND url = ?", (self.lang, url)).fetchone() \
+            is not None
+
+    def __iter__(self):
+        return (i for i, in self.db.execute("SELECT url FROM frontier WHERE lang = ?", (self.lang,)).fetchall())
+
+    def add(self, url, priority=None):
+        if url in self.visited or url in self.inflight:
+            return False
+        added = self.db.execute("INSERT OR IGNORE INTO frontier VALUES (?, ?, ?, ?)",
+                                (self.lang, url, priority, random.getrandbits(62))).rowcount
+        self.size += added
+        return added == 1
+
+    def promote(self, url, priority):
+        return self.db.execute("UPDATE frontier SET priority = ? WHERE lang = ? AND url = ? AND "
+                               "(priority IS NULL OR priority < ?)", (priority, self.lang, url, priority)).rowcount == 1
+
+    def discard(self, url):
+        self.size -= self.db.execute("DELETE FROM frontier WHERE lang = ? AND url = ?", (self.lang, url)).rowcount
+
+    def take(self, url, priority):
+        """
+        Moves a popped URL from the frontier to the inflight table, returns False if it has been visited.
+        """
+        self.discard(url)
+        if url in self.visited:
+            return False
+        self.db.execute("INSERT OR REPLACE INTO inflight VALUES (?, ?, ?)", (self.lang, url, priority))
+        self.inflight.add(url)
+        return True
+
+    def pop_random(self):
+        while self.size > 0:
+            row = self.db.execute("SELECT url, priority FROM frontier WHERE lang = ? AND rnd >= ? ORDER BY rnd "
+                                  "LIMIT 1", (self.lang, random.getrandbits(62))).fetchone()
+            if row is None:
+                row = self.db.execute("SELECT url, priority FROM frontier WHERE lang = ? ORDER BY rnd LIMIT 1",
+                                      (self.lang,)).fetchone()
+            if self.take(*row):
+                return row[0]
+        return None
+
+    def pop_best(self):
+        while True:
+            row = self.db.execute("SELECT url, priority FROM frontier WHERE lang = ? AND priority IS NOT NULL "
+                                  "ORDER BY priority DESC LIMIT 1", (self.lang,)).fetchone()
+            if row is None:
+                return self.pop_random()
+            if self.take(*row):
+                return row[0]
+
+    def done(self, url):
+        if url not in self.inflight:
+            return False
+        self.inflight.discard(url)
+        self.db.execute("DELETE FROM inflight WHERE lang = ? AND url = ?", (self.lang, url))
+        return True
+
+    def requeue(self, url):
+        if url not in self.inflight:
+            return
+        priority, = self.db.execute("SELECT priority FROM inflight WHERE lang = ? AND url = ?",
+                                    (self.lang, url)).fetchone()
+        self.done(url)
+        self.add(url, priority)
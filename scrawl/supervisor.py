@@ -0,0 +1,150 @@
+import asyncio
+import collections
+import os
+
+from scrawl import logger
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+# the memory of the browser is measured every this many pages (a scan of /proc)
+CHECK_EVERY = 25
+
+
+def process_tree_rss(marker):
+    """
+    Sum of the resident memory, in bytes, of the processes whose command line contains `marker` (the user data
+    directory of a browser) and of all their descendants (renderers, GPU process...). None without /proc.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    marker = os.fsencode(marker)
+    children = collections.defaultdict(list)
+    roots = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as fstat:
+                stat = fstat.read()
+            with open(f"/proc/{entry}/cmdline", "rb") as fcmdline:
+                cmdline = fcmdline.read()
+        except OSError:
+            continue
+        # pid (comm) state ppid ...
+        children[int(stat[stat.rindex(b")") + 2:].split()[1])].append(int(entry))
+        if marker in cmdline:
+            roots.append(int(entry))
+
+    tree = set()
+    while roots:
+        pid = roots.pop()
+        if pid not in tree:
+            tree.add(pid)
+            roots.extend(children[pid])
+
+    rss = 0
+    for pid in tree:
+        try:
+            with open(f"/proc/{pid}/statm", "rt") as fstatm:
+                rss += int(fstatm.read().split()[1]) * PAGE_SIZE
+        except OSError:
+            continue
+    return rss
+
+
+class BrowserSupervisor:
+    """
+    Owns the persistent context of a locale and relaunches it once it has opened `max_pages` pages or its process tree
+    uses more than `max_rss` bytes (0 disables either check). The new context uses the same user data directory, so
+    cookies and local storage (cookie consent included) carry over. Can be used as the context: new_page() waits
+    while a relaunch is pending, and recycle_if_due() only relaunches once every page in flight has been closed.
+    """
+    def __init__(self, browser_type, user_data_dir, launch_options, on_launch, max_pages=0, max_rss=0, label=""):
+        self.browser_type = browser_type
+        self.user_data_dir = user_data_dir
+        self.launch_options = launch_options
+        self.on_launch = on_launch
+        self.max_pages = max_pages
+        self.max_rss = max_rss
+        self.label = label
+        self.context = None
+        self.pages = 0
+        self.last_check = 0
+        self.recycles = 0
+        self.rss = None
+        self.active = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.ready = asyncio.Event()
+        self.ready.set()
+
+    async def launch(self):
+        self.context = await self.browser_type.launch_persistent_context(self.user_data_dir, **self.launch_options)
+        await self.on_launch(self.context)
+        self.pages = 0
+        self.last_check = 0
+
+    async def new_page(self):
+        while not self.ready.is_set():
+            await self.ready.wait()
+        self.active += 1
+        self.idle.clear()
+        self.pages += 1
+        try:
+            page = await self.context.new_page()
+        except Exception:
+            self.closed()
+            raise
+        page.on("close", lambda _: self.closed())
+        return page
+
+    def closed(self):
+        self.active -= 1
+        if self.active == 0:
+            self.idle.set()
+
+    def due(self):
+        """
+        Returns why the context has to be relaunched, None if it does not.
+        """
+        if self.max_pages > 0 and self.pages >= self.max_pages:
+            return f"{self.pages} pages"
+        if self.max_rss > 0 and self.pages - self.last_check >= CHECK_EVERY:
+            self.last_check = self.pages
+            self.rss = process_tree_rss(self.user_data_dir)
+            if self.rss is not None and self.rss > self.max_rss:
+                return f"{self.rss / 2**20:.0f} MiB"
+        return None
+
+    async def recycle_if_due(self):
+        """
+        Relaunches the context if due(). Must not be called while holding a page open.
+        """
+        if not self.ready.is_set():
+            await self.ready.wait()
+            return
+        reason = self.due()
+        if reason is None:
+            return
+
+        self.ready.clear()
+        try:
+            await self.idle.wait()
+            before = process_tree_rss(self.user_data_dir)
+            await self.context.close()
+            await self.launch()
+            self.recycles += 1
+            after = self.rss = process_tree_rss(self.user_data_dir)
+            if before is not None:
+                logger.logger.info(f"[{self.label}] Browser recycled ({reason}): {before / 2**20:.0f} MiB before, "
+                                   f"{after / 2**20:.0f} MiB after")
+            else:
+                logger.logger.info(f"[{self.label}] Browser recycled ({reason})")
+        finally:
+            self.ready.set()
+
+    async def close(self):
+        if self.context:
+            await self.context.close()
+            self.context = None
+        if self.recycles > 0:
+            logger.logger.info(f"[{self.label}] Browser recycled {self.recycles} times")
@@ -1,19 +1,47 @@
 import errno
+import functools
 import os
 import sys
 import re
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, urlsplit
 from bs4 import BeautifulSoup
 from babel import Locale
 from tld import get_tld
 import time
-from scrawl import logger
+from scrawl import logger, metrics
 
 ERROR_INVALID_NAME = 123
-FORBIDDEN_DOCUMENTS = (r"(.| )+\.(pdf|pptx?|xlsx?|docx?|ods|odt|odf|odp|css|rss|js|jpeg|jpg|gif|webm|webp|tiff|ps|gz|png|"
-                       r"mp3|mp4|ogg|wav|aif|cda|mid|midi|wma|wpl|7z|arj|zip|gz|gzip|tar|rar|pkg|deb|rpm|z|bin|dmg|"
-                       r"iso|toast|vcd|csv|dat|db|dbf|sql|sav|mdb|ttf|otf|fon|fnt|ai|bmp|ico|psd|scr|svg|tif|key|3g2|"
-                       r"3gp|mkv|avi|flv|h264|m4v|mov|mpg|mpeg|rm|swf|vob|wmv|rtf|wpd|wsdl|xsd)$")
+FORBIDDEN_EXTENSIONS = frozenset(
+    "pdf ppt pptx xls xlsx doc docx ods odt odf odp css rss js jpeg jpg gif webm webp tiff ps gz png "
+    "mp3 mp4 ogg wav aif cda mid midi wma wpl 7z arj zip gzip tar rar pkg deb rpm z bin dmg "
+    "iso toast vcd csv dat db dbf sql sav mdb ttf otf fon fnt ai bmp ico psd scr svg tif key 3g2 "
+    "3gp mkv avi flv h264 m4v mov mpg mpeg rm swf vob wmv rtf wpd wsdl xsd".split())
+MULTIPLE_SLASHES = re.compile(r"/+")
+# Evaluated in the page: same HTML as page.content(), same text as page.text_content("body"), absolute URLs of
+# <a href> and <link rel=alternate href> (with their hreflang). URLs are resolved from the href attribute, since the
+# href property of SVG <a> elements is not a string, and the ones that do not parse are left out.
+PAGE_SNAPSHOT = """() => {
+    const resolve = (element) => {
+        try {
+            return new URL(element.getAttribute("href"), document.baseURI).href;
+        } catch (e) {
+            return null;
+        }
+    };
+    let html = document.doctype ? new XMLSerializer().serializeToString(document.doctype) : "";
+    if (document.documentElement) {
+        html += document.documentElement.outerHTML;
+    }
+    return {
+        html: html,
+        text: document.body ? document.body.textContent : "",
+        lang: document.documentElement ? document.documentElement.lang : "",
+        links: Array.from(document.querySelectorAll("a[href]"), resolve).filter(i => i !== null),
+        alternates: Array.from(document.querySelectorAll("link[rel~=alternate][href]"),
+                               l => ({href: resolve(l), hreflang: l.getAttribute("hreflang") || ""}))
+                         .filter(i => i.href !== null)
+    };
+}"""
 
 def is_pathname_valid(pathname: str) -> bool:
     """
@@ -68,71 +96,165 @@ def is_path_exists_or_creatable(pathname: str) -> bool:
         return False
 
 
-def is_valid_host(valid_hosts, url2, patterns):
+def get_domain(url):
+    """
+    Domain of `url` as compared by is_valid_host (`example` for https://www.example.co.uk/), None if it has none.
+    """
     try:
-        if re.match(r"^mailto:", url2):
-            return False
-        valid_domains = {get_tld(i, as_object=True, fix_protocol=True).domain for i in valid_hosts}
-        url2_domain = get_tld(url2, as_object=True, fix_protocol=True).domain
+        return get_tld(url, as_object=True, fix_protocol=True).domain
+    except Exception:
+        return None
+
+
+def get_host_domain(host):
+    """
+    Domain of a URL host (netloc). Hosts without a registrable domain (localhost, IP addresses) are their own domain.
+    """
+    return get_domain(f"http://{host}") or urlsplit(f"http://{host}").hostname
 
-    except:
-        return False
 
-    return url2_domain in valid_domains and any(i in url2 for i in patterns)
+class HostMatcher:
+    """
+    Precomputed is_valid_host: the domains of `valid_hosts` are computed once, the domain of every URL host goes
+    through a bounded LRU cache and mailto:, javascript:, tel: and data: links are rejected without parsing.
+    """
+    REJECTED_SCHEMES = ("mailto:", "javascript:", "tel:", "data:")
+
+    def __init__(self, valid_hosts, cache_size=65536):
+        self.valid_hosts = set(valid_hosts)
+        self.valid_domains = {get_host_domain(i) for i in self.valid_hosts} - {None}
+        self.host_domain = functools.lru_cache(maxsize=cache_size)(get_host_domain)
+
+    def url_domain(self, url):
+        if url[:11].lower().startswith(self.REJECTED_SCHEMES):
+            return None
+        try:
+            host = urlsplit(url).netloc.lower()
+            return self.host_domain(host) if host else get_domain(url)
+        except ValueError:
+            return None
+
+    def is_valid(self, url, patterns):
+        return self.url_domain(url) in self.valid_domains and any(i in url for i in patterns)
+
+
+def is_valid_host(valid_hosts, url2, patterns):
+    """
+    `valid_hosts` can be a set of hosts or, better, a HostMatcher built once for them.
+    """
+    if not isinstance(valid_hosts, HostMatcher):
+        valid_hosts = HostMatcher(valid_hosts, cache_size=0)
+    return valid_hosts.is_valid(url2, patterns)
     # return urlparse(url2).netloc.replace("www.", "") in valid_hosts and any(i in url2 for i in patterns)
 
 def sanitize_url(url):
-    o = urlparse(url)
-    path = re.sub(r"[/]+", "/", o.path)
+    return sanitize_parsed_url(urlparse(url))
+
+
+def sanitize_parsed_url(o):
+    path = MULTIPLE_SLASHES.sub("/", o.path)
     query = ""
     if o.query != "":
         query = f"?{o.query}"
 
-    return f"{o.scheme}://{o.netloc}{path}{query}".split("#")[0]
+    return f"{o.scheme}://{o.netloc}{path}{query}"
 
 
-def filter_urls(urls, links, valid_hosts, patterns):
-    global FORBIDDEN_DOCUMENTS
-    links_filtered = [sanitize_url(n) for n in (urls + links) if is_valid_host(valid_hosts, n, patterns)]
+class UrlFilter:
+    """
+    Single pass link filter: each link is parsed once, normalised as in sanitize_url and checked against the rules
+    in order: scheme, host (valid_hosts), patterns, excluded strings and forbidden file extension. `hits` counts the
+    links stopped by each rule, and the accepted ones.
+    """
+    RULES = ("scheme", "host", "pattern", "excluded", "extension", "accepted")
 
-    l2 = []
-    for i in links_filtered:
-        if re.match(FORBIDDEN_DOCUMENTS, i, re.IGNORECASE|re.DOTALL):
-            logger.logger.info(f"Unsupported filetype of URL: {i}")
-            l2.append(i)
+    def __init__(self, valid_hosts, patterns, forbidden_extensions=FORBIDDEN_EXTENSIONS, excluded=()):
+        self.host_matcher = valid_hosts if isinstance(valid_hosts, HostMatcher) else HostMatcher(valid_hosts)
+        self.patterns = list(patterns)
+        self.forbidden_extensions = frozenset(i.strip().lstrip(".").lower() for i in forbidden_extensions)
+        self.excluded = list(excluded)
+        self.hits = dict.fromkeys(self.RULES, 0)
 
-    links_filtered2 = [i.split("#")[0] for i in links_filtered if not re.match(FORBIDDEN_DOCUMENTS, i, re.IGNORECASE|re.DOTALL)]
+    def verdict(self, url):
+        """
+        Returns the normalised URL and the rule that stops it, or "accepted". Anything but a string is stopped by the
+        scheme rule.
+        """
+        if not isinstance(url, str) or url[:11].lower().startswith(HostMatcher.REJECTED_SCHEMES):
+            return url, "scheme"
+        try:
+            o = urlparse(url)
+            domain = self.host_matcher.host_domain(o.netloc.lower()) if o.netloc else get_domain(url)
+        except ValueError:
+            return url, "host"
+        if domain not in self.host_matcher.valid_domains:
+            return url, "host"
+        if not any(i in url for i in self.patterns):
+            return url, "pattern"
 
-    return list(set(links_filtered2)), l2
+        normalised = sanitize_parsed_url(o)
+        if any(i in normalised for i in self.excluded):
+            return normalised, "excluded"
+        dot = normalised.rfind(".")
+        if dot > 0 and normalised[dot + 1:].lower() in self.forbidden_extensions:
+            return normalised, "extension"
+        return normalised, "accepted"
 
+    def filter(self, urls):
+        """
+        Returns the unique accepted URLs and the URLs of forbidden file types (to be marked as visited).
+        """
+        accepted = set()
+        discarded = []
+        with metrics.registry.timer("filter_links"):
+            for url in urls:
+                normalised, rule = self.verdict(url)
+                self.hits[rule] += 1
+                if rule == "accepted":
+                    accepted.add(normalised)
+                elif rule == "extension":
+                    discarded.append(normalised)
+        return list(accepted), discarded
 
-def retrieve_more_links(valid_hosts, url, page_content, patterns):
-    global FORBIDDEN_DOCUMENTS
-    links = []
+    def report(self):
+        logger.logger.info("Link filter: " + ", ".join(f"{i}={self.hits[i]}" for i in self.RULES))
 
-    soup = BeautifulSoup(page_content, "lxml")
-    for i in soup.find_all("link"):
-        if "href" in i.attrs and "rel" in i.attrs and "alternate" in i["rel"] and is_valid_host(valid_hosts, i["href"],
-                                                                                                patterns):
-            links.append(sanitize_url(i["href"]))
-    for i in soup.find_all("a"):
-        if "href" in i.attrs:
-            u = urljoin(url, i["href"])
-            if is_valid_host(valid_hosts, u, patterns):
-                links.append(sanitize_url(u))
 
-    links = list(set(links))
+def filter_urls(urls, links, valid_hosts, patterns):
+    """
+    `valid_hosts` can be a set of hosts, a HostMatcher or a UrlFilter (which brings its own patterns).
+    """
+    url_filter = valid_hosts if isinstance(valid_hosts, UrlFilter) else UrlFilter(valid_hosts, patterns)
+    return url_filter.filter(urls + links)
+
 
-    links2 = []
-    for i in links:
-        if re.match(FORBIDDEN_DOCUMENTS, i, re.IGNORECASE|re.DOTALL):
-            logger.logger.info(f"Unsupported filetype of URL: {i}")
-            links2.append(i)
+def retrieve_more_links(valid_hosts, url, page_content, patterns):
+    """
+    Same as filter_urls, for links that still have to be extracted from HTML (pages not snapshotted in a browser).
+    """
+    soup = BeautifulSoup(page_content, "lxml")
+    alternates = [i["href"] for i in soup.find_all("link")
+                  if "href" in i.attrs and "rel" in i.attrs and "alternate" in i["rel"]]
+    links = [urljoin(url, i["href"]) for i in soup.find_all("a") if "href" in i.attrs]
 
+    return filter_urls(alternates, links, valid_hosts, patterns)
 
-    links = [i.split("#")[0] for i in links if not re.match(FORBIDDEN_DOCUMENTS, i, re.IGNORECASE|re.DOTALL)]
 
-    return links, links2
+def html_snapshot(url, page_content, soup=None):
+    """
+    PAGE_SNAPSHOT for HTML that has not been loaded in a browser: same keys, links resolved against `url` (or the
+    document's <base href>). `soup` is `page_content` already parsed, if available.
+    """
+    with metrics.registry.timer("parse_html"):
+        soup = soup or BeautifulSoup(page_content, "lxml")
+        base = soup.find("base", href=True)
+        base_url = urljoin(url, base["href"]) if base else url
+        return {"html": page_content,
+                "text": soup.body.get_text() if soup.body else "",
+                "lang": soup.html.get("lang", "") if soup.html else "",
+                "links": [urljoin(base_url, i["href"]) for i in soup.find_all("a", href=True)],
+                "alternates": [{"href": urljoin(base_url, i["href"]), "hreflang": i.get("hreflang", "")}
+                               for i in soup.find_all("link", href=True) if "alternate" in i.get("rel", [])]}
 
 
 def scroll_down(page, scrolls):